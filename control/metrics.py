@@ -0,0 +1,176 @@
+import logging
+import socket
+import time
+from collections import OrderedDict
+from threading import Lock, Timer
+
+from celery.exceptions import SoftTimeLimitExceeded
+from celery.signals import worker_process_init, worker_process_shutdown, \
+    worker_shutdown
+from django.conf import settings
+from django.utils.module_loading import import_by_path
+
+from control import senders
+
+logger = logging.getLogger(__name__)
+
+
+class VumiBackend(object):
+    '''Fires metrics to the Vumi Go HTTP API, through `sender` if one is
+    given and the default conversation's sender if not.'''
+
+    def fire(self, metric, value, agg, sender=None):
+        (sender or senders.get_sender()).fire_metric(metric, value, agg=agg)
+
+
+class StatsdBackend(object):
+    '''Sends metrics over UDP in the statsd format to METRICS_STATSD_HOST
+    and METRICS_STATSD_PORT. Sums are sent as counters and everything else
+    as gauges.'''
+
+    def __init__(self):
+        self.address = (settings.METRICS_STATSD_HOST,
+                        settings.METRICS_STATSD_PORT)
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def fire(self, metric, value, agg, sender=None):
+        self.socket.sendto(
+            "%s:%s|%s" % (metric, value, "c" if agg == "sum" else "g"),
+            self.address)
+
+
+class FileBackend(object):
+    '''Appends a "time metric agg value" line per metric to METRICS_FILE.'''
+
+    def __init__(self):
+        self.path = settings.METRICS_FILE
+        self._lock = Lock()
+
+    def fire(self, metric, value, agg, sender=None):
+        line = "%f %s %s %s\n" % (time.time(), metric, agg, value)
+        with self._lock:
+            with open(self.path, "a") as metrics_file:
+                metrics_file.write(line)
+
+
+class MemoryBackend(object):
+    '''Keeps the (metric, value, agg) fired in a list, for tests and
+    benchmarks.'''
+
+    def __init__(self):
+        self.fired = []
+
+    def fire(self, metric, value, agg, sender=None):
+        self.fired.append((metric, value, agg))
+
+
+_lock = Lock()
+_backends = {}
+
+
+def get_backend():
+    '''Returns this process's instance of the METRICS_BACKEND class.'''
+    path = settings.METRICS_BACKEND
+    backend = _backends.get(path)
+    if backend is None:
+        with _lock:
+            backend = _backends.setdefault(path, import_by_path(path)())
+    return backend
+
+
+class MetricsAggregator(object):
+    '''Collects the metrics fired in this process and fires each one once
+    per METRICS_FLUSH_INTERVAL seconds rather than once per firing. Sums are
+    added up, avg is averaged, max and min keep the largest and smallest
+    and last keeps the newest value. An interval of 0 sends every metric
+    as it is fired.'''
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.pending = OrderedDict()
+        self.timer = None
+        self._lock = Lock()
+
+    def add(self, metric, value, agg, sender=None):
+        self.add_many([(metric, value)], agg, sender)
+
+    def add_many(self, metrics, agg, sender=None):
+        '''Adds (metric, value) pairs together, so they all go out in the
+        same flush.'''
+        with self._lock:
+            for metric, value in metrics:
+                key = (metric, agg, sender)
+                current = self.pending.get(key)
+                if current is None:
+                    self.pending[key] = (value, 1)
+                elif agg == "sum":
+                    self.pending[key] = (current[0] + value, 1)
+                elif agg == "avg":
+                    self.pending[key] = (current[0] + value, current[1] + 1)
+                elif agg == "max":
+                    self.pending[key] = (max(current[0], value), 1)
+                elif agg == "min":
+                    self.pending[key] = (min(current[0], value), 1)
+                else:
+                    self.pending[key] = (value, 1)
+            interval = settings.METRICS_FLUSH_INTERVAL
+            if interval and self.timer is None:
+                self.timer = Timer(interval, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+        if not interval:
+            self.flush()
+
+    def flush(self):
+        '''Sends everything collected so far. Returns how many metrics were
+        sent.'''
+        with self._lock:
+            pending, self.pending = self.pending, OrderedDict()
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+        for (metric, agg, sender), (value, count) in pending.items():
+            if agg == "avg":
+                value = value / float(count)
+            try:
+                get_backend().fire(metric, value, agg, sender)
+            except SoftTimeLimitExceeded:
+                raise
+            except Exception:
+                logger.error('Error firing metric %s' % metric,
+                             exc_info=True)
+        return len(pending)
+
+    def clear(self):
+        with self._lock:
+            self.pending = OrderedDict()
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+
+
+aggregator = MetricsAggregator()
+
+
+def fire_metric(metric, value, agg, sender=None):
+    '''Fires a metric to the metrics backend with this process's next
+    batch.'''
+    aggregator.add(metric, value, agg, sender)
+
+
+def fire_metrics(metrics, agg, sender=None):
+    '''Fires (metric, value) pairs to the metrics backend as one batch.'''
+    aggregator.add_many(metrics, agg, sender)
+
+
+@worker_process_shutdown.connect
+@worker_shutdown.connect
+def flush_metrics(**kwargs):
+    '''Don't lose what has been collected when a worker stops.'''
+    aggregator.flush()
+
+
+@worker_process_init.connect
+def reset_metrics(**kwargs):
+    '''Forked worker processes start without their parent's metrics.'''
+    aggregator.clear()
@@ -0,0 +1,56 @@
+from threading import Lock
+
+import requests
+from requests.adapters import HTTPAdapter
+from celery.signals import worker_process_init
+from django.conf import settings
+from go_http.send import HttpApiSender
+
+
+_lock = Lock()
+_session = None
+_senders = {}
+
+
+def get_session():
+    '''Returns this process's keep-alive HTTP session for Vumi Go.'''
+    global _session
+    with _lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=settings.VUMI_GO_HTTP_POOL_SIZE,
+                pool_maxsize=settings.VUMI_GO_HTTP_POOL_SIZE)
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+        return _session
+
+
+def get_sender(conversation_key=None):
+    '''Returns this process's HttpApiSender for a conversation, creating it
+    on first use. Defaults to the VUMI_GO_CONVERSATION_KEY conversation.
+    All senders share one session so connections are reused between
+    messages and metrics.'''
+    if conversation_key is None:
+        conversation_key = settings.VUMI_GO_CONVERSATION_KEY
+    sender = _senders.get(conversation_key)
+    if sender is None:
+        session = get_session()
+        with _lock:
+            sender = _senders.get(conversation_key)
+            if sender is None:
+                sender = _senders[conversation_key] = HttpApiSender(
+                    account_key=settings.VUMI_GO_ACCOUNT_KEY,
+                    conversation_key=conversation_key,
+                    conversation_token=settings.VUMI_GO_ACCOUNT_TOKEN,
+                    session=session)
+    return sender
+
+
+@worker_process_init.connect
+def reset_senders(**kwargs):
+    '''Forked worker processes must not share their parent's sockets.'''
+    global _session
+    with _lock:
+        _session = None
+        _senders.clear()
@@ -261,6 +261,9 @@ CELERY_ROUTES = {
     'subscription.tasks.fire_metrics_all_time_langs': {
         'queue': 'priority',
     },
+    'subscription.tasks.fire_metrics_subscriptions': {
+        'queue': 'priority',
+    },
     'subscription.tasks.vumi_fire_metric': {
         'queue': 'priority',
     },
@@ -306,6 +309,18 @@ CELERY_ROUTES = {
     'subsend.tasks.processes_message': {
         'queue': 'lowpriority',
     },
+    'subsend.tasks.send_message_batch': {
+        'queue': 'lowpriority',
+    },
+    'subsend.tasks.drain_message_queue': {
+        'queue': 'lowpriority',
+    },
+    'subsend.tasks.reap_stuck_subscriptions': {
+        'queue': 'mediumpriority',
+    },
+    'subsend.tasks.plan_sends': {
+        'queue': 'highmemory',
+    },
     'registration.tasks.jembi_post_json': {
         'queue': 'priority',
     },
@@ -378,6 +393,25 @@ VUMI_GO_CONVERSATION_KEY = "replaceme"
 VUMI_GO_ACCOUNT_TOKEN = "replaceme"
 VUMI_GO_METRICS_PREFIX = "prd"
 VUMI_GO_API_TOKEN = "replaceme"
+# Metrics fired in each process are added up and sent to Vumi Go at most
+# once per metric every this many seconds, and when the worker stops
+METRICS_FLUSH_INTERVAL = 10
+# Where metrics go: control.metrics.VumiBackend, StatsdBackend (UDP to
+# METRICS_STATSD_HOST:METRICS_STATSD_PORT), FileBackend (appended to
+# METRICS_FILE) or MemoryBackend
+METRICS_BACKEND = "control.metrics.VumiBackend"
+METRICS_STATSD_HOST = "localhost"
+METRICS_STATSD_PORT = 8125
+METRICS_FILE = abspath('metrics.log')
+# Keep-alive connections each worker process holds open to Vumi Go
+VUMI_GO_HTTP_POOL_SIZE = 10
+# Outbound messages per second allowed per Vumi conversation key, shared by
+# all workers through Redis. Conversations not listed use the default, and
+# None means no limit. BURST is how many seconds of sends may go at once.
+VUMI_GO_RATE_LIMITS = {}
+VUMI_GO_DEFAULT_RATE_LIMIT = None
+VUMI_GO_RATE_LIMIT_BURST = 1
+VUMI_GO_RATE_LIMIT_REDIS_URL = 'redis://localhost:6379/1'
 
 SITE_DOMAIN_URL = "https://momconnect.co.za"
 
@@ -423,6 +457,59 @@ LANG_GROUP_KEYS = {
 
 METRIC_ENV = "prd"
 
+# Number of due subscriptions process_message_queue claims per statement
+SUBSEND_CLAIM_CHUNK_SIZE = 5000
+# Number of subscriptions handed to each send_message_batch task
+SUBSEND_BATCH_SIZE = 250
+# Seconds a single send may take. A batch task gets long enough to make
+# every send at this pace and at the slowest rate limit before its soft time
+# limit, and then SUBSEND_BATCH_TIME_MARGIN more seconds to release what it
+# did not send before it is killed.
+SUBSEND_BATCH_SEND_TIME = 1
+SUBSEND_BATCH_TIME_MARGIN = 60
+# How many messages a batch task sends at the same time, each on its own
+# thread. Keep it at or below VUMI_GO_HTTP_POOL_SIZE so every thread gets a
+# kept-alive connection.
+SUBSEND_SEND_CONCURRENCY = 1
+# Schedules with a SendWindow have their sends grouped into slots this many
+# seconds long, each claimed and sent at the start of its slot
+SUBSEND_WINDOW_SLOT_SIZE = 300
+# Send windows are capped at this many minutes so a window is over well
+# before its schedule runs again
+SUBSEND_MAX_WINDOW_MINUTES = 6 * 60
+# Write every send attempt to the subsend_sendledgerentry table
+SUBSEND_LEDGER_ENABLED = True
+# A batch writes its ledger rows after every this many sends, so if its
+# worker dies the reaper can see which messages already went out
+SUBSEND_LEDGER_CHUNK_SIZE = 50
+# A batch that has not started this many seconds after it was handed out is
+# dropped by the worker that gets it, so it can never send to subscriptions
+# that have been recovered in the meantime
+SUBSEND_BATCH_EXPIRES = 3600
+# Subscriptions whose batch has not been seen for longer than this many
+# seconds are recovered by subsend.tasks.reap_stuck_subscriptions, which
+# also starts new drainers for subscriptions Queued for that long. Keep it
+# above SUBSEND_BATCH_EXPIRES plus the longest batch or drainer time limit
+# so only batches that can no longer run are reaped.
+SUBSEND_STUCK_AFTER = 7200
+# New subscriptions work out their position in the message set from their
+# schedule and start time instead of incrementing next_sequence_number
+SUBSCRIPTION_COMPUTED_SEQUENCES = False
+# How often, in seconds, each worker reloads the numbers that have opted out
+SUBSCRIPTION_OPTOUT_REFRESH = 300
+# "push" has process_message_queue claim and hand out every batch itself.
+# "pull" only queues the due subscriptions and starts SUBSEND_DRAIN_TASKS
+# drain_message_queue tasks, which claim SUBSEND_DRAIN_BATCH_SIZE rows at
+# a time with SKIP LOCKED. More drainers can be started on any worker.
+SUBSEND_QUEUE_MODE = "push"
+SUBSEND_DRAIN_TASKS = 4
+SUBSEND_DRAIN_BATCH_SIZE = 100
+SUBSEND_DRAIN_TIME_LIMIT = 600
+# Worker-local cache of message content, entries expire after TTL seconds
+# so edits made in other processes are picked up
+SUBSEND_MESSAGE_CACHE_SIZE = 10000
+SUBSEND_MESSAGE_CACHE_TTL = 300
+
 try:
     from local_settings import *  # flake8: noqa
 except ImportError:
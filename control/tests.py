@@ -0,0 +1,170 @@
+""" Tests for shared control helpers. """
+
+import logging
+import os
+import socket
+import tempfile
+
+from django.test import TestCase
+from django.test.utils import override_settings
+from go_http.send import LoggingSender
+
+from control import metrics, senders
+from servicerating.tasks import vumi_fire_metric
+
+
+class TestSenders(TestCase):
+
+    def setUp(self):
+        senders.reset_senders()
+
+    def tearDown(self):
+        senders.reset_senders()
+
+    def test_default_conversation(self):
+        sender = senders.get_sender()
+        self.assertEqual(sender.conversation_key, "replaceme")
+        self.assertEqual(sender.account_key, "replaceme")
+
+    def test_sender_reused_per_conversation(self):
+        sender = senders.get_sender("conv-1")
+        self.assertTrue(senders.get_sender("conv-1") is sender)
+        self.assertEqual(sender.conversation_key, "conv-1")
+        other = senders.get_sender("conv-2")
+        self.assertFalse(other is sender)
+        # but they share one keep-alive session
+        self.assertTrue(other.session is sender.session)
+
+    def test_reset(self):
+        sender = senders.get_sender("conv-1")
+        senders.reset_senders()
+        new_sender = senders.get_sender("conv-1")
+        self.assertFalse(new_sender is sender)
+        self.assertFalse(new_sender.session is sender.session)
+
+
+class RecordingHandler(logging.Handler):
+
+    """ Record logs. """
+    logs = None
+
+    def emit(self, record):
+        if self.logs is None:
+            self.logs = []
+        self.logs.append(record)
+
+
+@override_settings(METRICS_FLUSH_INTERVAL=60)
+class TestMetricsAggregator(TestCase):
+
+    def setUp(self):
+        self.aggregator = metrics.MetricsAggregator()
+        self.sender = LoggingSender('go_http.test')
+        self.handler = RecordingHandler()
+        logger = logging.getLogger('go_http.test')
+        logger.setLevel(logging.INFO)
+        logger.addHandler(self.handler)
+
+    def tearDown(self):
+        self.aggregator.clear()
+        logging.getLogger('go_http.test').removeHandler(self.handler)
+
+    def sent(self):
+        return [log.msg for log in self.handler.logs or []]
+
+    def test_coalesced(self):
+        for value in [1, 2, 3]:
+            self.aggregator.add("prd.sum.sent", value, "sum", self.sender)
+            self.aggregator.add("prd.last.queued", value, "last", self.sender)
+            self.aggregator.add("prd.avg.rate", value, "avg", self.sender)
+            self.aggregator.add("prd.max.batch", value, "max", self.sender)
+        # nothing is sent until the flush
+        self.assertEqual(self.sent(), [])
+        self.assertEqual(self.aggregator.flush(), 4)
+        self.assertEqual(self.sent(), [
+            "Metric: 'prd.sum.sent' [sum] -> 6",
+            "Metric: 'prd.last.queued' [last] -> 3",
+            "Metric: 'prd.avg.rate' [avg] -> 2",
+            "Metric: 'prd.max.batch' [max] -> 3",
+        ])
+        self.assertEqual(self.aggregator.flush(), 0)
+
+    @override_settings(METRICS_FLUSH_INTERVAL=0)
+    def test_without_interval(self):
+        self.aggregator.add("prd.sum.sent", 1, "sum", self.sender)
+        self.aggregator.add("prd.sum.sent", 1, "sum", self.sender)
+        self.assertEqual(self.sent(), [
+            "Metric: 'prd.sum.sent' [sum] -> 1",
+            "Metric: 'prd.sum.sent' [sum] -> 1",
+        ])
+
+    @override_settings(METRICS_FLUSH_INTERVAL=0)
+    def test_add_many(self):
+        self.aggregator.add("prd.last.queued", 1, "last", self.sender)
+        self.aggregator.add_many(
+            [("prd.last.queued", 2), ("prd.last.sent", 3)], "last",
+            self.sender)
+        self.assertEqual(self.sent(), [
+            "Metric: 'prd.last.queued' [last] -> 1",
+            "Metric: 'prd.last.queued' [last] -> 2",
+            "Metric: 'prd.last.sent' [last] -> 3",
+        ])
+
+    def test_flushed_on_shutdown(self):
+        metrics.fire_metric("prd.sum.sent", 2, "sum", self.sender)
+        metrics.fire_metric("prd.sum.sent", 3, "sum", self.sender)
+        metrics.flush_metrics()
+        self.assertEqual(self.sent(), ["Metric: 'prd.sum.sent' [sum] -> 5"])
+
+
+class TestMetricsBackends(TestCase):
+
+    def tearDown(self):
+        metrics._backends.clear()
+
+    @override_settings(METRICS_BACKEND="control.metrics.MemoryBackend")
+    def test_memory(self):
+        backend = metrics.get_backend()
+        self.assertTrue(metrics.get_backend() is backend)
+        metrics.fire_metric("prd.sum.sent", 2, "sum")
+        self.assertEqual(backend.fired, [("prd.sum.sent", 2, "sum")])
+
+    @override_settings(METRICS_BACKEND="control.metrics.MemoryBackend")
+    def test_fire_metric_task(self):
+        vumi_fire_metric.delay(
+            metric="servicerating.duplicates", value=1, agg="last")
+        self.assertEqual(metrics.get_backend().fired,
+                         [("servicerating.duplicates", 1, "last")])
+
+    def test_file(self):
+        path = tempfile.mktemp()
+        try:
+            with override_settings(
+                    METRICS_BACKEND="control.metrics.FileBackend",
+                    METRICS_FILE=path):
+                metrics.fire_metric("prd.sum.sent", 2, "sum")
+                metrics.fire_metric("prd.last.queued", 5, "last")
+            with open(path) as metrics_file:
+                lines = [line.split()[1:] for line in metrics_file]
+        finally:
+            os.remove(path)
+        self.assertEqual(lines, [
+            ["prd.sum.sent", "sum", "2"],
+            ["prd.last.queued", "last", "5"],
+        ])
+
+    def test_statsd(self):
+        server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        server.bind(("127.0.0.1", 0))
+        server.settimeout(5)
+        try:
+            with override_settings(
+                    METRICS_BACKEND="control.metrics.StatsdBackend",
+                    METRICS_STATSD_HOST="127.0.0.1",
+                    METRICS_STATSD_PORT=server.getsockname()[1]):
+                metrics.fire_metric("prd.sum.sent", 2, "sum")
+                metrics.fire_metric("prd.last.queued", 5, "last")
+            self.assertEqual(server.recv(512), "prd.sum.sent:2|c")
+            self.assertEqual(server.recv(512), "prd.last.queued:5|g")
+        finally:
+            server.close()
@@ -11,5 +11,7 @@ BROKER_BACKEND = 'memory'
 CELERY_RESULT_BACKEND = 'djcelery.backends.database:DatabaseBackend'
 RAVEN_CONFIG = {'dsn': None}
 METRIC_ENV = "test"
+# send metrics as they are fired so tests can check them straight away
+METRICS_FLUSH_INTERVAL = 0
 CELERY_EAGER_PROPAGATES_EXCEPTIONS = False
 SNAPPY_ACCOUNT_ID = 77777
@@ -1,9 +1,18 @@
 from django.contrib import admin
 from controlinterface.models import (
-    Dashboard, Widget, WidgetData, UserDashboard)
+    Dashboard, Widget, WidgetData, UserDashboard, MetricSnapshot)
 
 
 admin.site.register(Dashboard)
 admin.site.register(Widget)
 admin.site.register(WidgetData)
 admin.site.register(UserDashboard)
+
+
+class MetricSnapshotAdmin(admin.ModelAdmin):
+    list_display = ["date", "key", "value"]
+    list_filter = ["date"]
+    search_fields = ["key"]
+
+
+admin.site.register(MetricSnapshot, MetricSnapshotAdmin)
@@ -1,9 +1,15 @@
+import calendar
+from datetime import datetime
+
 from tastypie import fields
+from tastypie.exceptions import BadRequest
 from tastypie.resources import Resource
 from tastypie.authentication import ApiKeyAuthentication
 from tastypie.authorization import Authorization
 from go_http.metrics import MetricsApiClient
 from django.conf import settings
+
+from controlinterface.snapshots import snapshot_series
 # Resource custom API for bulk load
 
 
@@ -74,3 +80,44 @@ class MetricResource(Resource):
 
     def obj_get_list(self, bundle, **kwargs):
         return self.get_object_list(bundle.request)
+
+
+class SnapshotResource(Resource):
+    # Daily values kept in MetricSnapshot, in the same shape as the metrics
+    # above so the dashboards can chart either.
+    key = fields.CharField(attribute='key')
+    values = fields.ListField(attribute='values')
+
+    class Meta:
+        resource_name = 'snapshot'
+        list_allowed_methods = ['get']
+        object_class = MetricObject
+        authentication = ApiKeyAuthentication()
+        authorization = Authorization()
+
+    def _date(self, request, name):
+        value = request.GET.get(name)
+        if not value:
+            return None
+        try:
+            return datetime.strptime(value, "%Y-%m-%d").date()
+        except ValueError:
+            raise BadRequest("%s must be a date like 2015-01-31" % name)
+
+    def get_object_list(self, request):
+        keys = request.GET.getlist('m')
+        series = snapshot_series(keys,
+                                 self._date(request, 'start'),
+                                 self._date(request, 'end'))
+        results = []
+        for key in keys:
+            new_obj = MetricObject()
+            new_obj.key = key
+            new_obj.values = [
+                {"x": calendar.timegm(date.timetuple()) * 1000, "y": value}
+                for date, value in series[key]]
+            results.append(new_obj)
+        return results
+
+    def obj_get_list(self, bundle, **kwargs):
+        return self.get_object_list(bundle.request)
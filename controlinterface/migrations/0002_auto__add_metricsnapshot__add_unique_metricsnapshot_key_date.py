@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+from south.utils import datetime_utils as datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding model 'MetricSnapshot'
+        db.create_table(u'controlinterface_metricsnapshot', (
+            (u'id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('date', self.gf('django.db.models.fields.DateField')()),
+            ('key', self.gf('django.db.models.fields.CharField')(max_length=200)),
+            ('value', self.gf('django.db.models.fields.FloatField')()),
+        ))
+        db.send_create_signal(u'controlinterface', ['MetricSnapshot'])
+
+        # Adding unique constraint on 'MetricSnapshot', fields ['key', 'date']
+        db.create_unique(u'controlinterface_metricsnapshot', ['key', 'date'])
+
+
+    def backwards(self, orm):
+        # Removing unique constraint on 'MetricSnapshot', fields ['key', 'date']
+        db.delete_unique(u'controlinterface_metricsnapshot', ['key', 'date'])
+
+        # Deleting model 'MetricSnapshot'
+        db.delete_table(u'controlinterface_metricsnapshot')
+
+
+    models = {
+        u'auth.group': {
+            'Meta': {'object_name': 'Group'},
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '80'}),
+            'permissions': ('django.db.models.fields.related.ManyToManyField', [], {'to': u"orm['auth.Permission']", 'symmetrical': 'False', 'blank': 'True'})
+        },
+        u'auth.permission': {
+            'Meta': {'ordering': "(u'content_type__app_label', u'content_type__model', u'codename')", 'unique_together': "((u'content_type', u'codename'),)", 'object_name': 'Permission'},
+            'codename': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'content_type': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['contenttypes.ContentType']"}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '50'})
+        },
+        u'auth.user': {
+            'Meta': {'object_name': 'User'},
+            'date_joined': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'email': ('django.db.models.fields.EmailField', [], {'max_length': '75', 'blank': 'True'}),
+            'first_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'blank': 'True'}),
+            'groups': ('django.db.models.fields.related.ManyToManyField', [], {'symmetrical': 'False', 'related_name': "u'user_set'", 'blank': 'True', 'to': u"orm['auth.Group']"}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_active': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'is_staff': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'is_superuser': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'last_login': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'last_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'blank': 'True'}),
+            'password': ('django.db.models.fields.CharField', [], {'max_length': '128'}),
+            'user_permissions': ('django.db.models.fields.related.ManyToManyField', [], {'symmetrical': 'False', 'related_name': "u'user_set'", 'blank': 'True', 'to': u"orm['auth.Permission']"}),
+            'username': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '30'})
+        },
+        u'contenttypes.contenttype': {
+            'Meta': {'ordering': "('name',)", 'unique_together': "(('app_label', 'model'),)", 'object_name': 'ContentType', 'db_table': "'django_content_type'"},
+            'app_label': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'model': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'})
+        },
+        u'controlinterface.dashboard': {
+            'Meta': {'object_name': 'Dashboard'},
+            'created_at': ('controlinterface.models.AutoNewDateTimeField', [], {'blank': 'True'}),
+            'dashboard_type': ('django.db.models.fields.CharField', [], {'max_length': '10'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '200'}),
+            'updated_at': ('controlinterface.models.AutoDateTimeField', [], {'blank': 'True'}),
+            'widgets': ('django.db.models.fields.related.ManyToManyField', [], {'symmetrical': 'False', 'to': u"orm['controlinterface.Widget']", 'null': 'True', 'blank': 'True'})
+        },
+        u'controlinterface.metricsnapshot': {
+            'Meta': {'unique_together': "(('key', 'date'),)", 'object_name': 'MetricSnapshot'},
+            'date': ('django.db.models.fields.DateField', [], {}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'key': ('django.db.models.fields.CharField', [], {'max_length': '200'}),
+            'value': ('django.db.models.fields.FloatField', [], {})
+        },
+        u'controlinterface.userdashboard': {
+            'Meta': {'object_name': 'UserDashboard'},
+            'created_at': ('controlinterface.models.AutoNewDateTimeField', [], {'blank': 'True'}),
+            'dashboards': ('django.db.models.fields.related.ManyToManyField', [], {'related_name': "'dashboards'", 'symmetrical': 'False', 'to': u"orm['controlinterface.Dashboard']"}),
+            'default_dashboard': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'default'", 'to': u"orm['controlinterface.Dashboard']"}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'updated_at': ('controlinterface.models.AutoDateTimeField', [], {'blank': 'True'}),
+            'user': ('django.db.models.fields.related.OneToOneField', [], {'to': u"orm['auth.User']", 'unique': 'True'})
+        },
+        u'controlinterface.widget': {
+            'Meta': {'object_name': 'Widget'},
+            'created_at': ('controlinterface.models.AutoNewDateTimeField', [], {'blank': 'True'}),
+            'data': ('django.db.models.fields.related.ManyToManyField', [], {'symmetrical': 'False', 'to': u"orm['controlinterface.WidgetData']", 'null': 'True', 'blank': 'True'}),
+            'data_from': ('django.db.models.fields.CharField', [], {'max_length': '20'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'interval': ('django.db.models.fields.CharField', [], {'max_length': '20'}),
+            'nulls': ('django.db.models.fields.CharField', [], {'max_length': '20', 'null': 'True', 'blank': 'True'}),
+            'title': ('django.db.models.fields.CharField', [], {'max_length': '200'}),
+            'type_of': ('django.db.models.fields.CharField', [], {'max_length': '10'}),
+            'updated_at': ('controlinterface.models.AutoDateTimeField', [], {'blank': 'True'})
+        },
+        u'controlinterface.widgetdata': {
+            'Meta': {'object_name': 'WidgetData'},
+            'created_at': ('controlinterface.models.AutoNewDateTimeField', [], {'blank': 'True'}),
+            'data_type': ('django.db.models.fields.CharField', [], {'max_length': '10'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'key': ('django.db.models.fields.CharField', [], {'max_length': '200'}),
+            'source': ('django.db.models.fields.CharField', [], {'max_length': '10'}),
+            'title': ('django.db.models.fields.CharField', [], {'max_length': '200'}),
+            'updated_at': ('controlinterface.models.AutoDateTimeField', [], {'blank': 'True'})
+        }
+    }
+
+    complete_apps = ['controlinterface']
\ No newline at end of file
@@ -130,6 +130,24 @@ class UserDashboard(models.Model):
             self.user.first_name, self.user.last_name, self.user.email)
 
 
+class MetricSnapshot(models.Model):
+
+    """ A metric's value on a day, kept so trends can be charted without
+        asking the metric store
+    """
+    date = models.DateField()
+    key = models.CharField(max_length=200)
+    value = models.FloatField()
+
+    class Meta:
+        verbose_name = 'metric snapshot'
+        verbose_name_plural = 'metric snapshots'
+        unique_together = ('key', 'date')
+
+    def __unicode__(self):
+        return "%s %s: %s" % (self.date, self.key, self.value)
+
+
 from south.modelsinspector import add_introspection_rules
 add_introspection_rules(
     [], ["^controlinterface\.models\.AutoNewDateTimeField",
@@ -0,0 +1,43 @@
+from datetime import timedelta
+
+from django.db import connection
+from django.utils import timezone
+
+from controlinterface.models import MetricSnapshot
+
+
+def today():
+    return timezone.localtime(timezone.now()).date()
+
+
+def record_snapshots(metrics, date=None):
+    """ Stores (key, value) pairs as their values on `date`, today if not
+        given, in one statement. A key recorded again on the same day keeps
+        the newest value. Returns how many were stored.
+    """
+    metrics = dict(metrics)
+    if not metrics:
+        return 0
+    cursor = connection.cursor()
+    cursor.execute(
+        """INSERT INTO controlinterface_metricsnapshot (date, key, value)
+        SELECT %s, m.key, m.value
+        FROM unnest(%s::varchar[], %s::float8[]) AS m (key, value)
+        ON CONFLICT (key, date) DO UPDATE SET value = EXCLUDED.value""",
+        [date or today(), list(metrics), list(metrics.values())])
+    return len(metrics)
+
+
+def snapshot_series(keys, start=None, end=None):
+    """ The values recorded for each key from `start` to `end`, inclusive,
+        as a dict of key to a list of (date, value) in date order. `end`
+        defaults to today and `start` to four weeks before it.
+    """
+    end = end or today()
+    start = start or end - timedelta(days=27)
+    series = dict((key, []) for key in keys)
+    for key, date, value in MetricSnapshot.objects.filter(
+            key__in=keys, date__gte=start, date__lte=end).order_by(
+            "key", "date").values_list("key", "date", "value"):
+        series[key].append((date, value))
+    return series
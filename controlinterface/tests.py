@@ -1,9 +1,16 @@
 import responses
 import json
+from datetime import date, timedelta
 from django.test import TestCase, Client
+from django.test.utils import override_settings
+from django.utils import timezone
 from django.core.urlresolvers import reverse
 from django.contrib.auth.models import User
-from subscription.models import Message, Subscription
+from tastypie.test import ResourceTestCase
+from controlinterface.models import MetricSnapshot
+from controlinterface.snapshots import record_snapshots, snapshot_series
+from subscription.models import Message, Subscription, OptOut
+from subscription.optouts import registry
 
 
 class MessageEditViewTests(TestCase):
@@ -280,6 +287,9 @@ class SubscriptionEditViewTests(TestCase):
         activeafter = Subscription.objects.filter(
             to_addr="+271112", active=True).count()
         self.assertEqual(activeafter, 0)
+        optout = OptOut.objects.get(to_addr="+271112")
+        self.assertEqual(optout.source, "admin")
+        registry.clear()
 
     def test_subscription_baby_switch(self):
         """
@@ -303,3 +313,80 @@ class SubscriptionEditViewTests(TestCase):
             to_addr="+271112", active=True)
         self.assertEqual(activeafter.count(), 1)
         self.assertEqual(activeafter[0].message_set.short_name, "baby1")
+
+    @override_settings(SUBSCRIPTION_COMPUTED_SEQUENCES=True)
+    def test_subscription_baby_switch_computed_sequence(self):
+        self.login()
+        Subscription.objects.filter(pk=3).update(
+            sequence_started_at=timezone.now() - timedelta(days=60),
+            start_sequence_number=2, next_sequence_number=2)
+        self.client.post(
+            reverse('controlinterface.views.subscription_edit'), {
+                "subaction": "baby",
+                "msisdn": "+271112",
+                "existing_id": 3
+            })
+        baby = Subscription.objects.get(to_addr="+271112", active=True)
+        self.assertEqual(baby.start_sequence_number, 1)
+        self.assertEqual(baby.sequence_number_due(), 1)
+
+
+class MetricSnapshotTests(ResourceTestCase):
+
+    def setUp(self):
+        super(MetricSnapshotTests, self).setUp()
+        self.username = 'testuser'
+        self.user = User.objects.create_user(
+            self.username, 'testuser@example.com', 'testpass')
+        self.api_key = self.user.api_key.key
+        record_snapshots([("prd.subscriptions.active", 2),
+                          ("prd.subscriptions.alltime", 3)],
+                         date(2015, 1, 1))
+        record_snapshots([("prd.subscriptions.active", 4)],
+                         date(2015, 1, 8))
+
+    def get_credentials(self):
+        return self.create_apikey(self.username, self.api_key)
+
+    def test_recorded_again_same_day(self):
+        self.assertEqual(record_snapshots(
+            [("prd.subscriptions.active", 5)], date(2015, 1, 8)), 1)
+        self.assertEqual(MetricSnapshot.objects.count(), 3)
+        self.assertEqual(MetricSnapshot.objects.get(
+            key="prd.subscriptions.active", date=date(2015, 1, 8)).value, 5)
+
+    def test_series(self):
+        self.assertEqual(snapshot_series(
+            ["prd.subscriptions.active", "prd.subscriptions.none"],
+            end=date(2015, 1, 10)), {
+            "prd.subscriptions.active": [
+                (date(2015, 1, 1), 2), (date(2015, 1, 8), 4)],
+            "prd.subscriptions.none": []})
+        self.assertEqual(snapshot_series(
+            ["prd.subscriptions.active"], date(2015, 1, 2),
+            date(2015, 1, 10)), {
+            "prd.subscriptions.active": [(date(2015, 1, 8), 4)]})
+
+    def test_api_unauthorized(self):
+        self.assertHttpUnauthorized(self.api_client.get(
+            "/api/v1/controlinterface/snapshot/", format="json"))
+
+    def test_api(self):
+        response = self.api_client.get(
+            "/api/v1/controlinterface/snapshot/"
+            "?m=prd.subscriptions.active&m=prd.subscriptions.alltime"
+            "&start=2015-01-01&end=2015-01-31",
+            format="json", authentication=self.get_credentials())
+        self.assertValidJSONResponse(response)
+        self.assertEqual(self.deserialize(response)["objects"], [
+            {"key": "prd.subscriptions.active", "resource_uri": "",
+             "values": [{"x": 1420070400000, "y": 2.0},
+                        {"x": 1420675200000, "y": 4.0}]},
+            {"key": "prd.subscriptions.alltime", "resource_uri": "",
+             "values": [{"x": 1420070400000, "y": 3.0}]}])
+
+    def test_api_bad_date(self):
+        self.assertHttpBadRequest(self.api_client.get(
+            "/api/v1/controlinterface/snapshot/"
+            "?m=prd.subscriptions.active&start=01/01/2015",
+            format="json", authentication=self.get_credentials()))
@@ -7,6 +7,7 @@ from tastypie.api import Api
 # Tastypies API function
 api_resources = Api(api_name='v1/controlinterface')
 api_resources.register(api.MetricResource())
+api_resources.register(api.SnapshotResource())
 api_resources.prepend_urls()
 
 urlpatterns = patterns(
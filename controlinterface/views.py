@@ -17,6 +17,7 @@ from models import Dashboard, UserDashboard
 from subscription.models import (Message,
                                  Subscription,
                                  MessageSet)
+from subscription.optouts import record_optouts
 from servicerating.models import Response
 from subscription.forms import (MessageFindForm,
                                 MessageUpdateForm,
@@ -342,6 +343,7 @@ def subscription_edit(request):
             subscriptions = Subscription.objects.filter(
                 to_addr=optoutform.cleaned_data['msisdn']).update(
                 active=False)
+            record_optouts([optoutform.cleaned_data['msisdn']], "admin")
             # Opt the user out
             optout_client = OptOutsApiClient(
                 auth_token=settings.VUMI_GO_API_TOKEN)
@@ -375,6 +377,9 @@ def subscription_edit(request):
             subscription.active = True
             subscription.completed = False
             subscription.next_sequence_number = 1
+            # the new set's position starts afresh
+            subscription.sequence_started_at = None
+            subscription.start_sequence_number = None
             newsub = subscription
             baby_message_set = MessageSet.objects.get(short_name="baby1")
             newsub.message_set = baby_message_set
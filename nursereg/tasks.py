@@ -8,7 +8,8 @@ from celery import task
 from celery.utils.log import get_task_logger
 from celery.exceptions import SoftTimeLimitExceeded
 from djcelery.models import PeriodicTask
-from go_http import HttpApiSender
+from control import senders
+from control.metrics import fire_metric, get_backend
 from go_http.contacts import ContactsApiClient
 from .models import NurseReg
 from subscription.models import Subscription, MessageSet
@@ -64,12 +65,7 @@ def get_sanc(sanc):
 
 
 def get_sender():
-    sender = HttpApiSender(
-        account_key=settings.VUMI_GO_ACCOUNT_KEY,
-        conversation_key=settings.VUMI_GO_CONVERSATION_KEY,
-        conversation_token=settings.VUMI_GO_ACCOUNT_TOKEN
-    )
-    return sender
+    return senders.get_sender()
 
 
 def build_jembi_json(nursereg):
@@ -112,37 +108,31 @@ def jembi_post_json(nursereg_id, sender=None):
                 verify=False
             )
             result.raise_for_status()
-            vumi_fire_metric.apply_async(
-                kwargs={
-                    "metric": u"%s.%s.sum.json_to_jembi_success" % (
-                        settings.METRIC_ENV, 'nursereg'),
-                    "value": 1,
-                    "agg": "sum",
-                    "sender": sender}
-            )
+            fire_metric(
+                metric=u"%s.%s.sum.json_to_jembi_success" % (
+                    settings.METRIC_ENV, 'nursereg'),
+                value=1,
+                agg="sum",
+                sender=sender)
         except HTTPError as e:
             # retry message sending if in 500 range (3 default retries)
             if 500 < e.response.status_code < 599:
                 if jembi_post_json.max_retries == \
                    jembi_post_json.request.retries:
-                    vumi_fire_metric.apply_async(
-                        kwargs={
-                            "metric": u"%s.%s.sum.json_to_jembi_fail" % (
-                                settings.METRIC_ENV, 'nursereg'),
-                            "value": 1,
-                            "agg": "sum",
-                            "sender": None}
-                    )
+                    fire_metric(
+                        metric=u"%s.%s.sum.json_to_jembi_fail" % (
+                            settings.METRIC_ENV, 'nursereg'),
+                        value=1,
+                        agg="sum",
+                        sender=None)
                 raise jembi_post_json.retry(exc=e)
             else:
-                vumi_fire_metric.apply_async(
-                    kwargs={
-                        "metric": u"%s.%s.sum.json_to_jembi_fail" % (
-                            settings.METRIC_ENV, 'nursereg'),
-                        "value": 1,
-                        "agg": "sum",
-                        "sender": None}
-                )
+                fire_metric(
+                    metric=u"%s.%s.sum.json_to_jembi_fail" % (
+                        settings.METRIC_ENV, 'nursereg'),
+                    value=1,
+                    agg="sum",
+                    sender=None)
                 raise e
         except:
             logger.error('Problem posting JSON to Jembi', exc_info=True)
@@ -238,34 +228,28 @@ def create_subscription(contact, sender=None):
         subscription.save()
         logger.info("Created subscription for %s" % subscription.to_addr)
 
-        vumi_fire_metric.apply_async(
-            kwargs={
-                "metric": u"%s.sum.nc_subscriptions" % (
-                    settings.METRIC_ENV),
-                "value": 1,
-                "agg": "sum",
-                "sender": sender}
-        )
-        vumi_fire_metric.apply_async(
-            kwargs={
-                "metric": u"%s.%s.sum.nc_subscription_to_protocol_success" % (
-                    settings.METRIC_ENV, "nurseconnect"),
-                "value": 1,
-                "agg": "sum",
-                "sender": sender}
-        )
+        fire_metric(
+            metric=u"%s.sum.nc_subscriptions" % (
+                settings.METRIC_ENV),
+            value=1,
+            agg="sum",
+            sender=sender)
+        fire_metric(
+            metric=u"%s.%s.sum.nc_subscription_to_protocol_success" % (
+                settings.METRIC_ENV, "nurseconnect"),
+            value=1,
+            agg="sum",
+            sender=sender)
 
         return subscription
 
     except:
-        vumi_fire_metric.apply_async(
-            kwargs={
-                "metric": u"%s.%s.sum.nc_subscription_to_protocol_fail" % (
-                    settings.METRIC_ENV, "nurseconnect"),
-                "value": 1,
-                "agg": "sum",
-                "sender": sender}
-        )
+        fire_metric(
+            metric=u"%s.%s.sum.nc_subscription_to_protocol_fail" % (
+                settings.METRIC_ENV, "nurseconnect"),
+            value=1,
+            agg="sum",
+            sender=sender)
         logger.error(
             'Error creating Subscription instance',
             exc_info=True)
@@ -384,11 +368,10 @@ def fire_new_clinic_metric(client=None, sender=None):
         if client is None:
             client = get_client()
 
-        vumi_fire_metric.apply_async(kwargs={
-            "metric": u"%s.nurseconnect.unique.clinics" % (
+        fire_metric(
+            metric=u"%s.nurseconnect.unique.clinics" % (
                 settings.METRIC_ENV),
-            "value": 1, "agg": "sum", "sender": sender}
-        )
+            value=1, agg="sum", sender=sender)
     except SoftTimeLimitExceeded:
         logger.error(
             'Soft time limit exceeded processing Jembi send via Celery.',
@@ -399,9 +382,7 @@ def fire_new_clinic_metric(client=None, sender=None):
 @task(ignore_result=True)
 def vumi_fire_metric(metric, value, agg, sender=None):
     try:
-        if sender is None:
-            sender = get_sender()
-        sender.fire_metric(metric, value, agg=agg)
+        get_backend().fire(metric, value, agg, sender)
         return sender
     except SoftTimeLimitExceeded:
         logger.error(
@@ -4,6 +4,7 @@ import logging
 from datetime import datetime
 from django.contrib.auth.models import User
 from django.test import TestCase
+from django.conf import settings
 from django.db.models.signals import post_save
 from django.core.exceptions import ValidationError
 from django.core.exceptions import MultipleObjectsReturned
@@ -18,6 +19,7 @@ from go_http.send import LoggingSender
 from fake_go_contacts import Request, FakeContactsApi
 from .models import NurseReg, NurseSource, nursereg_postsave
 from subscription.models import Subscription
+from control import senders
 from nursereg import tasks
 
 
@@ -248,6 +250,10 @@ class APITestCase(TestCase):
         tasks.get_today = override_get_today
         tasks.get_tomorrow = override_get_tomorrow
         tasks.get_sender = override_get_sender
+        # metrics fired without a sender go to the default conversation's
+        senders._senders[settings.VUMI_GO_CONVERSATION_KEY] = \
+            override_get_sender()
+        self.addCleanup(senders.reset_senders)
 
 
 class FakeContactsApiAdapter(HTTPAdapter):
@@ -11,7 +11,8 @@ from django.core.exceptions import ObjectDoesNotExist
 from requests.exceptions import HTTPError
 from django.conf import settings
 from go_http.contacts import ContactsApiClient
-from go_http import HttpApiSender
+from control import senders
+from control.metrics import fire_metric, get_backend
 from .models import Registration
 from djcelery.models import PeriodicTask
 from subscription.models import Subscription, MessageSet
@@ -25,12 +26,7 @@ def get_client():
 
 
 def get_sender():
-    sender = HttpApiSender(
-        account_key=settings.VUMI_GO_ACCOUNT_KEY,
-        conversation_key=settings.VUMI_GO_CONVERSATION_KEY,
-        conversation_token=settings.VUMI_GO_ACCOUNT_TOKEN
-    )
-    return sender
+    return senders.get_sender()
 
 
 def get_today():
@@ -465,34 +461,28 @@ def create_subscription(contact, authority, sender=None):
         subscription.save()
         logger.info("Created subscription for %s" % subscription.to_addr)
 
-        vumi_fire_metric.apply_async(
-            kwargs={
-                "metric": u"%s.sum.subscriptions" % (
-                    settings.METRIC_ENV),
-                "value": 1,
-                "agg": "sum",
-                "sender": sender}
-        )
-        vumi_fire_metric.apply_async(
-            kwargs={
-                "metric": u"%s.%s.sum.subscription_to_protocol_success" % (
-                    settings.METRIC_ENV, authority),
-                "value": 1,
-                "agg": "sum",
-                "sender": sender}
-        )
+        fire_metric(
+            metric=u"%s.sum.subscriptions" % (
+                settings.METRIC_ENV),
+            value=1,
+            agg="sum",
+            sender=sender)
+        fire_metric(
+            metric=u"%s.%s.sum.subscription_to_protocol_success" % (
+                settings.METRIC_ENV, authority),
+            value=1,
+            agg="sum",
+            sender=sender)
 
         return subscription
 
     except:
-        vumi_fire_metric.apply_async(
-            kwargs={
-                "metric": u"%s.%s.sum.subscription_to_protocol_fail" % (
-                    settings.METRIC_ENV, authority),
-                "value": 1,
-                "agg": "sum",
-                "sender": sender}
-        )
+        fire_metric(
+            metric=u"%s.%s.sum.subscription_to_protocol_fail" % (
+                settings.METRIC_ENV, authority),
+            value=1,
+            agg="sum",
+            sender=sender)
         logger.error(
             'Error creating Subscription instance',
             exc_info=True)
@@ -516,37 +506,31 @@ def jembi_post_json(registration_id, sender=None):
                 verify=False
             )
             result.raise_for_status()
-            vumi_fire_metric.apply_async(
-                kwargs={
-                    "metric": u"%s.%s.sum.json_to_jembi_success" % (
-                        settings.METRIC_ENV, registration.authority),
-                    "value": 1,
-                    "agg": "sum",
-                    "sender": sender}
-            )
+            fire_metric(
+                metric=u"%s.%s.sum.json_to_jembi_success" % (
+                    settings.METRIC_ENV, registration.authority),
+                value=1,
+                agg="sum",
+                sender=sender)
         except HTTPError as e:
             # retry message sending if in 500 range (3 default retries)
             if 500 < e.response.status_code < 599:
                 if jembi_post_json.max_retries == \
                    jembi_post_json.request.retries:
-                    vumi_fire_metric.apply_async(
-                        kwargs={
-                            "metric": u"%s.%s.sum.json_to_jembi_fail" % (
-                                settings.METRIC_ENV, registration.authority),
-                            "value": 1,
-                            "agg": "sum",
-                            "sender": None}
-                    )
+                    fire_metric(
+                        metric=u"%s.%s.sum.json_to_jembi_fail" % (
+                            settings.METRIC_ENV, registration.authority),
+                        value=1,
+                        agg="sum",
+                        sender=None)
                 raise jembi_post_json.retry(exc=e)
             else:
-                vumi_fire_metric.apply_async(
-                    kwargs={
-                        "metric": u"%s.%s.sum.json_to_jembi_fail" % (
-                            settings.METRIC_ENV, registration.authority),
-                        "value": 1,
-                        "agg": "sum",
-                        "sender": None}
-                )
+                fire_metric(
+                    metric=u"%s.%s.sum.json_to_jembi_fail" % (
+                        settings.METRIC_ENV, registration.authority),
+                    value=1,
+                    agg="sum",
+                    sender=None)
                 raise e
         except:
             logger.error('Problem posting JSON to Jembi', exc_info=True)
@@ -585,37 +569,31 @@ def jembi_post_xml(registration_id, sender=None):
             result = requests.post(api_url, headers=headers, data=data,
                                    auth=auth, verify=False)
             result.raise_for_status()
-            vumi_fire_metric.apply_async(
-                kwargs={
-                    "metric": u"%s.%s.sum.doc_to_jembi_success" % (
-                        settings.METRIC_ENV, registration.authority),
-                    "value": 1,
-                    "agg": "sum",
-                    "sender": sender}
-            )
+            fire_metric(
+                metric=u"%s.%s.sum.doc_to_jembi_success" % (
+                    settings.METRIC_ENV, registration.authority),
+                value=1,
+                agg="sum",
+                sender=sender)
         except HTTPError as e:
             # retry message sending if in 500 range (3 default retries)
             if 500 < e.response.status_code < 599:
                 if jembi_post_xml.max_retries == \
                    jembi_post_xml.request.retries:
-                    vumi_fire_metric.apply_async(
-                        kwargs={
-                            "metric": u"%s.%s.sum.doc_to_jembi_fail" % (
-                                settings.METRIC_ENV, registration.authority),
-                            "value": 1,
-                            "agg": "sum",
-                            "sender": None}
-                    )
+                    fire_metric(
+                        metric=u"%s.%s.sum.doc_to_jembi_fail" % (
+                            settings.METRIC_ENV, registration.authority),
+                        value=1,
+                        agg="sum",
+                        sender=None)
                 raise jembi_post_xml.retry(exc=e)
             else:
-                vumi_fire_metric.apply_async(
-                    kwargs={
-                        "metric": u"%s.%s.sum.doc_to_jembi_fail" % (
-                            settings.METRIC_ENV, registration.authority),
-                        "value": 1,
-                        "agg": "sum",
-                        "sender": None}
-                )
+                fire_metric(
+                    metric=u"%s.%s.sum.doc_to_jembi_fail" % (
+                        settings.METRIC_ENV, registration.authority),
+                    value=1,
+                    agg="sum",
+                    sender=None)
                 raise e
         except:
             logger.error('Problem posting XML to Jembi', exc_info=True)
@@ -699,9 +677,7 @@ def update_create_vumi_contact(registration_id, client=None, sender=None):
 @task(ignore_result=True)
 def vumi_fire_metric(metric, value, agg, sender=None):
     try:
-        if sender is None:
-            sender = get_sender()
-        sender.fire_metric(metric, value, agg=agg)
+        get_backend().fire(metric, value, agg, sender)
         return sender
     except SoftTimeLimitExceeded:
         logger.error(
@@ -4,6 +4,7 @@ import logging
 from datetime import datetime
 from django.contrib.auth.models import User
 from django.test import TestCase
+from django.conf import settings
 from django.db.models.signals import post_save
 from django.core.exceptions import ValidationError
 from rest_framework.test import APIClient
@@ -16,6 +17,7 @@ from go_http.contacts import ContactsApiClient
 from go_http.send import LoggingSender
 from fake_go_contacts import Request, FakeContactsApi
 from .models import Registration, Source, fire_jembi_post
+from control import senders
 from control.test_utils import AdminCsvDownloadBase
 from subscription.models import Subscription
 from registration import tasks
@@ -241,6 +243,10 @@ class APITestCase(TestCase):
         tasks.get_today = override_get_today
         tasks.get_tomorrow = override_get_tomorrow
         tasks.get_sender = override_get_sender
+        # metrics fired without a sender go to the default conversation's
+        senders._senders[settings.VUMI_GO_CONVERSATION_KEY] = \
+            override_get_sender()
+        self.addCleanup(senders.reset_senders)
 
 
 class FakeContactsApiAdapter(HTTPAdapter):
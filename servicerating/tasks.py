@@ -1,8 +1,9 @@
 from celery import task, chain
 from celery.exceptions import SoftTimeLimitExceeded
-from go_http import HttpApiSender
 from go_http.contacts import ContactsApiClient
 import control.settings as settings
+from control.senders import get_sender
+from control.metrics import fire_metric, get_backend
 from django.db import connection
 import logging
 logger = logging.getLogger(__name__)
@@ -42,7 +43,7 @@ def ensure_one_servicerating():
         (SELECT MAX(id) as id FROM servicerating_contact GROUP BY key)
     """)
     affected = cursor.rowcount
-    vumi_fire_metric.delay(
+    fire_metric(
         metric="servicerating.duplicates", value=affected, agg="last")
     return affected
 
@@ -50,13 +51,7 @@ def ensure_one_servicerating():
 @task(ignore_result=True)
 def vumi_fire_metric(metric, value, agg, sender=None):
     try:
-        if sender is None:
-            sender = HttpApiSender(
-                account_key=settings.VUMI_GO_ACCOUNT_KEY,
-                conversation_key=settings.VUMI_GO_CONVERSATION_KEY,
-                conversation_token=settings.VUMI_GO_ACCOUNT_TOKEN
-            )
-        sender.fire_metric(metric, value, agg=agg)
+        get_backend().fire(metric, value, agg, sender)
         return sender
     except SoftTimeLimitExceeded:
         logger.error((
@@ -70,11 +65,7 @@ def vumi_send_message(contact_key, message, client=None, sender=None):
         if client is None:
             client = ContactsApiClient(auth_token=settings.VUMI_GO_API_TOKEN)
         if sender is None:
-            sender = HttpApiSender(
-                account_key=settings.VUMI_GO_ACCOUNT_KEY,
-                conversation_key=settings.VUMI_GO_CONVERSATION_KEY,
-                conversation_token=settings.VUMI_GO_ACCOUNT_TOKEN
-            )
+            sender = get_sender()
         # get contact
         try:
             contact = client.get_contact(contact_key)
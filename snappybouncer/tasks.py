@@ -5,12 +5,13 @@ import requests
 import json
 import urllib
 
-from go_http.send import HttpApiSender
 from go_http.contacts import ContactsApiClient
 from besnappy import SnappyApiSender
 
 from django.conf import settings
 
+from control.senders import get_sender
+
 from snappybouncer.models import Ticket
 
 logger = get_task_logger(__name__)
@@ -18,12 +19,8 @@ logger = get_task_logger(__name__)
 
 @task(ignore_result=True)
 def send_helpdesk_response(ticket):
-    # Make a session to Vumi
-    sender = HttpApiSender(
-        account_key=settings.VUMI_GO_ACCOUNT_KEY,
-        conversation_key=settings.VUMI_GO_CONVERSATION_KEY,
-        conversation_token=settings.VUMI_GO_ACCOUNT_TOKEN
-    )
+    # Reuse this worker's session to Vumi
+    sender = get_sender()
     # Send message
     response = sender.send_text(ticket.msisdn, ticket.response)
     # TODO: Log outbound send metric
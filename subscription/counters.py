@@ -0,0 +1,235 @@
+from django.db import connection, transaction
+
+
+# A number is counted on a message set or language while it has any
+# subscriptions there, and as active while any of those are active, as the
+# metrics have always counted. SubscriptionNumber keeps how many each number
+# has so a change only touches that number's row and, when the number starts
+# or stops being counted, a SubscriptionCount row. Each database connection
+# adds to its own one of COUNT_SHARDS rows for the key, so workers changing
+# subscriptions on the same message set at the same time don't queue for
+# one row lock. The shards are summed when the counts are read.
+COUNT_SHARDS = 16
+
+TRIGGER_FUNCTION = """
+CREATE OR REPLACE FUNCTION subscription_number_change(
+    change_kind varchar, change_key varchar, change_to_addr varchar,
+    change integer, active_change integer) RETURNS void AS $$
+DECLARE
+    now_subscriptions integer;
+    now_active integer;
+    numbers_change integer;
+    active_numbers_change integer;
+BEGIN
+    INSERT INTO subscription_subscriptionnumber AS n
+        (kind, key, to_addr, subscriptions, active_subscriptions)
+    VALUES (change_kind, change_key, change_to_addr, change, active_change)
+    ON CONFLICT (kind, key, to_addr) DO UPDATE SET
+        subscriptions = n.subscriptions + EXCLUDED.subscriptions,
+        active_subscriptions =
+            n.active_subscriptions + EXCLUDED.active_subscriptions
+    RETURNING n.subscriptions, n.active_subscriptions
+    INTO now_subscriptions, now_active;
+    IF now_subscriptions = 0 THEN
+        DELETE FROM subscription_subscriptionnumber
+        WHERE kind = change_kind AND key = change_key
+        AND to_addr = change_to_addr;
+    END IF;
+    numbers_change := (now_subscriptions > 0)::integer -
+        (now_subscriptions - change > 0)::integer;
+    active_numbers_change := (now_active > 0)::integer -
+        (now_active - active_change > 0)::integer;
+    IF numbers_change <> 0 OR active_numbers_change <> 0 THEN
+        INSERT INTO subscription_subscriptioncount AS c
+            (kind, key, shard, numbers, active_numbers)
+        VALUES (change_kind, change_key, pg_backend_pid() %% %(shards)s,
+            numbers_change, active_numbers_change)
+        ON CONFLICT (kind, key, shard) DO UPDATE SET
+            numbers = c.numbers + EXCLUDED.numbers,
+            active_numbers = c.active_numbers + EXCLUDED.active_numbers;
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION subscription_count_move(
+    move_kind varchar,
+    old_key varchar, old_to_addr varchar, old_active boolean,
+    new_key varchar, new_to_addr varchar, new_active boolean)
+    RETURNS void AS $$
+BEGIN
+    IF old_key IS NOT DISTINCT FROM new_key
+            AND old_to_addr IS NOT DISTINCT FROM new_to_addr THEN
+        IF new_key IS NOT NULL AND old_active <> new_active THEN
+            PERFORM subscription_number_change(
+                move_kind, new_key, new_to_addr, 0,
+                new_active::integer - old_active::integer);
+        END IF;
+    ELSE
+        IF old_key IS NOT NULL THEN
+            PERFORM subscription_number_change(
+                move_kind, old_key, old_to_addr, -1, -old_active::integer);
+        END IF;
+        IF new_key IS NOT NULL THEN
+            PERFORM subscription_number_change(
+                move_kind, new_key, new_to_addr, 1, new_active::integer);
+        END IF;
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION subscription_count_change() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM subscription_count_move('set', NULL, NULL, NULL,
+            NEW.message_set_id::varchar, NEW.to_addr, NEW.active);
+        PERFORM subscription_count_move('lang', NULL, NULL, NULL,
+            nullif(NEW.lang, ''), NEW.to_addr, NEW.active);
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM subscription_count_move('set',
+            OLD.message_set_id::varchar, OLD.to_addr, OLD.active,
+            NULL, NULL, NULL);
+        PERFORM subscription_count_move('lang',
+            nullif(OLD.lang, ''), OLD.to_addr, OLD.active, NULL, NULL, NULL);
+    ELSE
+        PERFORM subscription_count_move('set',
+            OLD.message_set_id::varchar, OLD.to_addr, OLD.active,
+            NEW.message_set_id::varchar, NEW.to_addr, NEW.active);
+        PERFORM subscription_count_move('lang',
+            nullif(OLD.lang, ''), OLD.to_addr, OLD.active,
+            nullif(NEW.lang, ''), NEW.to_addr, NEW.active);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql""" % {"shards": COUNT_SHARDS}
+
+# SubscriptionCount with its shards added up
+COUNTS_SQL = """(SELECT kind, key, sum(numbers) AS numbers,
+        sum(active_numbers) AS active_numbers
+    FROM subscription_subscriptioncount
+    GROUP BY kind, key)"""
+
+# Updates that leave the counted columns alone, like claiming and
+# advancing, don't touch the counters
+TRIGGERS = """
+DROP TRIGGER IF EXISTS subscription_count ON subscription_subscription;
+CREATE TRIGGER subscription_count
+    AFTER INSERT OR DELETE ON subscription_subscription
+    FOR EACH ROW EXECUTE PROCEDURE subscription_count_change();
+DROP TRIGGER IF EXISTS subscription_count_update
+    ON subscription_subscription;
+CREATE TRIGGER subscription_count_update
+    AFTER UPDATE OF message_set_id, lang, active, to_addr
+    ON subscription_subscription
+    FOR EACH ROW
+    WHEN (OLD.message_set_id IS DISTINCT FROM NEW.message_set_id
+        OR OLD.lang IS DISTINCT FROM NEW.lang
+        OR OLD.active IS DISTINCT FROM NEW.active
+        OR OLD.to_addr IS DISTINCT FROM NEW.to_addr)
+    EXECUTE PROCEDURE subscription_count_change()"""
+
+
+def install_counters():
+    """ Creates or replaces the triggers that keep SubscriptionCount up to
+        date and counts the subscriptions there already are
+    """
+    cursor = connection.cursor()
+    cursor.execute(TRIGGER_FUNCTION)
+    cursor.execute(TRIGGERS)
+    rebuild_counts()
+
+
+def rebuild_counts():
+    """ Recounts every SubscriptionNumber and SubscriptionCount from the
+        subscriptions, with writes to the subscriptions held off while it
+        does
+    """
+    cursor = connection.cursor()
+    with transaction.atomic():
+        cursor.execute(
+            "LOCK TABLE subscription_subscription IN SHARE ROW EXCLUSIVE MODE")
+        cursor.execute("DELETE FROM subscription_subscriptionnumber")
+        cursor.execute("DELETE FROM subscription_subscriptioncount")
+        cursor.execute(
+            """INSERT INTO subscription_subscriptionnumber
+                (kind, key, to_addr, subscriptions, active_subscriptions)
+            SELECT 'set', message_set_id::varchar, to_addr, count(*),
+                count(*) FILTER (WHERE active)
+            FROM subscription_subscription
+            GROUP BY message_set_id, to_addr
+            UNION ALL
+            SELECT 'lang', lang, to_addr, count(*),
+                count(*) FILTER (WHERE active)
+            FROM subscription_subscription
+            WHERE lang <> ''
+            GROUP BY lang, to_addr""")
+        cursor.execute(
+            """INSERT INTO subscription_subscriptioncount
+                (kind, key, shard, numbers, active_numbers)
+            SELECT kind, key, 0, count(*),
+                count(*) FILTER (WHERE active_subscriptions > 0)
+            FROM subscription_subscriptionnumber
+            GROUP BY kind, key""")
+
+
+def counts_by_message_set(active=False):
+    """ (short name, numbers) for each message set with any numbers
+        subscribed, only counting those with an active subscription if
+        `active`
+    """
+    cursor = connection.cursor()
+    cursor.execute(
+        """SELECT ms.short_name, CASE WHEN %s THEN c.active_numbers
+            ELSE c.numbers END AS subscribers
+        FROM """ + COUNTS_SQL + """ c
+        JOIN subscription_messageset ms ON ms.id::varchar = c.key
+        WHERE c.kind = 'set'
+        AND CASE WHEN %s THEN c.active_numbers ELSE c.numbers END > 0
+        ORDER BY subscribers, 1""", [active, active])
+    return list(cursor.fetchall())
+
+
+def counts_by_lang(active=False):
+    """ (language, numbers) for each language with any numbers subscribed,
+        only counting those with an active subscription if `active`
+    """
+    cursor = connection.cursor()
+    cursor.execute(
+        """SELECT c.key, CASE WHEN %s THEN c.active_numbers
+            ELSE c.numbers END AS subscribers
+        FROM """ + COUNTS_SQL + """ c
+        WHERE c.kind = 'lang'
+        AND CASE WHEN %s THEN c.active_numbers ELSE c.numbers END > 0
+        ORDER BY subscribers, 1""", [active, active])
+    return list(cursor.fetchall())
+
+
+def subscription_metrics():
+    """ Every subscription count the metrics report, read together in one
+        statement so they agree with each other. Returns (name, value)
+        pairs, where names are like those fired by the fire_metrics_*
+        tasks without the prefix: "subscriptions.<set>.active",
+        "subscriptions.<lang>.alltime", "subscriptions.active" and so on.
+    """
+    cursor = connection.cursor()
+    cursor.execute(
+        """SELECT c.kind, coalesce(ms.short_name, c.key), c.numbers,
+            c.active_numbers
+        FROM """ + COUNTS_SQL + """ c
+        LEFT JOIN subscription_messageset ms
+            ON c.kind = 'set' AND ms.id::varchar = c.key
+        WHERE c.numbers > 0
+        ORDER BY 2""")
+    totals = {"active": 0, "alltime": 0}
+    metrics = []
+    rows = cursor.fetchall()
+    for kind in ("set", "lang"):
+        for column, name in ((3, "active"), (2, "alltime")):
+            for row in rows:
+                if row[0] == kind and row[column]:
+                    metrics.append(
+                        ("subscriptions.%s.%s" % (row[1], name), row[column]))
+                    if kind == "set":
+                        totals[name] += row[column]
+    metrics.append(("subscriptions.active", totals["active"]))
+    metrics.append(("subscriptions.alltime", totals["alltime"]))
+    return metrics
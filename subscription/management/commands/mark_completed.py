@@ -1,11 +1,12 @@
 from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
 from optparse import make_option
-from djcelery.models import PeriodicTask
-from django.db.models import Max
 from datetime import datetime
 from math import floor
 
-from subscription.models import Subscription, MessageSet, Message
+from subscription.models import Subscription, MessageSet, \
+    create_follow_on_subscriptions
 
 SUBSCRIPTION_STANDARD = 1  # less than week 32 when reg
 SUBSCRIPTION_LATER = 2  # 32-35 when reg
@@ -63,50 +64,38 @@ class Command(BaseCommand):
         self.stdout.write("Affected records: %s\n" % (subscribers.count()))
 
         if not options["dry_run"]:
-            set_max = Message.objects.filter(
-                message_set_id=options["message_set_id"]).aggregate(
-                    Max('sequence_number'))["sequence_number__max"]
             message_set = MessageSet.objects.get(
                 id=options["message_set_id"])
-
-            for subscriber in subscribers:
-                # make current subscription completed
-                subscriber.next_sequence_number = set_max
-                subscriber.active = False
-                subscriber.completed = True
-                subscriber.process_status = 2
-                last_update = subscriber.updated_at.date()
-
-                subscriber.save()
-
-                # if there is a next set, make a new subscription
-                if message_set.next_set:
-                    # clone existing minus PK as recommended in
-                    # https://docs.djangoproject.com/en/1.6/topics/db/queries/
-                    #     #copying-model-instances
-                    subscriber.pk = None
-                    new_subscription = subscriber
-                    new_subscription.process_status = 0  # Ready
-                    new_subscription.active = True
-                    new_subscription.completed = False
-                    new_subscription.message_set = message_set.next_set
-                    if message_set.next_set.short_name == 'baby2':
-                        new_subscription.schedule = PeriodicTask.objects.get(
-                            pk=2)
-                        # PeriodicTask(pk=2) is once a week
-                    else:
-                        new_subscription.schedule = PeriodicTask.objects.get(
-                            pk=3)
-                        # PeriodicTask(pk=3) is twice a week
-
-                    if (message_set.short_name == 'accelerated' or
-                            message_set.short_name == 'later'):
-                        days_missed = self.calc_days(last_update)
-                        next_seq_number = self.calc_baby1_start(days_missed)
-                        new_subscription.next_sequence_number = next_seq_number
-                    else:
-                        new_subscription.next_sequence_number = 1
-
-                    new_subscription.save()
+            set_max = message_set.get_max_sequence_number()
+            subscribers = list(subscribers.select_related(
+                "message_set__next_set"))
+
+            with transaction.atomic():
+                # make current subscriptions completed
+                Subscription.objects.filter(
+                    id__in=[subscriber.id for subscriber in subscribers]
+                ).update(
+                    next_sequence_number=set_max,
+                    active=False,
+                    completed=True,
+                    process_status=2,
+                    updated_at=timezone.now())
+                # if there is a next set, make new subscriptions
+                create_follow_on_subscriptions(
+                    subscribers, follow_on=self.follow_on)
 
             self.stdout.write("Records updated\n")
+
+    def follow_on(self, subscriber):
+        message_set = subscriber.message_set
+        if message_set.next_set.short_name == 'baby2':
+            schedule_id = 2  # PeriodicTask(pk=2) is once a week
+        else:
+            schedule_id = 3  # PeriodicTask(pk=3) is twice a week
+
+        if message_set.short_name in ('accelerated', 'later'):
+            days_missed = self.calc_days(subscriber.updated_at.date())
+            next_seq_number = self.calc_baby1_start(days_missed)
+        else:
+            next_seq_number = 1
+        return schedule_id, next_seq_number
@@ -141,6 +141,9 @@ class Command(BaseCommand):
                     self.stdout.write("Setting to seq %s from %s\n" % (
                         new_seq_num, str(subscriber.next_sequence_number)))
                     subscriber.next_sequence_number = new_seq_num
+                    if subscriber.sequence_started_at is not None:
+                        # restart the computed position from the new number
+                        subscriber.start_computed_sequence()
                     subscriber.save()
                     counter += 1.0
                     delta = self.get_now() - started
@@ -1,7 +1,8 @@
-from datetime import date, datetime
+from datetime import date, datetime, timedelta
 
 from django.test import TestCase
 from django.test.utils import override_settings
+from django.utils.timezone import utc
 
 from djcelery.models import PeriodicTask, IntervalSchedule
 
@@ -163,6 +164,33 @@ class TestSetSeqCommand(TestCase):
             'Completed'
         ]), command.stdout.getvalue().strip())
 
+    def test_computed_subscription_restarted(self):
+        msg_set = self.mk_message_set(short_name='standard')
+        sub = self.mk_subscription(
+            user_account='82309423098',
+            contact_key='82309423098',
+            to_addr='+271234',
+            message_set=msg_set)
+        sub.start_computed_sequence(now=datetime(2014, 1, 1, tzinfo=utc))
+        sub.save()
+
+        command = self.mk_command(contacts=[
+            {u'extra': {u'due_date_day': u'21',
+                        u'due_date_month': u'11',
+                        u'subscription_type': SUBSCRIPTION_STANDARD},
+             u'key': u'82309423098',
+             u'msisdn': u'+271234'}
+        ])
+        command.handle()
+
+        updated = Subscription.objects.get(contact_key='82309423098')
+        self.assertEqual(updated.start_sequence_number, 67)
+        self.assertTrue(
+            updated.sequence_started_at > datetime(2014, 1, 1, tzinfo=utc))
+        # the next run sends the new number
+        self.assertEqual(updated.sequence_number_due(
+            updated.sequence_started_at + timedelta(days=2)), 67)
+
     @override_settings(VUMI_GO_API_TOKEN='token')
     def test_later_subscription_updated(self):
 
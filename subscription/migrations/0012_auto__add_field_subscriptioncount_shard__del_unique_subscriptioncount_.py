@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+from south.utils import datetime_utils as datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+# subscription_number_change as it was before the counts were sharded
+UNSHARDED_NUMBER_CHANGE = """
+CREATE OR REPLACE FUNCTION subscription_number_change(
+    change_kind varchar, change_key varchar, change_to_addr varchar,
+    change integer, active_change integer) RETURNS void AS $$
+DECLARE
+    now_subscriptions integer;
+    now_active integer;
+    numbers_change integer;
+    active_numbers_change integer;
+BEGIN
+    INSERT INTO subscription_subscriptionnumber AS n
+        (kind, key, to_addr, subscriptions, active_subscriptions)
+    VALUES (change_kind, change_key, change_to_addr, change, active_change)
+    ON CONFLICT (kind, key, to_addr) DO UPDATE SET
+        subscriptions = n.subscriptions + EXCLUDED.subscriptions,
+        active_subscriptions =
+            n.active_subscriptions + EXCLUDED.active_subscriptions
+    RETURNING n.subscriptions, n.active_subscriptions
+    INTO now_subscriptions, now_active;
+    IF now_subscriptions = 0 THEN
+        DELETE FROM subscription_subscriptionnumber
+        WHERE kind = change_kind AND key = change_key
+        AND to_addr = change_to_addr;
+    END IF;
+    numbers_change := (now_subscriptions > 0)::integer -
+        (now_subscriptions - change > 0)::integer;
+    active_numbers_change := (now_active > 0)::integer -
+        (now_active - active_change > 0)::integer;
+    IF numbers_change <> 0 OR active_numbers_change <> 0 THEN
+        INSERT INTO subscription_subscriptioncount AS c
+            (kind, key, numbers, active_numbers)
+        VALUES (change_kind, change_key, numbers_change,
+            active_numbers_change)
+        ON CONFLICT (kind, key) DO UPDATE SET
+            numbers = c.numbers + EXCLUDED.numbers,
+            active_numbers = c.active_numbers + EXCLUDED.active_numbers;
+    END IF;
+END;
+$$ LANGUAGE plpgsql"""
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Removing unique constraint on 'SubscriptionCount', fields ['kind', 'key']
+        db.delete_unique(u'subscription_subscriptioncount', ['kind', 'key'])
+
+        # Adding field 'SubscriptionCount.shard'
+        db.add_column(u'subscription_subscriptioncount', 'shard',
+                      self.gf('django.db.models.fields.IntegerField')(default=0),
+                      keep_default=False)
+
+        # Adding unique constraint on 'SubscriptionCount', fields ['kind', 'key', 'shard']
+        db.create_unique(u'subscription_subscriptioncount', ['kind', 'key', 'shard'])
+
+        # Keep the counts up to date from now on and count what's there
+        if not db.dry_run:
+            from subscription.counters import install_counters
+            install_counters()
+
+
+    def backwards(self, orm):
+        # Fold the shards back into one row per key
+        db.execute("""CREATE TEMPORARY TABLE subscription_count_totals AS
+            SELECT kind, key, sum(numbers) AS numbers,
+                sum(active_numbers) AS active_numbers
+            FROM subscription_subscriptioncount
+            GROUP BY kind, key""")
+        db.execute("DELETE FROM subscription_subscriptioncount")
+        db.execute("""INSERT INTO subscription_subscriptioncount
+                (kind, key, shard, numbers, active_numbers)
+            SELECT kind, key, 0, numbers, active_numbers
+            FROM subscription_count_totals""")
+        db.execute("DROP TABLE subscription_count_totals")
+        db.execute(UNSHARDED_NUMBER_CHANGE)
+
+        # Removing unique constraint on 'SubscriptionCount', fields ['kind', 'key', 'shard']
+        db.delete_unique(u'subscription_subscriptioncount', ['kind', 'key', 'shard'])
+
+        # Deleting field 'SubscriptionCount.shard'
+        db.delete_column(u'subscription_subscriptioncount', 'shard')
+
+        # Adding unique constraint on 'SubscriptionCount', fields ['kind', 'key']
+        db.create_unique(u'subscription_subscriptioncount', ['kind', 'key'])
+
+
+    models = {
+        u'djcelery.crontabschedule': {
+            'Meta': {'ordering': "[u'month_of_year', u'day_of_month', u'day_of_week', u'hour', u'minute']", 'object_name': 'CrontabSchedule'},
+            'day_of_month': ('django.db.models.fields.CharField', [], {'default': "u'*'", 'max_length': '64'}),
+            'day_of_week': ('django.db.models.fields.CharField', [], {'default': "u'*'", 'max_length': '64'}),
+            'hour': ('django.db.models.fields.CharField', [], {'default': "u'*'", 'max_length': '64'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'minute': ('django.db.models.fields.CharField', [], {'default': "u'*'", 'max_length': '64'}),
+            'month_of_year': ('django.db.models.fields.CharField', [], {'default': "u'*'", 'max_length': '64'})
+        },
+        u'djcelery.intervalschedule': {
+            'Meta': {'ordering': "[u'period', u'every']", 'object_name': 'IntervalSchedule'},
+            'every': ('django.db.models.fields.IntegerField', [], {}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'period': ('django.db.models.fields.CharField', [], {'max_length': '24'})
+        },
+        u'djcelery.periodictask': {
+            'Meta': {'object_name': 'PeriodicTask'},
+            'args': ('django.db.models.fields.TextField', [], {'default': "u'[]'", 'blank': 'True'}),
+            'crontab': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['djcelery.CrontabSchedule']", 'null': 'True', 'blank': 'True'}),
+            'date_changed': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'}),
+            'description': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'enabled': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'exchange': ('django.db.models.fields.CharField', [], {'default': 'None', 'max_length': '200', 'null': 'True', 'blank': 'True'}),
+            'expires': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'interval': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['djcelery.IntervalSchedule']", 'null': 'True', 'blank': 'True'}),
+            'kwargs': ('django.db.models.fields.TextField', [], {'default': "u'{}'", 'blank': 'True'}),
+            'last_run_at': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '200'}),
+            'queue': ('django.db.models.fields.CharField', [], {'default': 'None', 'max_length': '200', 'null': 'True', 'blank': 'True'}),
+            'routing_key': ('django.db.models.fields.CharField', [], {'default': 'None', 'max_length': '200', 'null': 'True', 'blank': 'True'}),
+            'task': ('django.db.models.fields.CharField', [], {'max_length': '200'}),
+            'total_run_count': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'})
+        },
+        u'subscription.message': {
+            'Meta': {'object_name': 'Message'},
+            'category': ('django.db.models.fields.CharField', [], {'max_length': '20', 'null': 'True', 'blank': 'True'}),
+            'content': ('django.db.models.fields.TextField', [], {}),
+            'created_at': ('subscription.models.AutoNewDateTimeField', [], {'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'lang': ('django.db.models.fields.CharField', [], {'max_length': '3'}),
+            'message_set': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'messages'", 'to': u"orm['subscription.MessageSet']"}),
+            'sequence_number': ('django.db.models.fields.IntegerField', [], {}),
+            'updated_at': ('subscription.models.AutoDateTimeField', [], {'blank': 'True'})
+        },
+        u'subscription.messageset': {
+            'Meta': {'object_name': 'MessageSet'},
+            'conversation_key': ('django.db.models.fields.CharField', [], {'max_length': '255', 'null': 'True', 'blank': 'True'}),
+            'created_at': ('subscription.models.AutoNewDateTimeField', [], {'blank': 'True'}),
+            'default_schedule': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'message_sets'", 'to': u"orm['djcelery.PeriodicTask']"}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'max_sequence_number': ('django.db.models.fields.IntegerField', [], {'null': 'True', 'blank': 'True'}),
+            'next_set': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['subscription.MessageSet']", 'null': 'True', 'blank': 'True'}),
+            'notes': ('django.db.models.fields.TextField', [], {'null': 'True', 'blank': 'True'}),
+            'short_name': ('django.db.models.fields.CharField', [], {'max_length': '20'}),
+            'updated_at': ('subscription.models.AutoDateTimeField', [], {'blank': 'True'})
+        },
+        u'subscription.optout': {
+            'Meta': {'object_name': 'OptOut'},
+            'created_at': ('subscription.models.AutoNewDateTimeField', [], {'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'source': ('django.db.models.fields.CharField', [], {'max_length': '10'}),
+            'to_addr': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '255'})
+        },
+        u'subscription.subscription': {
+            'Meta': {'object_name': 'Subscription'},
+            'active': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'completed': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'contact_key': ('django.db.models.fields.CharField', [], {'max_length': '36'}),
+            'created_at': ('subscription.models.AutoNewDateTimeField', [], {'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'lang': ('django.db.models.fields.CharField', [], {'max_length': '3', 'db_index': 'True'}),
+            'message_set': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'subscribers'", 'to': u"orm['subscription.MessageSet']"}),
+            'next_sequence_number': ('django.db.models.fields.IntegerField', [], {'default': '1'}),
+            'process_status': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'schedule': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'subscriptions'", 'to': u"orm['djcelery.PeriodicTask']"}),
+            'sequence_started_at': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'start_sequence_number': ('django.db.models.fields.IntegerField', [], {'null': 'True', 'blank': 'True'}),
+            'to_addr': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'updated_at': ('subscription.models.AutoDateTimeField', [], {'blank': 'True'}),
+            'user_account': ('django.db.models.fields.CharField', [], {'max_length': '36'})
+        },
+        u'subscription.subscriptioncount': {
+            'Meta': {'unique_together': "[('kind', 'key', 'shard')]", 'object_name': 'SubscriptionCount'},
+            'active_numbers': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'key': ('django.db.models.fields.CharField', [], {'max_length': '20'}),
+            'kind': ('django.db.models.fields.CharField', [], {'max_length': '4'}),
+            'numbers': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'shard': ('django.db.models.fields.IntegerField', [], {'default': '0'})
+        },
+        u'subscription.subscriptionnumber': {
+            'Meta': {'unique_together': "[('kind', 'key', 'to_addr')]", 'object_name': 'SubscriptionNumber'},
+            'active_subscriptions': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'key': ('django.db.models.fields.CharField', [], {'max_length': '20'}),
+            'kind': ('django.db.models.fields.CharField', [], {'max_length': '4'}),
+            'subscriptions': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'to_addr': ('django.db.models.fields.CharField', [], {'max_length': '255'})
+        }
+    }
+
+    complete_apps = ['subscription']
\ No newline at end of file
@@ -1,9 +1,13 @@
-from django.db import models
-from django.db.models.signals import post_save
+from django.db import models, connection
+from django.db.models.signals import pre_save, post_save, post_delete, \
+    post_syncdb
 from django.dispatch import receiver
 from djcelery.models import PeriodicTask
 from django.utils import timezone
 from django.db.models import DateTimeField
+from django.conf import settings
+
+from subscription.schedules import count_runs
 
 
 # Modelled on https://github.com/jamesmarlowe/django-AutoDateTimeFields
@@ -37,12 +41,36 @@ class MessageSet(models.Model):
     default_schedule = models.ForeignKey(PeriodicTask,
                                          related_name='message_sets',
                                          null=False)
+    max_sequence_number = models.IntegerField(null=True, blank=True,
+                                              editable=False)
     created_at = AutoNewDateTimeField(blank=True)
     updated_at = AutoDateTimeField(blank=True)
 
     def __unicode__(self):
         return "%s" % self.short_name
 
+    def save(self, *args, **kwargs):
+        # max_sequence_number is kept by refresh_max_sequence_number, so
+        # saving a set that exists doesn't write back what was loaded
+        if self.pk is not None and not args and \
+                not kwargs.get("force_insert") and \
+                kwargs.get("update_fields") is None and \
+                MessageSet.objects.filter(pk=self.pk).exists():
+            kwargs["update_fields"] = [
+                field.name for field in self._meta.local_fields
+                if not field.primary_key and
+                field.name != "max_sequence_number"]
+        super(MessageSet, self).save(*args, **kwargs)
+
+    def get_max_sequence_number(self):
+        """ The last sequence number in the set. Stored on the set and
+            refreshed when its messages change so senders don't need to
+            aggregate over the messages.
+        """
+        if self.max_sequence_number is None:
+            self.max_sequence_number = refresh_max_sequence_number(self.id)
+        return self.max_sequence_number
+
 
 class Message(models.Model):
     """ A message that a user can be sent
@@ -62,6 +90,36 @@ class Message(models.Model):
             self.sequence_number, self.lang, self.message_set.short_name)
 
 
+def refresh_max_sequence_number(message_set_id):
+    """ Recalculates and stores the last sequence number of a message set
+    """
+    cursor = connection.cursor()
+    cursor.execute(
+        """UPDATE subscription_messageset
+        SET max_sequence_number = (
+            SELECT MAX(sequence_number) FROM subscription_message
+            WHERE message_set_id = %s)
+        WHERE id = %s
+        RETURNING max_sequence_number""", [message_set_id, message_set_id])
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def fill_max_sequence_numbers():
+    """ Stores the last sequence number of every set that doesn't have it
+        yet so queries can rely on it
+    """
+    for message_set_id in MessageSet.objects.filter(
+            max_sequence_number=None).values_list("id", flat=True):
+        refresh_max_sequence_number(message_set_id)
+
+
+@receiver(post_save, sender=Message)
+@receiver(post_delete, sender=Message)
+def update_max_sequence_number(sender, instance, **kwargs):
+    refresh_max_sequence_number(instance.message_set_id)
+
+
 class Subscription(models.Model):
     """ Users subscriptions and their status
     """
@@ -83,10 +141,143 @@ class Subscription(models.Model):
                                  related_name='subscriptions',
                                  null=False)
     process_status = models.IntegerField(default=0, null=False, blank=False)
+    # When set the position in the set is worked out from the schedule and
+    # next_sequence_number only holds the number pinned at the latest claim
+    sequence_started_at = models.DateTimeField(null=True, blank=True)
+    start_sequence_number = models.IntegerField(null=True, blank=True)
 
     def __unicode__(self):
         return "%s to %s" % (self.contact_key, self.message_set.short_name)
 
+    def start_computed_sequence(self, now=None):
+        """ Switches to working out the position in the set from the
+            schedule, starting with the next message at the next run
+        """
+        self.sequence_started_at = now or timezone.now()
+        self.start_sequence_number = self.next_sequence_number
+
+    def sequence_number_due(self, now=None):
+        """ The sequence number to send at the schedule's latest run """
+        if self.sequence_started_at is None:
+            return self.next_sequence_number
+        runs = count_runs(
+            self.schedule, self.sequence_started_at, now or timezone.now())
+        return self.start_sequence_number + max(0, runs - 1)
+
+
+@receiver(pre_save, sender=Subscription)
+def start_computed_sequence(sender, instance, **kwargs):
+    if instance.pk is None and instance.sequence_started_at is None and \
+            settings.SUBSCRIPTION_COMPUTED_SEQUENCES:
+        instance.start_computed_sequence()
+
+
+class SubscriptionCount(models.Model):
+    """ How many numbers are subscribed to a message set or in a language,
+        and how many of those are active. Kept up to date by triggers on
+        the subscription table (see subscription.counters) so metrics don't
+        need to count the whole table. The counts for a key are spread over
+        shards that are summed when read.
+    """
+    KINDS = (
+        ('set', 'Message set'),
+        ('lang', 'Language'),
+    )
+    kind = models.CharField(max_length=4, choices=KINDS)
+    # the message set's id or the language
+    key = models.CharField(max_length=20)
+    shard = models.IntegerField(default=0)
+    numbers = models.IntegerField(default=0)
+    active_numbers = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = [("kind", "key", "shard")]
+
+    def __unicode__(self):
+        return "%s %s/%s: %s (%s active)" % (
+            self.kind, self.key, self.shard, self.numbers,
+            self.active_numbers)
+
+
+class SubscriptionNumber(models.Model):
+    """ How many subscriptions, and active ones, a number has on a message
+        set or in a language, so the triggers can tell when it starts or
+        stops being counted in SubscriptionCount
+    """
+    kind = models.CharField(max_length=4, choices=SubscriptionCount.KINDS)
+    key = models.CharField(max_length=20)
+    to_addr = models.CharField(max_length=255)
+    subscriptions = models.IntegerField(default=0)
+    active_subscriptions = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = [("kind", "key", "to_addr")]
+
+    def __unicode__(self):
+        return "%s %s %s: %s (%s active)" % (
+            self.kind, self.key, self.to_addr, self.subscriptions,
+            self.active_subscriptions)
+
+
+class OptOut(models.Model):
+    """ A number that has opted out of messages, so sends to it can be
+        skipped without asking Vumi
+    """
+    SOURCES = (
+        ('vumi', 'Vumi Go'),
+        ('csv', 'Opt-out CSV'),
+        ('admin', 'Control interface'),
+    )
+    to_addr = models.CharField(max_length=255, unique=True)
+    source = models.CharField(max_length=10, choices=SOURCES)
+    created_at = AutoNewDateTimeField(blank=True)
+
+    def __unicode__(self):
+        return "%s" % self.to_addr
+
+
+def create_follow_on_subscriptions(subscribers, follow_on=None, now=None):
+    """ Bulk creates a subscription to the next set for each completed
+        subscriber whose set has one, on the next set's default schedule
+        from its first message. `follow_on(subscriber)` can return the
+        (schedule id, next sequence number) to use instead.
+    """
+    new_subscriptions = []
+    for subscriber in subscribers:
+        next_set = subscriber.message_set.next_set
+        if next_set is None:
+            continue
+        if follow_on is not None:
+            schedule_id, next_sequence_number = follow_on(subscriber)
+        else:
+            schedule_id, next_sequence_number = next_set.default_schedule_id, 1
+        new_subscription = Subscription(
+            user_account=subscriber.user_account,
+            contact_key=subscriber.contact_key,
+            to_addr=subscriber.to_addr,
+            message_set=next_set,
+            next_sequence_number=next_sequence_number,
+            lang=subscriber.lang,
+            active=True,
+            completed=False,
+            schedule_id=schedule_id,
+            process_status=0)  # Ready
+        # bulk_create skips the pre_save signal that would do this
+        if settings.SUBSCRIPTION_COMPUTED_SEQUENCES:
+            new_subscription.start_computed_sequence(now)
+        new_subscriptions.append(new_subscription)
+    Subscription.objects.bulk_create(new_subscriptions)
+    return new_subscriptions
+
+
+@receiver(post_syncdb)
+def install_subscription_counters(sender, **kwargs):
+    # test databases are made with syncdb rather than the migrations
+    if sender.__name__ == __name__ and "subscription_subscriptioncount" in \
+            connection.introspection.table_names():
+        from subscription.counters import install_counters
+        install_counters()
+
 
 from south.modelsinspector import add_introspection_rules
 add_introspection_rules([], [
@@ -0,0 +1,93 @@
+import time
+from threading import Lock
+
+from django.db import connection, transaction, IntegrityError
+from django.utils import timezone
+
+import control.settings as settings
+from subscription.models import OptOut
+
+
+class OptOutRegistry(object):
+    """ When each opted out number opted out, held in memory by each
+        worker. Reloaded from the OptOut table every
+        SUBSCRIPTION_OPTOUT_REFRESH seconds and added to straight away when
+        this worker records an opt-out.
+    """
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.opted_out = None
+        self.loaded_at = None
+        self._lock = Lock()
+
+    def load(self):
+        opted_out = dict(OptOut.objects.values_list("to_addr", "created_at"))
+        with self._lock:
+            self.opted_out = opted_out
+            self.loaded_at = self.clock()
+
+    def get(self, to_addr):
+        """ Returns when a number opted out, or None if it hasn't """
+        if self.opted_out is None or \
+                self.clock() - self.loaded_at > \
+                settings.SUBSCRIPTION_OPTOUT_REFRESH:
+            self.load()
+        return self.opted_out.get(to_addr)
+
+    def add(self, to_addrs, opted_out_at):
+        with self._lock:
+            if self.opted_out is not None:
+                for to_addr in to_addrs:
+                    self.opted_out[to_addr] = opted_out_at
+
+    def clear(self):
+        with self._lock:
+            self.opted_out = None
+
+
+registry = OptOutRegistry()
+
+
+def is_opted_out(subscription):
+    """ Whether the number opted out after the subscription was made. A
+        subscription made after an opt-out is a new sign up, so it is sent.
+    """
+    opted_out_at = registry.get(subscription.to_addr)
+    return opted_out_at is not None and \
+        opted_out_at >= subscription.created_at
+
+
+def record_optouts(to_addrs, source):
+    """ Stores the numbers as having opted out now, in two statements
+        however many there are, and returns how many there were
+    """
+    to_addrs = list(set(to_addrs))
+    if not to_addrs:
+        return 0
+    cursor = connection.cursor()
+    # taken here rather than from the database so it compares with the
+    # subscriptions' created_at, which are set the same way
+    opted_out_at = timezone.now()
+
+    def upsert():
+        with transaction.atomic():
+            cursor.execute(
+                """UPDATE subscription_optout
+                SET source = %s, created_at = %s
+                WHERE to_addr = ANY(%s)""", [source, opted_out_at, to_addrs])
+            cursor.execute(
+                """INSERT INTO subscription_optout
+                    (to_addr, source, created_at)
+                SELECT n.to_addr, %s, %s FROM unnest(%s) AS n (to_addr)
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM subscription_optout o
+                    WHERE o.to_addr = n.to_addr)""",
+                [source, opted_out_at, to_addrs])
+    try:
+        upsert()
+    except IntegrityError:
+        # someone else stored one of them at the same time so try again
+        upsert()
+    registry.add(to_addrs, opted_out_at)
+    return len(to_addrs)
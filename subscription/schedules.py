@@ -0,0 +1,97 @@
+from datetime import datetime, timedelta
+
+from django.utils.timezone import utc
+
+
+# A Sunday, which crontab counts as day 0 of the week
+EPOCH = datetime(2014, 1, 5, tzinfo=utc)
+
+
+def runs_on(cron, day):
+    """ How many times a crontab runs on a date """
+    # crontab counts days of the week from Sunday
+    if day.isoweekday() % 7 not in cron.day_of_week or \
+            day.day not in cron.day_of_month or \
+            day.month not in cron.month_of_year:
+        return 0
+    return len(cron.hour) * len(cron.minute)
+
+
+def runs_until(cron, moment):
+    """ How many times a crontab runs on the day of `moment`, up to and
+        including it
+    """
+    if not runs_on(cron, moment.date()):
+        return 0
+    return len([
+        hour for hour in cron.hour for minute in cron.minute
+        if (hour, minute) <= (moment.hour, moment.minute)])
+
+
+def count_runs(periodic_task, start, end):
+    """ How many times a schedule runs after `start` up to and including
+        `end`. Weekly crontabs and intervals are worked out without walking
+        the days in between.
+    """
+    start = start.astimezone(utc)
+    end = end.astimezone(utc)
+    if end <= start:
+        return 0
+    if periodic_task.crontab is not None:
+        cron = periodic_task.crontab.schedule
+        if len(cron.day_of_month) == 31 and len(cron.month_of_year) == 12:
+            return runs_since_epoch(cron, end) - runs_since_epoch(cron, start)
+        if start.date() == end.date():
+            return runs_until(cron, end) - runs_until(cron, start)
+        count = runs_on(cron, start.date()) - runs_until(cron, start)
+        day = start.date() + timedelta(days=1)
+        while day < end.date():
+            count += runs_on(cron, day)
+            day += timedelta(days=1)
+        return count + runs_until(cron, end)
+    if periodic_task.interval is not None:
+        every = periodic_task.interval.schedule.run_every.total_seconds()
+        return int((end - EPOCH).total_seconds() // every) - \
+            int((start - EPOCH).total_seconds() // every)
+    return 0
+
+
+def runs_since_epoch(cron, moment):
+    """ How many times a crontab that runs every week has run from EPOCH up
+        to and including `moment`
+    """
+    weeks, days = divmod((moment - EPOCH).days, 7)
+    per_day = len(cron.hour) * len(cron.minute)
+    count = weeks * len(cron.day_of_week) * per_day
+    count += len([day for day in range(days) if day in cron.day_of_week]) * \
+        per_day
+    return count + runs_until(cron, moment)
+
+
+def run_times(periodic_task, start, end):
+    """ When a schedule runs after `start` up to and including `end`, in
+        order, as UTC datetimes
+    """
+    start = start.astimezone(utc)
+    end = end.astimezone(utc)
+    if periodic_task.crontab is not None:
+        cron = periodic_task.crontab.schedule
+        times = [(hour, minute)
+                 for hour in sorted(cron.hour)
+                 for minute in sorted(cron.minute)]
+        day = start.date()
+        while day <= end.date():
+            if runs_on(cron, day):
+                for hour, minute in times:
+                    moment = datetime(day.year, day.month, day.day,
+                                      hour, minute, tzinfo=utc)
+                    if start < moment <= end:
+                        yield moment
+            day += timedelta(days=1)
+    elif periodic_task.interval is not None:
+        every = periodic_task.interval.schedule.run_every
+        moment = EPOCH + every * (
+            int((start - EPOCH).total_seconds() // every.total_seconds()) + 1)
+        while moment <= end:
+            yield moment
+            moment += every
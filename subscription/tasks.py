@@ -1,9 +1,13 @@
 from celery import task
 from celery.exceptions import SoftTimeLimitExceeded
-from go_http import HttpApiSender
 import csv
 from subscription.models import Message, Subscription
+from subscription.optouts import record_optouts
+from subscription.counters import counts_by_message_set, counts_by_lang, \
+    subscription_metrics
 import control.settings as settings
+from control.metrics import fire_metric, fire_metrics, get_backend
+from controlinterface.snapshots import record_snapshots
 from django.db import IntegrityError, transaction, connection
 import logging
 logger = logging.getLogger(__name__)
@@ -12,13 +16,7 @@ logger = logging.getLogger(__name__)
 @task(ignore_result=True)
 def vumi_fire_metric(metric, value, agg, sender=None):
     try:
-        if sender is None:
-            sender = HttpApiSender(
-                account_key=settings.VUMI_GO_ACCOUNT_KEY,
-                conversation_key=settings.VUMI_GO_CONVERSATION_KEY,
-                conversation_token=settings.VUMI_GO_ACCOUNT_TOKEN
-            )
-        sender.fire_metric(metric, value, agg=agg)
+        get_backend().fire(metric, value, agg, sender)
         return sender
     except SoftTimeLimitExceeded:
         logger.error(
@@ -68,7 +66,7 @@ def ensure_one_subscription():
         (SELECT MAX(id) as id FROM subscription_subscription GROUP BY to_addr)"
     )
     affected = cursor.rowcount
-    vumi_fire_metric.delay(
+    fire_metric(
         metric="subscription.duplicates", value=affected, agg="last")
     return affected
 
@@ -79,36 +77,16 @@ def fire_metrics_active_subscriptions(sender=None):
     Gathers subscription metrics and fires to metric store
     Runs hourly
     """
-    cursor = connection.cursor()
-    cursor.execute(
-        """SELECT
-            subscription_messageset.short_name,
-            count(ss.id) AS subscribers
-        FROM
-            (SELECT
-            MAX(id) as id, message_set_id
-        FROM
-            subscription_subscription
-        WHERE
-            active = true
-        GROUP BY
-            to_addr, message_set_id
-        ) ss
-        INNER JOIN subscription_messageset ON
-            subscription_messageset.id = ss.message_set_id
-        GROUP BY subscription_messageset.short_name
-        ORDER BY subscribers""")
-
-    subscriptions = cursor.fetchall()
+    subscriptions = counts_by_message_set(active=True)
     total = 0
     for sub in subscriptions:
-        vumi_fire_metric.delay(
+        fire_metric(
             metric="%s.subscriptions.%s.active" %
             (settings.VUMI_GO_METRICS_PREFIX, sub[0]),
             value=sub[1], agg="last", sender=sender)
         total += sub[1]
     # Total fire
-    vumi_fire_metric.delay(
+    fire_metric(
         metric="%s.subscriptions.active" %
         settings.VUMI_GO_METRICS_PREFIX,
         value=total, agg="last", sender=sender)
@@ -121,34 +99,16 @@ def fire_metrics_all_time_subscriptions(sender=None):
     Gathers subscription metrics for all time and fires to metric store
     Runs hourly
     """
-    cursor = connection.cursor()
-    cursor.execute(
-        """SELECT
-            subscription_messageset.short_name,
-            count(ss.id) AS subscribers
-        FROM
-            (SELECT
-            MAX(id) as id, message_set_id
-        FROM
-            subscription_subscription
-        GROUP BY
-            to_addr, message_set_id
-        ) ss
-        INNER JOIN subscription_messageset ON
-            subscription_messageset.id = ss.message_set_id
-        GROUP BY subscription_messageset.short_name
-        ORDER BY subscribers""")
-
-    subscriptions = cursor.fetchall()
+    subscriptions = counts_by_message_set()
     total = 0
     for sub in subscriptions:
-        vumi_fire_metric.delay(
+        fire_metric(
             metric="%s.subscriptions.%s.alltime" %
             (settings.VUMI_GO_METRICS_PREFIX, sub[0]),
             value=sub[1], agg="last", sender=sender)
         total += sub[1]
     # Total fire
-    vumi_fire_metric.delay(
+    fire_metric(
         metric="%s.subscriptions.alltime" %
         settings.VUMI_GO_METRICS_PREFIX,
         value=total, agg="last", sender=sender)
@@ -161,30 +121,10 @@ def fire_metrics_active_langs(sender=None):
     Gathers subscription lang metrics and fires to metric store
     Runs hourly
     """
-    cursor = connection.cursor()
-    cursor.execute(
-        """SELECT
-                ss.lang,
-                count(ss.id) AS subscribers
-            FROM
-                (SELECT
-                MAX(id) as id, lang
-            FROM
-                subscription_subscription
-            WHERE
-                lang <> ''
-            AND
-                active = true
-            GROUP BY
-                to_addr, lang
-            ) ss
-            GROUP BY ss.lang
-            ORDER BY subscribers""")
-
-    subscriptions = cursor.fetchall()
+    subscriptions = counts_by_lang(active=True)
     total = 0
     for sub in subscriptions:
-        vumi_fire_metric.delay(
+        fire_metric(
             metric="%s.subscriptions.%s.active" %
             (settings.VUMI_GO_METRICS_PREFIX, sub[0]),
             value=sub[1], agg="last", sender=sender)
@@ -198,28 +138,10 @@ def fire_metrics_all_time_langs(sender=None):
     Gathers subscription lang metrics for all time and fires to metric store
     Runs hourly
     """
-    cursor = connection.cursor()
-    cursor.execute(
-        """SELECT
-                ss.lang,
-                count(ss.id) AS subscribers
-            FROM
-                (SELECT
-                MAX(id) as id, lang
-            FROM
-                subscription_subscription
-            WHERE
-                lang <> ''
-            GROUP BY
-                to_addr, lang
-            ) ss
-            GROUP BY ss.lang
-            ORDER BY subscribers""")
-
-    subscriptions = cursor.fetchall()
+    subscriptions = counts_by_lang()
     total = 0
     for sub in subscriptions:
-        vumi_fire_metric.delay(
+        fire_metric(
             metric="%s.subscriptions.%s.alltime" %
             (settings.VUMI_GO_METRICS_PREFIX, sub[0]),
             value=sub[1], agg="last", sender=sender)
@@ -227,6 +149,22 @@ def fire_metrics_all_time_langs(sender=None):
     return total
 
 
+@task(ignore_result=True)
+def fire_metrics_subscriptions(sender=None):
+    """
+    Gathers the active and all time subscription metrics by message set and
+    lang, with their totals, from one query and fires them together. They
+    are kept as today's snapshot too, for the dashboards' trends
+    Runs hourly
+    """
+    metrics = [
+        ("%s.%s" % (settings.VUMI_GO_METRICS_PREFIX, name), value)
+        for name, value in subscription_metrics()]
+    fire_metrics(metrics, agg="last", sender=sender)
+    record_snapshots(metrics)
+    return len(metrics)
+
+
 def clean_msisdn(msisdn):
     if msisdn.strip()[0] == "+":
         return msisdn.strip()
@@ -253,6 +191,7 @@ def ingest_opt_opts_csv(csv_data):
 
             msisdn = clean_msisdn(line[" Address"])
             msisdns.append(msisdn)
+    record_optouts(msisdns, "csv")
     subs = Subscription.objects.filter(to_addr__in=msisdns).filter(
         active=True).update(active=False)
     # return affected count
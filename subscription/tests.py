@@ -5,21 +5,35 @@ Tests for Subscription Application
 from tastypie.test import ResourceTestCase
 from django.test import TestCase
 from django.contrib.auth.models import User
+from django.db.models import Sum
 from django.core.urlresolvers import reverse
 from django.test.utils import override_settings
 from control.test_utils import AdminCsvDownloadBase
+from controlinterface.models import MetricSnapshot
 from subscription.admin import SubscriptionAdmin, MessageAdmin, MessageSetAdmin
-from subscription.models import MessageSet, Message, Subscription
+from subscription.models import MessageSet, Message, Subscription, OptOut, \
+    SubscriptionCount, SubscriptionNumber
+from subscription.counters import (rebuild_counts, counts_by_message_set,
+                                   counts_by_lang, subscription_metrics,
+                                   COUNT_SHARDS)
+from subscription.optouts import (OptOutRegistry, registry, is_opted_out,
+                                  record_optouts)
+from subscription.schedules import count_runs, run_times
 from subscription.tasks import (ingest_csv, ensure_one_subscription,
                                 vumi_fire_metric, ingest_opt_opts_csv,
                                 fire_metrics_active_subscriptions,
                                 fire_metrics_all_time_subscriptions,
                                 fire_metrics_active_langs,
-                                fire_metrics_all_time_langs)
+                                fire_metrics_all_time_langs,
+                                fire_metrics_subscriptions)
 from StringIO import StringIO
+from datetime import datetime
+from django.utils.timezone import utc
+from djcelery.models import PeriodicTask, CrontabSchedule, IntervalSchedule
 import json
 import logging
 from go_http.send import LoggingSender
+import control.settings as settings
 
 
 class SubscriptionResourceTest(ResourceTestCase):
@@ -231,6 +245,156 @@ class TestUploadCSV(TestCase):
         self.assertEquals(len(imported_en_dirty), 1)
 
 
+class TestMessageSetLength(TestCase):
+
+    fixtures = ["test_initialdata.json"]
+
+    def setUp(self):
+        self.message_set = MessageSet.objects.get(short_name="standard")
+
+    def mk_message(self, sequence_number, lang="en"):
+        return Message.objects.create(
+            message_set=self.message_set, sequence_number=sequence_number,
+            lang=lang, content="message %s" % sequence_number)
+
+    def test_empty_set(self):
+        self.assertEqual(self.message_set.get_max_sequence_number(), None)
+
+    def test_updated_on_ingest(self):
+        uploaded = StringIO(
+            TestUploadCSV.MSG_HEADER + TestUploadCSV.MSG_LINE_CLEAN_1 +
+            TestUploadCSV.MSG_LINE_CLEAN_2)
+        ingest_csv(uploaded, self.message_set)
+        message_set = MessageSet.objects.get(pk=self.message_set.pk)
+        self.assertEqual(message_set.max_sequence_number, 2)
+
+    def test_updated_on_edit_and_delete(self):
+        self.mk_message(1)
+        message = self.mk_message(2)
+        self.mk_message(2, lang="af")
+        message.sequence_number = 3
+        message.save()
+        self.assertEqual(MessageSet.objects.get(
+            pk=self.message_set.pk).get_max_sequence_number(), 3)
+        message.delete()
+        self.assertEqual(MessageSet.objects.get(
+            pk=self.message_set.pk).get_max_sequence_number(), 2)
+
+    def test_filled_in_when_missing(self):
+        self.mk_message(1)
+        self.mk_message(2)
+        MessageSet.objects.filter(pk=self.message_set.pk).update(
+            max_sequence_number=None)
+        message_set = MessageSet.objects.get(pk=self.message_set.pk)
+        self.assertEqual(message_set.get_max_sequence_number(), 2)
+        self.assertEqual(MessageSet.objects.get(
+            pk=self.message_set.pk).max_sequence_number, 2)
+
+    def test_not_overwritten_on_save(self):
+        # loaded before the messages were added
+        self.mk_message(1)
+        self.mk_message(2)
+        self.message_set.notes = "edited"
+        self.message_set.max_sequence_number = 7
+        self.message_set.save()
+        message_set = MessageSet.objects.get(pk=self.message_set.pk)
+        self.assertEqual(message_set.notes, "edited")
+        self.assertEqual(message_set.max_sequence_number, 2)
+        self.assertFalse(MessageSet._meta.get_field(
+            "max_sequence_number").editable)
+
+
+class TestComputedSequence(TestCase):
+
+    fixtures = ["test_initialdata.json"]
+
+    def setUp(self):
+        # Mondays and Thursdays at 07:30
+        self.twice_a_week = PeriodicTask.objects.get(pk=3)
+
+    def at(self, day, hour=0, minute=0):
+        return datetime(2014, 12, day, hour, minute, tzinfo=utc)
+
+    def mk_subscription(self, **kwargs):
+        return Subscription.objects.create(
+            user_account="80493284823", contact_key="82309423098",
+            to_addr="+271234", message_set_id=3, lang="en",
+            schedule=self.twice_a_week, **kwargs)
+
+    def test_count_runs_weekly(self):
+        # Monday the 8th after the send to Thursday the 11th
+        self.assertEqual(count_runs(
+            self.twice_a_week, self.at(8, 8), self.at(11, 7, 29)), 0)
+        self.assertEqual(count_runs(
+            self.twice_a_week, self.at(8, 8), self.at(11, 7, 30)), 1)
+        self.assertEqual(count_runs(
+            self.twice_a_week, self.at(8, 7), self.at(11, 8)), 2)
+        self.assertEqual(count_runs(
+            self.twice_a_week, self.at(1, 8), self.at(29, 8)), 8)
+        self.assertEqual(count_runs(
+            self.twice_a_week, self.at(11, 8), self.at(8, 8)), 0)
+
+    def test_count_runs_monthly(self):
+        crontab = CrontabSchedule.objects.create(
+            minute="0", hour="9", day_of_month="1,15")
+        monthly = PeriodicTask.objects.create(
+            name="monthly", task="subsend.tasks.process_message_queue",
+            crontab=crontab)
+        self.assertEqual(count_runs(
+            monthly, self.at(1, 8), self.at(15, 9)), 2)
+        self.assertEqual(count_runs(
+            monthly, self.at(1, 10), datetime(2015, 2, 1, 9, tzinfo=utc)), 4)
+        # within a day
+        self.assertEqual(count_runs(
+            monthly, self.at(1, 8), self.at(1, 10)), 1)
+        self.assertEqual(count_runs(
+            monthly, self.at(1, 9), self.at(1, 10)), 0)
+        self.assertEqual(count_runs(
+            monthly, self.at(2, 8), self.at(2, 10)), 0)
+
+    def test_count_runs_interval(self):
+        interval = IntervalSchedule.objects.create(every=2, period="days")
+        every_two_days = PeriodicTask.objects.create(
+            name="every two days", task="subsend.tasks.process_message_queue",
+            interval=interval)
+        self.assertEqual(count_runs(
+            every_two_days, self.at(1), self.at(11)), 5)
+
+    def test_run_times(self):
+        self.assertEqual(
+            list(run_times(
+                self.twice_a_week, self.at(8, 7, 30), self.at(15, 7, 30))),
+            [self.at(11, 7, 30), self.at(15, 7, 30)])
+        interval = IntervalSchedule.objects.create(every=2, period="days")
+        every_two_days = PeriodicTask.objects.create(
+            name="every two days", task="subsend.tasks.process_message_queue",
+            interval=interval)
+        self.assertEqual(
+            len(list(run_times(every_two_days, self.at(1), self.at(11)))),
+            count_runs(every_two_days, self.at(1), self.at(11)))
+
+    def test_stored_sequence(self):
+        subscription = self.mk_subscription(next_sequence_number=2)
+        self.assertEqual(subscription.sequence_started_at, None)
+        self.assertEqual(subscription.sequence_number_due(self.at(29)), 2)
+
+    def test_computed_sequence(self):
+        subscription = self.mk_subscription(next_sequence_number=2)
+        subscription.start_computed_sequence(self.at(8, 8))
+        self.assertEqual(subscription.start_sequence_number, 2)
+        # the first message goes at the next run
+        self.assertEqual(subscription.sequence_number_due(self.at(9)), 2)
+        self.assertEqual(subscription.sequence_number_due(self.at(11, 8)), 2)
+        self.assertEqual(subscription.sequence_number_due(self.at(15, 8)), 3)
+        self.assertEqual(subscription.sequence_number_due(self.at(29, 8)), 7)
+
+    @override_settings(SUBSCRIPTION_COMPUTED_SEQUENCES=True)
+    def test_computed_sequence_setting(self):
+        subscription = self.mk_subscription(next_sequence_number=4)
+        self.assertNotEqual(subscription.sequence_started_at, None)
+        self.assertEqual(subscription.start_sequence_number, 4)
+
+
 class TestUploadOptOutCSV(TestCase):
 
     fixtures = ["test_initialdata.json", "test_optout.json"]
@@ -251,6 +415,9 @@ class TestUploadOptOutCSV(TestCase):
         self.admin = User.objects.create_superuser(
             'test', 'test@example.com', "pass123")
 
+    def tearDown(self):
+        registry.clear()
+
     def test_upload_view_not_logged_in_blocked(self):
         response = self.client.get(reverse("optout_uploader"))
         self.assertEqual(response.template_name, "admin/login.html")
@@ -272,6 +439,56 @@ class TestUploadOptOutCSV(TestCase):
         self.assertEqual(results.get(), 4)
         new_active_count = Subscription.objects.filter(active=True).count()
         self.assertEquals(new_active_count, 1)
+        self.assertEqual(
+            sorted(OptOut.objects.values_list("to_addr", "source")),
+            [("+271111", "csv"), ("+271234", "csv")])
+
+
+class TestOptOutRegistry(TestCase):
+
+    fixtures = ["test_initialdata.json"]
+
+    def setUp(self):
+        self.now = 1000
+        self.registry = OptOutRegistry(clock=lambda: self.now)
+        self.subscription = self.mk_subscription()
+
+    def mk_subscription(self):
+        return Subscription.objects.create(
+            user_account="80493284823", contact_key="82309423098",
+            to_addr="+271234", message_set_id=3, lang="en",
+            schedule_id=1)
+
+    def tearDown(self):
+        registry.clear()
+
+    def test_record_optouts(self):
+        self.assertEqual(is_opted_out(self.subscription), False)
+        self.assertEqual(
+            record_optouts(["+271234", "+271234", "+271111"], "vumi"), 2)
+        self.assertEqual(is_opted_out(self.subscription), True)
+        self.assertEqual(OptOut.objects.count(), 2)
+        # recording again moves the opt-out on rather than adding a row
+        before = OptOut.objects.get(to_addr="+271234").created_at
+        self.assertEqual(record_optouts(["+271234"], "admin"), 1)
+        optout = OptOut.objects.get(to_addr="+271234")
+        self.assertEqual(optout.source, "admin")
+        self.assertTrue(optout.created_at >= before)
+        self.assertEqual(record_optouts([], "vumi"), 0)
+
+    def test_resubscribed_after_optout(self):
+        record_optouts(["+271234"], "vumi")
+        resubscribed = self.mk_subscription()
+        self.assertEqual(is_opted_out(self.subscription), True)
+        self.assertEqual(is_opted_out(resubscribed), False)
+
+    def test_refresh(self):
+        self.assertEqual(self.registry.get("+271234"), None)
+        OptOut.objects.create(to_addr="+271234", source="csv")
+        # not seen until the registry is reloaded
+        self.assertEqual(self.registry.get("+271234"), None)
+        self.now += settings.SUBSCRIPTION_OPTOUT_REFRESH + 1
+        self.assertNotEqual(self.registry.get("+271234"), None)
 
 
 class RecordingHandler(logging.Handler):
@@ -384,6 +601,104 @@ class TestFireSummaryMetrics(TestCase):
         self.assertEqual(True, self.check_logs(
             "Metric: u'prd.subscriptions.en.alltime' [last] -> 1"))
 
+    def test_subscriptions_metrics(self):
+        Subscription.objects.filter(message_set=5).update(active=False)
+        results = fire_metrics_subscriptions.delay(sender=self.sender)
+        self.assertEqual(results.get(), 8)
+        for msg in [
+                "Metric: u'prd.subscriptions.accelerated.active' [last] -> 1",
+                "Metric: u'prd.subscriptions.accelerated.alltime' [last] -> 1",
+                "Metric: u'prd.subscriptions.baby2.alltime' [last] -> 1",
+                "Metric: u'prd.subscriptions.en.active' [last] -> 1",
+                "Metric: u'prd.subscriptions.en.alltime' [last] -> 1",
+                "Metric: u'prd.subscriptions.af.alltime' [last] -> 1",
+                "Metric: 'prd.subscriptions.active' [last] -> 1",
+                "Metric: 'prd.subscriptions.alltime' [last] -> 2"]:
+            self.assertEqual(True, self.check_logs(msg), msg)
+        self.assertEqual(
+            MetricSnapshot.objects.get(key="prd.subscriptions.active").value,
+            1)
+        self.assertEqual(MetricSnapshot.objects.count(), 8)
+
+
+class TestSubscriptionCounts(TestCase):
+
+    fixtures = ["test_initialdata.json", "test.json"]
+
+    def counts(self):
+        return sorted(
+            SubscriptionCount.objects.values_list("kind", "key")
+            .annotate(Sum("numbers"), Sum("active_numbers"))
+            .filter(numbers__sum__gt=0))
+
+    def test_kept_up_to_date(self):
+        # +271234 and +271111 have two subscriptions each
+        self.assertEqual(self.counts(), [
+            ("lang", "af", 1, 1), ("lang", "en", 1, 1),
+            ("set", "3", 1, 1), ("set", "5", 1, 1)])
+        # deactivated, moved on to another set and created
+        Subscription.objects.filter(pk=2).update(active=False)
+        Subscription.objects.filter(pk=3).update(message_set=4)
+        Subscription.objects.filter(pk=1).update(process_status=1)
+        Subscription.objects.create(
+            user_account="80493284823", contact_key="82309423098",
+            to_addr="+271234", message_set_id=3, lang="en", schedule_id=1)
+        Subscription.objects.create(
+            user_account="80493284823", contact_key="82309423099",
+            to_addr="+279999", message_set_id=3, lang="en", schedule_id=1)
+        self.assertEqual(self.counts(), [
+            ("lang", "af", 1, 1), ("lang", "en", 2, 2),
+            ("set", "3", 2, 2), ("set", "4", 1, 1), ("set", "5", 1, 0)])
+        # deleted and moved to another number
+        Subscription.objects.filter(pk=2).delete()
+        Subscription.objects.filter(pk=1).update(to_addr="+270000")
+        self.assertEqual(self.counts(), [
+            ("lang", "af", 1, 1), ("lang", "en", 3, 3),
+            ("set", "3", 3, 3), ("set", "4", 1, 1)])
+        counts = self.counts()
+        rebuild_counts()
+        self.assertEqual(self.counts(), counts)
+
+    def test_rebuild_counts(self):
+        SubscriptionCount.objects.update(numbers=0, active_numbers=0)
+        SubscriptionNumber.objects.all().delete()
+        rebuild_counts()
+        self.assertEqual(self.counts(), [
+            ("lang", "af", 1, 1), ("lang", "en", 1, 1),
+            ("set", "3", 1, 1), ("set", "5", 1, 1)])
+        self.assertEqual(counts_by_message_set(active=True), [
+            ("accelerated", 1), ("baby2", 1)])
+        self.assertEqual(counts_by_lang(), [("af", 1), ("en", 1)])
+
+    def test_counts_summed_over_shards(self):
+        # another connection has counted on the same message set
+        SubscriptionCount.objects.create(
+            kind="set", key="3", shard=COUNT_SHARDS, numbers=2,
+            active_numbers=1)
+        self.assertEqual(counts_by_message_set(), [
+            ("baby2", 1), ("accelerated", 3)])
+        self.assertEqual(counts_by_message_set(active=True), [
+            ("baby2", 1), ("accelerated", 2)])
+        self.assertTrue(
+            ("subscriptions.accelerated.alltime", 3) in
+            subscription_metrics())
+
+    def test_subscription_metrics(self):
+        Subscription.objects.filter(message_set=5).update(active=False)
+        Subscription.objects.create(
+            user_account="80493284823", contact_key="82309423099",
+            to_addr="+279999", message_set_id=5, lang="", schedule_id=1)
+        self.assertEqual(subscription_metrics(), [
+            ("subscriptions.accelerated.active", 1),
+            ("subscriptions.baby2.active", 1),
+            ("subscriptions.accelerated.alltime", 1),
+            ("subscriptions.baby2.alltime", 2),
+            ("subscriptions.en.active", 1),
+            ("subscriptions.af.alltime", 1),
+            ("subscriptions.en.alltime", 1),
+            ("subscriptions.active", 2),
+            ("subscriptions.alltime", 3)])
+
 
 class TestSetSeqCommand(TestCase):
 
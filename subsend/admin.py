@@ -0,0 +1,9 @@
+from django.contrib import admin
+from subsend.models import SendWindow
+
+
+class SendWindowAdmin(admin.ModelAdmin):
+    list_display = ["schedule", "minutes", "updated_at"]
+
+
+admin.site.register(SendWindow, SendWindowAdmin)
@@ -0,0 +1,159 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+
+import control.settings as settings
+from subscription.models import Message
+
+
+class LRUCache(object):
+    """ A small least recently used cache with optional expiry of entries
+        and counters for hits and misses
+    """
+
+    def __init__(self, max_size=1000, ttl=None, clock=time.time):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        with self._lock:
+            try:
+                value, stored_at = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return None
+            if self.ttl is not None and \
+                    self.clock() - stored_at > self.ttl:
+                self.misses += 1
+                return None
+            # re-insert as most recently used
+            self._data[key] = (value, stored_at)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (value, self.clock())
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete_matching(self, predicate):
+        """ Removes every entry whose value matches the predicate """
+        with self._lock:
+            for key, (value, stored_at) in self._data.items():
+                if predicate(value):
+                    del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+message_cache = LRUCache(
+    max_size=settings.SUBSEND_MESSAGE_CACHE_SIZE,
+    ttl=settings.SUBSEND_MESSAGE_CACHE_TTL)
+
+
+def get_message(message_set_id, lang, sequence_number):
+    """ Returns the Message to send, from the worker cache if possible.
+        Raises Message.DoesNotExist if there is no such message.
+    """
+    key = (message_set_id, lang, sequence_number)
+    message = message_cache.get(key)
+    if message is None:
+        message = Message.objects.get(
+            message_set_id=message_set_id, lang=lang,
+            sequence_number=sequence_number)
+        message_cache.set(key, message)
+    return message
+
+
+def get_messages(keys):
+    """ Returns a dict of (message_set_id, lang, sequence_number) to Message
+        for the given keys, loading any not in the cache in one query.
+        Keys without a matching message are left out.
+    """
+    messages = {}
+    missing = set()
+    for key in keys:
+        message = message_cache.get(key)
+        if message is None:
+            missing.add(key)
+        else:
+            messages[key] = message
+    if missing:
+        for message in Message.objects.filter(
+                message_set_id__in=set(key[0] for key in missing),
+                lang__in=set(key[1] for key in missing),
+                sequence_number__in=set(key[2] for key in missing)):
+            key = (message.message_set_id, message.lang,
+                   message.sequence_number)
+            if key in missing:
+                message_cache.set(key, message)
+                messages[key] = message
+    return messages
+
+
+def preload_messages(pairs):
+    """ Loads every message for the given (message_set_id, lang) pairs in
+        one query, caches them and returns them keyed by (message_set_id,
+        lang, sequence_number)
+    """
+    pairs = set(pairs)
+    messages = {}
+    if not pairs:
+        return messages
+    for message in Message.objects.filter(
+            message_set_id__in=set(pair[0] for pair in pairs),
+            lang__in=set(pair[1] for pair in pairs)):
+        if (message.message_set_id, message.lang) in pairs:
+            key = (message.message_set_id, message.lang,
+                   message.sequence_number)
+            message_cache.set(key, message)
+            messages[key] = message
+    return messages
+
+
+def pack_messages(messages):
+    """ Turns a dict of messages from get_messages into a list that can be
+        sent to another task
+    """
+    return [
+        [message.message_set_id, message.lang, message.sequence_number,
+         message.id, message.content, message.category]
+        for message in messages.values()]
+
+
+def unpack_messages(packed):
+    """ Turns the output of pack_messages back into a dict of messages
+        without going to the database
+    """
+    messages = {}
+    for message_set_id, lang, sequence_number, pk, content, category in \
+            packed:
+        messages[(message_set_id, lang, sequence_number)] = Message(
+            id=pk, message_set_id=message_set_id, lang=lang,
+            sequence_number=sequence_number, content=content,
+            category=category)
+    return messages
+
+
+def invalidate_message(message):
+    """ Drops a message from the worker cache after it has changed """
+    message_cache.delete_matching(lambda cached: cached.pk == message.pk)
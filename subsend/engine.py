@@ -0,0 +1,56 @@
+import sys
+from threading import Thread, Event, Lock
+
+
+def send_all(send, items, workers=1, results=None):
+    """ Calls send(item) for every item, using up to `workers` threads, and
+        appends (item, return value) to `results` as each one finishes.
+
+        If a send raises or the calling thread is interrupted (for example
+        by a soft time limit) no new sends are started, the ones in flight
+        are allowed to finish and are recorded, and the exception is
+        re-raised. So `results` always says exactly which items were sent.
+    """
+    if results is None:
+        results = []
+    if workers <= 1 or len(items) <= 1:
+        for item in items:
+            results.append((item, send(item)))
+        return results
+
+    pending = list(reversed(items))
+    lock = Lock()
+    stop = Event()
+    errors = []
+
+    def work():
+        while not stop.is_set():
+            with lock:
+                if not pending:
+                    return
+                item = pending.pop()
+            try:
+                result = send(item)
+            except Exception:
+                errors.append(sys.exc_info())
+                stop.set()
+                return
+            results.append((item, result))
+
+    threads = [Thread(target=work) for _ in range(min(workers, len(items)))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    try:
+        for thread in threads:
+            # join with a timeout so signals still reach this thread
+            while thread.is_alive():
+                thread.join(0.1)
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+    if errors:
+        exc_type, exc_value, exc_traceback = errors[0]
+        raise exc_type, exc_value, exc_traceback
+    return results
@@ -0,0 +1,132 @@
+from datetime import timedelta
+
+from django.db import connection
+from djcelery.models import PeriodicTask
+
+from subscription.models import MessageSet, fill_max_sequence_numbers
+from subscription.schedules import run_times
+from subsend.models import SendWindow
+from subsend.plan import SEND_TASK, past_runs
+
+
+def load_cohorts(start):
+    """ Counts the subscriptions that will be sent messages by schedule,
+        message set and the sequence number they are next sent after
+        `start`, in one statement. Everyone in a cohort is sent the same
+        messages at the same times, so the forecast only has to follow the
+        cohorts.
+    """
+    cursor = connection.cursor()
+    cursor.execute(
+        """WITH past_runs AS (
+            SELECT schedule_id, array_agg(moment ORDER BY moment) AS moments
+            FROM unnest(%s::integer[], %s::timestamptz[])
+                AS r (schedule_id, moment)
+            GROUP BY schedule_id)
+        SELECT s.schedule_id, s.message_set_id, CASE
+                WHEN s.sequence_started_at IS NULL
+                THEN s.next_sequence_number
+                ELSE s.start_sequence_number + coalesce(
+                    cardinality(pr.moments)
+                    - width_bucket(s.sequence_started_at, pr.moments), 0)
+                END AS sequence_number,
+            count(*)
+        FROM subscription_subscription s
+        LEFT JOIN past_runs pr ON pr.schedule_id = s.schedule_id
+        WHERE s.active = true
+        AND s.completed = false
+        AND s.process_status != -1
+        GROUP BY s.schedule_id, s.message_set_id, 3""", past_runs(start))
+    cohorts = {}
+    for schedule_id, message_set_id, sequence_number, count in \
+            cursor.fetchall():
+        cohorts.setdefault(schedule_id, {})[
+            (message_set_id, sequence_number)] = count
+    return cohorts
+
+
+def spread(moment, count, minutes=None):
+    """ Splits `count` sends made at `moment` across the hours of a send
+        window of `minutes`, in proportion to how much of the window is in
+        each hour, as (hour, messages) pairs
+    """
+    hour = moment.replace(minute=0, second=0, microsecond=0)
+    if not minutes:
+        return [(hour, count)]
+    end = moment + timedelta(minutes=minutes)
+    shares = []
+    while hour < end:
+        next_hour = hour + timedelta(hours=1)
+        covered = (min(next_hour, end) - max(hour, moment)).total_seconds()
+        shares.append((hour, count * covered / (60 * minutes)))
+        hour = next_hour
+    return shares
+
+
+def forecast_sends(start, end):
+    """ Projects how many messages go out on each conversation in each hour
+        after `start` up to `end`, from the subscriptions there are now.
+        Subscriptions that finish a set carry on with its next set on that
+        set's default schedule, as they would when sent. Returns a dict of
+        (hour, conversation key) to messages, which are fractional for
+        schedules with a send window.
+    """
+    fill_max_sequence_numbers()
+    message_sets = dict(
+        (message_set.id, message_set)
+        for message_set in MessageSet.objects.all())
+    windows = dict(
+        (window.schedule_id, window.send_minutes())
+        for window in SendWindow.objects.all())
+    cohorts = load_cohorts(start)
+
+    def move_on(schedule_id, message_set_id, sequence_number, count):
+        # where a cohort is once it has been sent `sequence_number`
+        message_set = message_sets[message_set_id]
+        if sequence_number < (message_set.max_sequence_number or 0):
+            return schedule_id, (message_set_id, sequence_number + 1), count
+        if message_set.next_set_id is not None:
+            next_set = message_sets[message_set.next_set_id]
+            return next_set.default_schedule_id, (next_set.id, 1), count
+
+    # those already past the end of their set are moved on at the next run
+    moved = []
+    for schedule_id, schedule_cohorts in cohorts.items():
+        for (message_set_id, sequence_number), count in \
+                schedule_cohorts.items():
+            message_set = message_sets[message_set_id]
+            if sequence_number > (message_set.max_sequence_number or 0):
+                del schedule_cohorts[(message_set_id, sequence_number)]
+                moved.append(move_on(
+                    schedule_id, message_set_id, sequence_number, count))
+
+    runs = sorted(
+        (moment, periodic_task.id)
+        for periodic_task in PeriodicTask.objects.filter(
+            task=SEND_TASK, enabled=True).select_related(
+            "crontab", "interval")
+        for moment in run_times(periodic_task, start, end))
+
+    volume = {}
+    moved_at = None
+    for moment, schedule_id in runs:
+        if moment != moved_at:
+            # cohorts moved on by earlier runs join their new schedule
+            for move in moved:
+                if move is not None:
+                    schedule, key, count = move
+                    cohort = cohorts.setdefault(schedule, {})
+                    cohort[key] = cohort.get(key, 0) + count
+            moved = []
+        for (message_set_id, sequence_number), count in \
+                cohorts.pop(schedule_id, {}).items():
+            conversation_key = \
+                message_sets[message_set_id].conversation_key
+            for hour, share in spread(
+                    moment, count, windows.get(schedule_id)):
+                volume[(hour, conversation_key)] = \
+                    volume.get((hour, conversation_key), 0) + share
+            moved.append(move_on(
+                schedule_id, message_set_id, sequence_number, count))
+        moved_at = moment
+    return volume
@@ -0,0 +1,55 @@
+from optparse import make_option
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.timezone import utc
+
+from subsend.forecast import forecast_sends
+
+
+class Command(BaseCommand):
+    help = "Forecast the messages sent each hour on each conversation"
+
+    option_list = BaseCommand.option_list + (
+        make_option('--start', dest='start', default=None,
+                    help='First day to forecast as YYYY-MM-DD, tomorrow by '
+                         'default'),
+        make_option('--days', dest='days', type='int', default=7,
+                    help='How many days to forecast'),
+    )
+
+    def get_now(self):
+        return datetime.now()
+
+    def handle(self, *args, **options):
+        if options["start"] is not None:
+            try:
+                start = datetime.strptime(options["start"], "%Y-%m-%d")
+            except ValueError:
+                raise CommandError("Start must be YYYY-MM-DD")
+        else:
+            start = datetime.combine(
+                self.get_now().date() + timedelta(days=1), datetime.min.time())
+        if options["days"] < 1:
+            raise CommandError("Days must be at least 1")
+        start = start.replace(tzinfo=utc)
+        # runs at exactly midnight belong to the first day
+        volume = forecast_sends(
+            start - timedelta(microseconds=1),
+            start + timedelta(days=options["days"], microseconds=-1))
+
+        self.stdout.write("Forecast for %s days from %s\n" % (
+            options["days"], start.date()))
+        hours = {}
+        for (hour, conversation_key), messages in sorted(volume.items()):
+            messages = int(round(messages))
+            if not messages:
+                continue
+            self.stdout.write("%s %s: %s\n" % (
+                hour.strftime("%Y-%m-%d %H:%M"), conversation_key, messages))
+            hours[hour] = hours.get(hour, 0) + messages
+        if hours:
+            busiest = max(sorted(hours), key=lambda hour: hours[hour])
+            self.stdout.write("Busiest hour: %s with %s\n" % (
+                busiest.strftime("%Y-%m-%d %H:%M"), hours[busiest]))
+        self.stdout.write("Total: %s\n" % sum(hours.values()))
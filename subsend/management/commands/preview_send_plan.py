@@ -0,0 +1,41 @@
+from optparse import make_option
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+
+from subsend.plan import build_send_plan, preview_send_plan
+
+
+class Command(BaseCommand):
+    help = "Show the messages planned for a day per message set and language"
+
+    option_list = BaseCommand.option_list + (
+        make_option('--date', dest='date', default=None,
+                    help='Day to preview as YYYY-MM-DD, tomorrow by default'),
+        make_option('--build', action='store_true', default=False,
+                    help='Build the plan for the day first'),
+    )
+
+    def get_now(self):
+        return datetime.now()
+
+    def handle(self, *args, **options):
+        if options["date"] is not None:
+            try:
+                date = datetime.strptime(options["date"], "%Y-%m-%d").date()
+            except ValueError:
+                raise CommandError("Date must be YYYY-MM-DD")
+        else:
+            date = self.get_now().date() + timedelta(days=1)
+
+        if options["build"]:
+            build_send_plan(date)
+
+        self.stdout.write("Send plan for %s\n" % date)
+        total = 0
+        for short_name, lang, messages, completing in \
+                preview_send_plan(date):
+            self.stdout.write("%s %s: %s messages, %s completing\n" % (
+                short_name, lang, messages, completing))
+            total += messages
+        self.stdout.write("Total: %s\n" % total)
@@ -0,0 +1,76 @@
+from datetime import datetime
+
+from django.core.management.base import CommandError
+from django.test import TestCase
+from django.utils.timezone import utc
+
+from StringIO import StringIO
+
+from subsend.management.commands import forecast_sends
+from subsend.models import SendWindow
+from subscription.models import Subscription
+
+
+class TestForecastSendsCommand(TestCase):
+
+    fixtures = ["test_initialdata.json", "test_subsend.json"]
+
+    def setUp(self):
+        self.command = self.mk_command()
+
+    def mk_command(self):
+        command = forecast_sends.Command()
+        command.stdout = StringIO()
+        # set the date so tests continue to work in the future
+        command.get_now = lambda *a: datetime(2014, 12, 7)
+        return command
+
+    def test_forecast_week(self):
+        self.command.handle(start=None, days=7)
+        self.assertEqual(self.command.stdout.getvalue().strip().split('\n'), [
+            "Forecast for 7 days from 2014-12-08",
+            "2014-12-08 07:00 replaceme_momconnect: 1",
+            "2014-12-08 07:00 replaceme_nurseconnect: 1",
+            "2014-12-08 08:00 replaceme_momconnect: 3",
+            "2014-12-09 07:00 replaceme_momconnect: 1",
+            "2014-12-09 08:00 replaceme_momconnect: 2",
+            "2014-12-10 07:00 replaceme_nurseconnect: 1",
+            "2014-12-11 07:00 replaceme_momconnect: 1",
+            "2014-12-12 07:00 replaceme_nurseconnect: 1",
+            "Busiest hour: 2014-12-08 08:00 with 3",
+            "Total: 11",
+        ])
+
+    def test_forecast_send_window(self):
+        # 08:15 to 10:15
+        SendWindow.objects.create(schedule_id=6, minutes=120)
+        self.command.handle(start="2014-12-09", days=1)
+        self.assertEqual(self.command.stdout.getvalue().strip().split('\n'), [
+            "Forecast for 1 days from 2014-12-09",
+            "2014-12-09 07:00 replaceme_momconnect: 1",
+            "2014-12-09 08:00 replaceme_momconnect: 1",
+            "2014-12-09 09:00 replaceme_momconnect: 2",
+            "Busiest hour: 2014-12-09 09:00 with 2",
+            "Total: 4",
+        ])
+
+    def test_forecast_computed_sequence(self):
+        # the same as next_sequence_number=3 after two weekday runs
+        Subscription.objects.filter(pk=5).update(
+            next_sequence_number=1, start_sequence_number=1,
+            sequence_started_at=datetime(2014, 12, 4, 8, tzinfo=utc))
+        self.command.handle(start=None, days=7)
+        computed = self.command.stdout.getvalue()
+
+        Subscription.objects.filter(pk=5).update(
+            next_sequence_number=3, sequence_started_at=None)
+        command = self.mk_command()
+        command.handle(start=None, days=7)
+        self.assertEqual(computed, command.stdout.getvalue())
+        self.assertNotIn("Total: 11", computed)
+
+    def test_bad_start(self):
+        self.assertRaises(
+            CommandError, self.command.handle, start="09/12/2014", days=7)
+        self.assertRaises(
+            CommandError, self.command.handle, start=None, days=0)
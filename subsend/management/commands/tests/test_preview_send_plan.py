@@ -0,0 +1,48 @@
+from datetime import datetime
+
+from django.core.management.base import CommandError
+from django.test import TestCase
+
+from StringIO import StringIO
+
+from subsend.management.commands import preview_send_plan
+from subsend.models import SendPlan
+
+
+class TestPreviewSendPlanCommand(TestCase):
+
+    fixtures = ["test_initialdata.json", "test_subsend.json"]
+
+    def setUp(self):
+        self.command = self.mk_command()
+
+    def mk_command(self):
+        command = preview_send_plan.Command()
+        command.stdout = StringIO()
+        # set the date so tests continue to work in the future
+        command.get_now = lambda *a: datetime(2014, 12, 7)
+        return command
+
+    def test_build_tomorrow(self):
+        self.command.handle(date=None, build=True)
+        self.assertEqual(self.command.stdout.getvalue().strip().split('\n'), [
+            "Send plan for 2014-12-08",
+            "accelerated en: 1 messages, 0 completing",
+            "baby1 af: 1 messages, 0 completing",
+            "baby2 en: 2 messages, 1 completing",
+            "nurseconnect en: 1 messages, 0 completing",
+            "Total: 5",
+        ])
+
+    def test_preview_without_building(self):
+        self.command.handle(date="2014-12-08", build=False)
+        self.assertEqual(SendPlan.objects.count(), 0)
+        self.assertEqual(self.command.stdout.getvalue().strip().split('\n'), [
+            "Send plan for 2014-12-08",
+            "Total: 0",
+        ])
+
+    def test_bad_date(self):
+        self.assertRaises(
+            CommandError, self.command.handle, date="08/12/2014",
+            build=False)
@@ -1 +1,132 @@
-# Create your models here.
+from django.conf import settings
+from django.core.validators import MaxValueValidator
+from django.db import models
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from djcelery.models import PeriodicTask
+
+from subscription.models import Subscription, MessageSet, Message, \
+    AutoNewDateTimeField, AutoDateTimeField
+from subsend.cache import invalidate_message
+
+
+class FanoutCheckpoint(models.Model):
+    """ How far the process_message_queue task currently fanning out a
+        schedule has got, so it can carry on from there if it is
+        redelivered after its worker died
+    """
+    schedule = models.OneToOneField(PeriodicTask,
+                                    related_name='fanout_checkpoint')
+    task_id = models.CharField(max_length=255)
+    last_id = models.IntegerField(default=0)
+    created_at = AutoNewDateTimeField(blank=True)
+    updated_at = AutoDateTimeField(blank=True)
+
+    def __unicode__(self):
+        return "%s up to %s" % (self.schedule_id, self.last_id)
+
+
+class SendLedgerEntry(models.Model):
+    """ One attempt to send a subscription one of its messages. Written in
+        bulk by the send path and never updated. A subscription with ledger
+        entries can't be deleted, and deleting a message leaves its entries
+        with the sequence number that was sent.
+    """
+    SENT = 'sent'
+    OPTED_OUT = 'opted_out'
+    FAILED = 'failed'
+    ERRORED = 'errored'
+    STATUSES = (
+        (SENT, 'Sent'),
+        (OPTED_OUT, 'Opted out'),
+        (FAILED, 'Failed, will be retried'),
+        (ERRORED, 'Errored'),
+    )
+    subscription = models.ForeignKey(Subscription,
+                                     related_name='send_ledger',
+                                     null=False,
+                                     on_delete=models.PROTECT)
+    message = models.ForeignKey(Message,
+                                related_name='send_ledger',
+                                null=True, blank=True,
+                                on_delete=models.SET_NULL)
+    to_addr = models.CharField(max_length=255, db_index=True)
+    sequence_number = models.IntegerField()
+    status = models.CharField(max_length=10, choices=STATUSES)
+    latency = models.FloatField(
+        null=True, blank=True,
+        help_text="Seconds taken by the Vumi Go API call")
+    attempt = models.IntegerField(default=1)
+    created_at = AutoNewDateTimeField(blank=True, db_index=True)
+
+    class Meta:
+        index_together = [["subscription", "sequence_number"]]
+
+    def __unicode__(self):
+        return "%s %s to %s" % (
+            self.status, self.sequence_number, self.to_addr)
+
+
+class SendPlan(models.Model):
+    """ One message a subscription is due to be sent on a day, worked out
+        the night before by subsend.plan.build_send_plan. `tick` counts the
+        runs of the schedule that day, from 0.
+    """
+    date = models.DateField()
+    tick = models.IntegerField(default=0)
+    schedule = models.ForeignKey(PeriodicTask,
+                                 related_name='send_plan',
+                                 null=False)
+    subscription = models.ForeignKey(Subscription,
+                                     related_name='send_plan',
+                                     null=False)
+    message = models.ForeignKey(Message,
+                                related_name='send_plan',
+                                null=False)
+    message_set = models.ForeignKey(MessageSet,
+                                    related_name='send_plan',
+                                    null=False)
+    lang = models.CharField(max_length=3)
+    sequence_number = models.IntegerField()
+    conversation_key = models.CharField(max_length=255, null=True, blank=True)
+    completes_set = models.BooleanField(default=False)
+    next_set = models.ForeignKey(MessageSet,
+                                 related_name='+',
+                                 null=True, blank=True)
+
+    class Meta:
+        index_together = [["date", "schedule", "tick"]]
+
+    def __unicode__(self):
+        return "%s to %s on %s" % (
+            self.sequence_number, self.subscription_id, self.date)
+
+
+class SendWindow(models.Model):
+    """ Spreads the sends for a schedule over the `minutes` after each run
+        rather than making them all at once. Each number is given the same
+        slot in the window every time.
+    """
+    schedule = models.OneToOneField(PeriodicTask,
+                                    related_name='send_window')
+    minutes = models.PositiveIntegerField(
+        validators=[MaxValueValidator(settings.SUBSEND_MAX_WINDOW_MINUTES)],
+        help_text="How long after the schedule runs its sends are spread "
+                  "over, e.g. 180 for 08:00 to 11:00 on an 08:00 schedule")
+    created_at = AutoNewDateTimeField(blank=True)
+    updated_at = AutoDateTimeField(blank=True)
+
+    def send_minutes(self):
+        """ The window's length capped at SUBSEND_MAX_WINDOW_MINUTES """
+        return min(self.minutes, settings.SUBSEND_MAX_WINDOW_MINUTES)
+
+    def __unicode__(self):
+        return "%s over %s minutes" % (self.schedule_id, self.minutes)
+
+
+# Keep the worker message cache in step with edits made through the admin,
+# the message_edit view and CSV ingests
+@receiver(post_save, sender=Message)
+@receiver(post_delete, sender=Message)
+def invalidate_cached_message(sender, instance, **kwargs):
+    invalidate_message(instance)
@@ -0,0 +1,131 @@
+from datetime import datetime, timedelta
+
+from django.db import connection, transaction
+from django.db.models import Min
+from django.utils.timezone import utc
+from djcelery.models import PeriodicTask
+
+from subscription.models import Subscription, fill_max_sequence_numbers
+from subscription.schedules import count_runs, run_times, runs_on
+from subsend.models import SendPlan
+
+
+SEND_TASK = "subsend.tasks.process_message_queue"
+
+
+def schedule_runs(periodic_task, date):
+    """ How many times a send schedule runs on a date """
+    if not periodic_task.enabled:
+        return 0
+    if periodic_task.crontab is not None:
+        return runs_on(periodic_task.crontab.schedule, date)
+    if periodic_task.interval is not None:
+        # the runs from midnight up to but not including the next midnight
+        start = datetime(date.year, date.month, date.day, tzinfo=utc) - \
+            timedelta(microseconds=1)
+        return count_runs(periodic_task, start, start + timedelta(days=1))
+    return 0
+
+
+def past_runs(end, schedule=None):
+    """ Lists when each schedule with computed subscriptions ran, or just
+        `schedule`, from the earliest sequence_started_at on it up to and
+        including `end`, as (schedule ids, run times) arrays. How many of a
+        schedule's runs come after a subscription's sequence_started_at is
+        how far its computed position has moved on.
+    """
+    subscriptions = Subscription.objects.filter(
+        active=True, completed=False, sequence_started_at__isnull=False)
+    if schedule is not None:
+        subscriptions = subscriptions.filter(schedule=schedule)
+    earliest = dict(subscriptions.values_list("schedule").annotate(
+        Min("sequence_started_at")))
+    schedule_ids = []
+    times = []
+    for periodic_task in PeriodicTask.objects.filter(
+            pk__in=earliest).select_related("crontab", "interval"):
+        for moment in run_times(
+                periodic_task, earliest[periodic_task.id], end):
+            schedule_ids.append(periodic_task.id)
+            times.append(moment)
+    return schedule_ids, times
+
+
+def build_send_plan(date):
+    """ Works out every message due to be sent on a date in one statement
+        and stores it as that day's SendPlan, replacing any plan already
+        there. Returns the number of messages planned.
+    """
+    runs = dict(
+        (periodic_task.id, schedule_runs(periodic_task, date))
+        for periodic_task in PeriodicTask.objects.filter(task=SEND_TASK)
+        .select_related("crontab", "interval"))
+    runs = dict((key, value) for key, value in runs.items() if value)
+
+    with transaction.atomic():
+        SendPlan.objects.filter(date=date).delete()
+        if not runs:
+            return 0
+        fill_max_sequence_numbers()
+
+        # computed positions as they stand before the day's first run
+        start = datetime(date.year, date.month, date.day, tzinfo=utc)
+        cursor = connection.cursor()
+        cursor.execute(
+            """WITH past_runs AS (
+                SELECT schedule_id, array_agg(moment ORDER BY moment)
+                    AS moments
+                FROM unnest(%s::integer[], %s::timestamptz[])
+                    AS r (schedule_id, moment)
+                GROUP BY schedule_id)
+            INSERT INTO subsend_sendplan (
+                date, tick, schedule_id, subscription_id, message_id,
+                message_set_id, lang, sequence_number, conversation_key,
+                completes_set, next_set_id)
+            SELECT %s, t.tick, s.schedule_id, s.id, m.id,
+                s.message_set_id, s.lang, m.sequence_number,
+                ms.conversation_key,
+                m.sequence_number >= ms.max_sequence_number,
+                CASE WHEN m.sequence_number >= ms.max_sequence_number
+                    THEN ms.next_set_id END
+            FROM subscription_subscription s
+            JOIN (SELECT unnest(%s) AS schedule_id, unnest(%s) AS runs)
+                AS runs ON runs.schedule_id = s.schedule_id
+            JOIN generate_series(0, %s) AS t (tick)
+                ON t.tick < runs.runs
+            JOIN subscription_messageset ms ON ms.id = s.message_set_id
+            LEFT JOIN past_runs pr ON pr.schedule_id = s.schedule_id
+            JOIN subscription_message m
+                ON m.message_set_id = s.message_set_id
+                AND m.lang = s.lang
+                AND m.sequence_number = t.tick + CASE
+                    WHEN s.sequence_started_at IS NULL
+                    THEN s.next_sequence_number
+                    ELSE s.start_sequence_number + coalesce(
+                        cardinality(pr.moments)
+                        - width_bucket(s.sequence_started_at, pr.moments),
+                        0) END
+            WHERE s.active = true
+            AND s.completed = false
+            AND s.process_status != -1""",
+            list(past_runs(start - timedelta(microseconds=1))) +
+            [date, list(runs.keys()), list(runs.values()),
+             max(runs.values()) - 1])
+        return cursor.rowcount
+
+
+def preview_send_plan(date):
+    """ Returns (message set, language, messages, completing) for the plan
+        on a date, where completing counts the subscriptions that will
+        reach the end of their set
+    """
+    cursor = connection.cursor()
+    cursor.execute(
+        """SELECT ms.short_name, p.lang, count(*),
+            sum(CASE WHEN p.completes_set THEN 1 ELSE 0 END)
+        FROM subsend_sendplan p
+        JOIN subscription_messageset ms ON ms.id = p.message_set_id
+        WHERE p.date = %s
+        GROUP BY ms.short_name, p.lang
+        ORDER BY ms.short_name, p.lang""", [date])
+    return [tuple(row) for row in cursor.fetchall()]
@@ -0,0 +1,143 @@
+import logging
+import time
+from threading import Lock
+
+import redis
+
+import control.settings as settings
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket(object):
+    """ A token bucket for one process. Holds up to `capacity` tokens and
+        refills at `rate` tokens per second.
+    """
+
+    def __init__(self, rate, capacity=None, clock=time.time,
+                 sleep=time.sleep):
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self.clock = clock
+        self.sleep = sleep
+        self.tokens = self.capacity
+        self.updated_at = clock()
+        self._lock = Lock()
+
+    def reserve(self, tokens=1):
+        """ Takes tokens from the bucket, going into debt if needed, and
+            returns how many seconds the caller must wait before using them
+        """
+        with self._lock:
+            now = self.clock()
+            self.tokens = min(
+                self.capacity,
+                self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            self.tokens -= tokens
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def acquire(self, tokens=1):
+        """ Blocks until the tokens are available and returns the seconds
+            spent waiting
+        """
+        wait = self.reserve(tokens)
+        if wait > 0:
+            self.sleep(wait)
+        return wait
+
+
+class RedisTokenBucket(TokenBucket):
+    """ A token bucket kept in Redis so all workers on all machines share
+        the same budget
+    """
+
+    SCRIPT = """
+    local rate = tonumber(ARGV[1])
+    local capacity = tonumber(ARGV[2])
+    local now = tonumber(ARGV[3])
+    local requested = tonumber(ARGV[4])
+    local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+    local tokens = tonumber(state[1]) or capacity
+    local ts = tonumber(state[2]) or now
+    if now < ts then now = ts end
+    tokens = math.min(capacity, tokens + (now - ts) * rate) - requested
+    redis.call('HMSET', KEYS[1], 'tokens', tokens, 'ts', now)
+    redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 60)
+    if tokens >= 0 then return '0' end
+    return tostring(-tokens / rate)
+    """
+
+    def __init__(self, client, key, rate, capacity=None, clock=time.time,
+                 sleep=time.sleep):
+        super(RedisTokenBucket, self).__init__(
+            rate, capacity=capacity, clock=clock, sleep=sleep)
+        self.key = key
+        self.script = client.register_script(self.SCRIPT)
+
+    def reserve(self, tokens=1):
+        try:
+            return float(self.script(
+                keys=[self.key],
+                args=[self.rate, self.capacity, self.clock(), tokens]))
+        except redis.RedisError:
+            # Rather send unthrottled than not at all
+            logger.warning(
+                'Rate limiter unavailable for %s' % self.key, exc_info=True)
+            return 0.0
+
+
+_lock = Lock()
+_buckets = {}
+_client = None
+
+
+def get_rate(conversation_key):
+    return settings.VUMI_GO_RATE_LIMITS.get(
+        conversation_key, settings.VUMI_GO_DEFAULT_RATE_LIMIT)
+
+
+def slowest_rate():
+    """ The lowest rate any conversation is limited to, or None if no
+        conversation is rate limited
+    """
+    rates = [rate for rate in list(settings.VUMI_GO_RATE_LIMITS.values()) +
+             [settings.VUMI_GO_DEFAULT_RATE_LIMIT] if rate]
+    return min(rates) if rates else None
+
+
+def get_bucket(conversation_key):
+    """ Returns the token bucket for a conversation, or None if sends to
+        it are not rate limited
+    """
+    global _client
+    rate = get_rate(conversation_key)
+    if not rate:
+        return None
+    with _lock:
+        bucket = _buckets.get(conversation_key)
+        if bucket is None or bucket.rate != rate:
+            capacity = rate * settings.VUMI_GO_RATE_LIMIT_BURST
+            if settings.VUMI_GO_RATE_LIMIT_REDIS_URL:
+                if _client is None:
+                    _client = redis.StrictRedis.from_url(
+                        settings.VUMI_GO_RATE_LIMIT_REDIS_URL)
+                bucket = RedisTokenBucket(
+                    _client, "subsend:ratelimit:%s" % conversation_key,
+                    rate, capacity=capacity)
+            else:
+                bucket = TokenBucket(rate, capacity=capacity)
+            _buckets[conversation_key] = bucket
+    return bucket
+
+
+def acquire(conversation_key, tokens=1):
+    """ Waits until a message may be sent on a conversation and returns the
+        seconds spent waiting
+    """
+    bucket = get_bucket(conversation_key)
+    if bucket is None:
+        return 0.0
+    return bucket.acquire(tokens)
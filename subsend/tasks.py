@@ -1,14 +1,31 @@
+import math
+import time
+from datetime import timedelta
+
 from celery import task
 from celery.utils.log import get_task_logger
 from celery.exceptions import SoftTimeLimitExceeded
-from django.db.models import Max
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
 from django.core.exceptions import ObjectDoesNotExist
 
-from go_http.send import HttpApiSender
-from requests.exceptions import HTTPError
+from requests.exceptions import HTTPError, RequestException
 from go_http.exceptions import UserOptedOutException
 import control.settings as settings
-from subscription.models import Subscription, Message
+from control.senders import get_sender
+from control.metrics import fire_metric, get_backend
+from subscription.models import Subscription, MessageSet, \
+    create_follow_on_subscriptions, fill_max_sequence_numbers
+from subscription.optouts import is_opted_out, record_optouts
+from subsend.cache import get_message, get_messages, preload_messages, \
+    pack_messages, unpack_messages
+from subsend.models import FanoutCheckpoint, SendLedgerEntry, SendPlan, \
+    SendWindow
+from subsend import ratelimit
+from subsend.engine import send_all
+from subsend.plan import build_send_plan, past_runs
+from subsend.windows import SLOT_OFFSET_SQL, split_rows, window_slot
 
 logger = get_task_logger(__name__)
 
@@ -16,13 +33,7 @@ logger = get_task_logger(__name__)
 @task(ignore_result=True)
 def vumi_fire_metric(metric, value, agg, sender=None):
     try:
-        if sender is None:
-            sender = HttpApiSender(
-                account_key=settings.VUMI_GO_ACCOUNT_KEY,
-                conversation_key=settings.VUMI_GO_CONVERSATION_KEY,
-                conversation_token=settings.VUMI_GO_ACCOUNT_TOKEN
-            )
-        sender.fire_metric(metric, value, agg=agg)
+        get_backend().fire(metric, value, agg, sender)
         return sender
     except SoftTimeLimitExceeded:
         logger.error(
@@ -31,55 +42,301 @@ def vumi_fire_metric(metric, value, agg, sender=None):
             exc_info=True)
 
 
-@task(ignore_result=True)
-def process_message_queue(schedule, sender=None):
-    # Get all active and incomplete subscribers for schedule
-    subscribers = Subscription.objects.filter(
-        schedule=schedule, active=True, completed=False,
-        process_status=0).all()
+def claim_subscriptions(schedule, after_id=0, limit=None, runs=None):
+    """
+    Moves a chunk of due subscriptions for a schedule from Ready to
+    In Process in a single statement. Rows are claimed in id order starting
+    after `after_id` and a list of (id, sequence number) pairs is returned
+    in that order, where the sequence number is the message to send. Each
+    pair is the idempotency key for sending that subscription its message
+    this tick.
+    """
+    return [row[:2] for row in claim_subscription_rows(
+        schedule, after_id=after_id, limit=limit, runs=runs)]
 
-    # Fire off message processor for each
-    for subscriber in subscribers:
-        subscriber.process_status = 1  # In Proceses
-        subscriber.save()
-        send_message.delay(subscriber, sender)
-        processes_message.delay(subscriber, sender)
-    total_sent = subscribers.count()
-    vumi_fire_metric.delay(
+
+# The sequence number a claimed subscription is sent. Subscriptions whose
+# position is worked out from their schedule have the number due at the
+# schedule's latest run, from the past_runs CTE, capped at the end of their
+# set. The claim stores it as next_sequence_number, so their idempotency
+# keys change with every run and a batch sends what was due when it was
+# claimed however long it waits.
+CLAIMED_SEQUENCE_SQL = """CASE WHEN s.sequence_started_at IS NULL
+            THEN s.next_sequence_number
+            ELSE LEAST(
+                s.start_sequence_number + GREATEST(0, coalesce(
+                    cardinality(pr.moments)
+                    - width_bucket(s.sequence_started_at, pr.moments),
+                    0) - 1),
+                ms.max_sequence_number) END"""
+
+PAST_RUNS_SQL = """past_runs AS (
+            SELECT schedule_id, array_agg(moment ORDER BY moment) AS moments
+            FROM unnest(%s::integer[], %s::timestamptz[])
+                AS r (schedule_id, moment)
+            GROUP BY schedule_id)"""
+
+
+def claim_subscription_rows(schedule, after_id=0, limit=None, runs=None,
+                            slot=None, created_before=None):
+    """
+    Claims like claim_subscriptions but returns (id, sequence number,
+    message_set_id, lang, to_addr) for each row so the caller knows which
+    messages will be sent and to whom. `runs` is past_runs for the
+    schedule up to the tick, looked up again for every chunk if not given.
+    `slot` is a (window seconds, start, end) from window_slot to only claim
+    the numbers sent in that slot of a send window, and `created_before`
+    leaves out subscriptions created after it.
+    """
+    schedule = getattr(schedule, "pk", schedule)
+    if runs is None:
+        runs = past_runs(timezone.now(), schedule)
+    conditions = ""
+    params = []
+    if created_before is not None:
+        conditions += " AND s.created_at <= %s"
+        params.append(created_before)
+    if slot is not None:
+        seconds, start, end = slot
+        conditions += " AND " + SLOT_OFFSET_SQL + " >= %s"
+        params.extend([seconds, start])
+        if end is not None:
+            conditions += " AND " + SLOT_OFFSET_SQL + " < %s"
+            params.extend([seconds, end])
+    cursor = connection.cursor()
+    cursor.execute(
+        """WITH """ + PAST_RUNS_SQL + """,
+        due AS (
+            SELECT s.id, """ + CLAIMED_SEQUENCE_SQL + """ AS sequence_number
+            FROM subscription_subscription s
+            JOIN subscription_messageset ms ON ms.id = s.message_set_id
+            LEFT JOIN past_runs pr ON pr.schedule_id = s.schedule_id
+            WHERE s.schedule_id = %s
+            AND s.active = true
+            AND s.completed = false
+            AND s.process_status = 0
+            AND s.id > %s""" + conditions + """
+            ORDER BY s.id
+            LIMIT %s)
+        UPDATE subscription_subscription s
+        SET process_status = 1, updated_at = now(),
+            next_sequence_number = due.sequence_number
+        FROM due
+        WHERE s.id = due.id
+        AND s.process_status = 0
+        RETURNING s.id, s.next_sequence_number, s.message_set_id, s.lang,
+            s.to_addr""",
+        list(runs) + [schedule, after_id] + params + [limit])
+    return sorted(tuple(row) for row in cursor.fetchall())
+
+
+def batch_messages(messages, rows):
+    """
+    Packs the messages that a batch of rows from claim_subscription_rows
+    will be sent, to go along with the batch.
+    """
+    keys = set((row[2], row[3], row[1]) for row in rows)
+    return pack_messages(dict(
+        (key, messages[key]) for key in keys if key in messages))
+
+
+def start_checkpoint(schedule, task_id):
+    """
+    Returns the id to resume claiming after for this run of
+    process_message_queue. A checkpoint left by the same task means it was
+    redelivered after a crash and carries on from where it stopped. A
+    checkpoint left by any other task belongs to an earlier tick that never
+    finished and is started over.
+    """
+    checkpoint, created = FanoutCheckpoint.objects.get_or_create(
+        schedule_id=schedule, defaults={"task_id": task_id})
+    if checkpoint.task_id != task_id:
+        checkpoint.task_id = task_id
+        checkpoint.last_id = 0
+        checkpoint.save()
+    return checkpoint.last_id
+
+
+def complete_finished_subscriptions(schedule=None, sender=None):
+    """
+    Completes, in one statement, every Ready subscription that has already
+    been sent the last message in its set, for one schedule or all of them,
+    and bulk creates their follow-on subscriptions in the same transaction.
+    Catches subscriptions moved past the end of their set outside the send
+    path, for example by set_seq or by messages being removed from a set,
+    including those whose position is worked out from their schedule.
+    Returns the number completed.
+    """
+    fill_max_sequence_numbers()
+    with transaction.atomic():
+        cursor = connection.cursor()
+        cursor.execute(
+            """UPDATE subscription_subscription s
+            SET completed = true, active = false, process_status = 2,
+                updated_at = now()
+            FROM subscription_messageset ms
+            WHERE ms.id = s.message_set_id
+            AND (%s::integer IS NULL OR s.schedule_id = %s)
+            AND s.active = true
+            AND s.completed = false
+            AND s.process_status = 0
+            AND s.next_sequence_number > ms.max_sequence_number
+            RETURNING s.id""",
+            [getattr(schedule, "pk", schedule),
+             getattr(schedule, "pk", schedule)])
+        completed = [row[0] for row in cursor.fetchall()]
+        new_subscriptions = create_follow_on_subscriptions(
+            Subscription.objects.filter(id__in=completed)
+            .select_related("message_set__next_set"))
+    fire_auto_metrics(new_subscriptions, sender)
+    return len(completed)
+
+
+@task(bind=True, acks_late=True, ignore_result=True)
+def process_message_queue(self, schedule, sender=None):
+    # Subscriptions that are already past the end of their set are moved
+    # on to their next set first, so the tick never claims them
+    complete_finished_subscriptions(schedule, sender)
+    if settings.SUBSEND_QUEUE_MODE == "pull":
+        # Queue everyone due and let drainers on any worker pull them
+        total_sent = queue_subscriptions(schedule)
+        if total_sent:
+            for _ in range(settings.SUBSEND_DRAIN_TASKS):
+                drain_message_queue.delay(schedule, sender)
+        fire_metric(
+            metric="%s.sum.sms.subscription.outbound" %
+            settings.VUMI_GO_METRICS_PREFIX,
+            value=total_sent, agg="sum", sender=sender)
+        return total_sent
+
+    # Claim active and incomplete subscribers for schedule a chunk at a
+    # time. Chunks are walked in id order so rows that have already been
+    # processed and reset to Ready during this tick are not claimed again.
+    # The last claimed id is checkpointed before each chunk is handed out
+    # so a redelivered task never claims a row twice in the same tick.
+    # Schedules with a SendWindow are spread over it a slot at a time by
+    # send_window_slot instead.
+    schedule = getattr(schedule, "pk", schedule)
+    started_at = timezone.now()
+    if SendWindow.objects.filter(schedule_id=schedule).exists():
+        return send_window_slot(schedule, started_at, 0, sender)
+    last_id = start_checkpoint(schedule, self.request.id)
+
+    def checkpoint(last_id):
+        FanoutCheckpoint.objects.filter(schedule_id=schedule).update(
+            last_id=last_id)
+
+    total_sent = fan_out(
+        schedule, sender, past_runs(started_at, schedule), after_id=last_id,
+        on_chunk=checkpoint)
+    FanoutCheckpoint.objects.filter(schedule_id=schedule).delete()
+    fire_metric(
         metric="%s.sum.sms.subscription.outbound" %
         settings.VUMI_GO_METRICS_PREFIX,
         value=total_sent, agg="sum", sender=sender)
     return total_sent
 
 
+def fan_out(schedule, sender, runs, after_id=0, on_chunk=None, **claim):
+    """
+    Claims a schedule's due subscriptions a chunk at a time with
+    claim_subscription_rows, passing on `claim`, and hands them straight
+    to send_message_batch tasks. `on_chunk` is called with the last id of
+    each chunk before it is handed out. Every message for the (message
+    set, language) pairs claimed is loaded once and handed to the batches
+    with their subscriptions. Each batch only holds one conversation and
+    language so it is sent with one sender and one set of messages.
+    Returns the number claimed.
+    """
+    conversations = dict(
+        MessageSet.objects.values_list("id", "conversation_key"))
+    total_sent = 0
+    messages = {}
+    loaded_pairs = set()
+    while True:
+        rows = claim_subscription_rows(
+            schedule, after_id=after_id,
+            limit=settings.SUBSEND_CLAIM_CHUNK_SIZE, runs=runs, **claim)
+        if not rows:
+            break
+        after_id = rows[-1][0]
+        if on_chunk is not None:
+            on_chunk(after_id)
+        total_sent += len(rows)
+        pairs = set((row[2], row[3]) for row in rows) - loaded_pairs
+        messages.update(preload_messages(pairs))
+        loaded_pairs.update(pairs)
+
+        # Fire off a batched sender for each slice of the chunk
+        for batch in split_rows(
+                rows, settings.SUBSEND_BATCH_SIZE,
+                group=lambda row: (conversations.get(row[2]), row[3])):
+            dispatch_batch(
+                [row[:2] for row in batch], sender,
+                batch_messages(messages, batch))
+    return total_sent
+
+
+@task(bind=True, acks_late=True, ignore_result=True)
+def send_window_slot(self, schedule, started_at, offset, sender=None):
+    """
+    Claims and sends the subscriptions in the slot starting `offset`
+    seconds into the SendWindow of a schedule that ran at `started_at`,
+    then schedules the next slot for when it starts. Each number is sent
+    in the slot slot_offset gives it. Only the next slot ever waits in the
+    broker, so nothing waits longer than SUBSEND_WINDOW_SLOT_SIZE for its
+    ETA and the broker's visibility timeout never runs out on a waiting
+    task. Claims are atomic, so a redelivered slot sends nobody twice.
+    Subscriptions created after the schedule ran wait for its next run.
+    Returns the number claimed.
+    """
+    window = SendWindow.objects.filter(schedule_id=schedule).first()
+    # a window removed part way through sends everyone left
+    slot = window and window_slot(
+        offset, window.send_minutes(), settings.SUBSEND_WINDOW_SLOT_SIZE)
+    claimed = fan_out(
+        schedule, sender, past_runs(started_at, schedule), slot=slot,
+        created_before=started_at)
+    fire_metric(
+        metric="%s.sum.sms.subscription.outbound" %
+        settings.VUMI_GO_METRICS_PREFIX,
+        value=claimed, agg="sum", sender=sender)
+    if slot and slot[2] is not None:
+        send_window_slot.apply_async(
+            args=[schedule, started_at, slot[2], sender],
+            eta=started_at + timedelta(seconds=slot[2]))
+    return claimed
+
+
 @task(bind=True, time_limit=10, ignore_result=True)
 def send_message(self, subscriber, sender=None):
     try:
         # send message to subscriber
         try:
             # get message to send
-            message = Message.objects.get(
-                message_set=subscriber.message_set, lang=subscriber.lang,
-                sequence_number=subscriber.next_sequence_number)
+            message = get_message(
+                subscriber.message_set_id, subscriber.lang,
+                subscriber.next_sequence_number)
             # send message
             try:
+                if is_opted_out(subscriber):
+                    raise UserOptedOutException(
+                        subscriber.to_addr, message.content,
+                        'Opted out before sending')
                 if sender is None:
-                    sender = HttpApiSender(
-                        account_key=settings.VUMI_GO_ACCOUNT_KEY,
-                        conversation_key=subscriber.message_set
-                        .conversation_key,
-                        conversation_token=settings.VUMI_GO_ACCOUNT_TOKEN
-                    )
+                    sender = get_sender(
+                        subscriber.message_set.conversation_key)
+                ratelimit.acquire(subscriber.message_set.conversation_key)
                 response = sender.send_text(subscriber.to_addr,
                                             message.content)
                 # Fire NurseConnect metrics if applicable
                 if subscriber.message_set.short_name == 'nurseconnect':
-                    vumi_fire_metric.delay(
+                    fire_metric(
                         metric="%s.sum.nurseconnect.sms.outbound" %
                         settings.VUMI_GO_METRICS_PREFIX,
                         value=1, agg="sum", sender=sender)
                     if message.category:
-                        vumi_fire_metric.delay(
+                        fire_metric(
                             metric="%s.sum.nurseconnect.%s.sms.outbound" % (
                                 settings.VUMI_GO_METRICS_PREFIX,
                                 str(message.category)),
@@ -87,6 +344,7 @@ def send_message(self, subscriber, sender=None):
 
             except UserOptedOutException:
                 # user has opted out so deactivate subscription
+                record_optouts([subscriber.to_addr], "vumi")
                 subscriber.active = False
                 subscriber.save()
                 response = ('Subscription deactivated for %s' %
@@ -114,9 +372,7 @@ def processes_message(subscriber, sender, ignore_result=True):
         # Process moving to next message, next set or finished
         try:
             # Get set max
-            set_max = Message.objects.filter(
-                message_set=subscriber.message_set
-            ).aggregate(Max('sequence_number'))["sequence_number__max"]
+            set_max = subscriber.message_set.get_max_sequence_number()
             # Compare user position to max
             if subscriber.next_sequence_number == set_max:
                 # Mark current as completed
@@ -135,12 +391,15 @@ def processes_message(subscriber, sender, ignore_result=True):
                     subscriber.active = True
                     subscriber.completed = False
                     subscriber.next_sequence_number = 1
+                    # the new set's position starts afresh
+                    subscriber.sequence_started_at = None
+                    subscriber.start_sequence_number = None
                     subscription = subscriber
                     subscription.message_set = message_set.next_set
                     subscription.schedule = (
                         subscription.message_set.default_schedule)
                     subscription.save()
-                    vumi_fire_metric.delay(
+                    fire_metric(
                         metric="%s.sum.%s_auto" %
                         (settings.VUMI_GO_METRICS_PREFIX,
                          subscription.message_set.short_name),
@@ -160,3 +419,552 @@ def processes_message(subscriber, sender, ignore_result=True):
     except SoftTimeLimitExceeded:
         logger.error(
             'Soft time limit exceed updating subscription', exc_info=True)
+
+
+def get_set_maxes(message_sets):
+    """
+    Returns a dict of message set id to the last sequence number in that set
+    """
+    return dict(
+        (message_set.id, message_set.get_max_sequence_number())
+        for message_set in message_sets)
+
+
+def update_claimed(subscribers, assignments):
+    """
+    Applies the SQL `assignments` to the given In Process or Sending
+    subscribers and returns the ids of the rows that were changed. A row is
+    only changed if it is still In Process or Sending on the sequence number
+    it was loaded with, so applying the same transition twice is a no-op.
+    """
+    by_sequence_number = {}
+    for subscriber in subscribers:
+        by_sequence_number.setdefault(
+            subscriber.next_sequence_number, []).append(subscriber.id)
+    cursor = connection.cursor()
+    updated = []
+    for sequence_number, ids in sorted(by_sequence_number.items()):
+        cursor.execute(
+            """UPDATE subscription_subscription
+            SET %s, updated_at = now()
+            WHERE id = ANY(%%s)
+            AND next_sequence_number = %%s
+            AND process_status IN (1, 4)
+            RETURNING id""" % assignments, [ids, sequence_number])
+        updated.extend(row[0] for row in cursor.fetchall())
+    return set(updated)
+
+
+def advance_subscriptions(subscribers, sender=None, now=None):
+    """
+    Moves sent subscribers on to their next message in bulk. Subscribers at
+    the end of their message set are completed and, if the set has a
+    follow-on set, a new subscription is created for it. Subscribers whose
+    position is worked out from their schedule are only made Ready again,
+    as their next_sequence_number was pinned when they were claimed.
+    """
+    if not subscribers:
+        return
+    now = now or timezone.now()
+    set_maxes = get_set_maxes(
+        set(subscriber.message_set for subscriber in subscribers))
+    to_advance = []
+    to_release = []
+    to_complete = []
+    for subscriber in subscribers:
+        set_max = set_maxes.get(subscriber.message_set_id)
+        if set_max is not None and \
+                subscriber.next_sequence_number >= set_max:
+            to_complete.append(subscriber)
+        elif subscriber.sequence_started_at is not None:
+            to_release.append(subscriber)
+        else:
+            to_advance.append(subscriber)
+
+    with transaction.atomic():
+        # More in this set so interate by one
+        update_claimed(
+            to_advance,
+            "next_sequence_number = next_sequence_number + 1, "
+            "process_status = 0")  # Ready
+        update_claimed(to_release, "process_status = 0")  # Ready
+        completed = update_claimed(
+            to_complete,
+            "completed = true, active = false, "
+            "process_status = 2")  # Completed
+        new_subscriptions = create_follow_on_subscriptions(
+            [subscriber for subscriber in to_complete
+             if subscriber.id in completed], now=now)
+    fire_auto_metrics(new_subscriptions, sender)
+
+
+def fire_auto_metrics(new_subscriptions, sender=None):
+    auto_counts = {}
+    for subscription in new_subscriptions:
+        short_name = subscription.message_set.short_name
+        auto_counts[short_name] = auto_counts.get(short_name, 0) + 1
+    for short_name, count in auto_counts.items():
+        fire_metric(
+            metric="%s.sum.%s_auto" %
+            (settings.VUMI_GO_METRICS_PREFIX, short_name),
+            value=count, agg="sum", sender=sender)
+
+
+def load_claimed(claimed):
+    """
+    Moves the subscriptions for a list of (subscription id, sequence number)
+    idempotency keys from In Process to Sending in one statement and loads
+    them. Any that are no longer In Process on that sequence number are
+    left out, because they have already been dealt with or a redelivered
+    copy of the same batch is sending them.
+    """
+    claimed = sorted(set(tuple(key) for key in claimed))
+    if not claimed:
+        return []
+    cursor = connection.cursor()
+    cursor.execute(
+        """UPDATE subscription_subscription s
+        SET process_status = 4, updated_at = now()
+        FROM unnest(%s, %s) AS c (id, sequence_number)
+        WHERE s.id = c.id
+        AND s.next_sequence_number = c.sequence_number
+        AND s.process_status = 1
+        RETURNING s.id""",
+        [[key[0] for key in claimed], [key[1] for key in claimed]])
+    return list(
+        Subscription.objects.filter(
+            id__in=[row[0] for row in cursor.fetchall()])
+        .select_related("message_set", "message_set__next_set",
+                        "schedule__crontab", "schedule__interval")
+        .order_by("id"))
+
+
+def ledger_entry(subscriber, sequence_number, message, status, latency,
+                 attempt):
+    return SendLedgerEntry(
+        subscription_id=subscriber.id, message=message,
+        to_addr=subscriber.to_addr, sequence_number=sequence_number,
+        status=status, latency=latency, attempt=attempt)
+
+
+def send_status(error):
+    """ The send ledger status for a send that raised `error`, if any """
+    if isinstance(error, UserOptedOutException):
+        return SendLedgerEntry.OPTED_OUT
+    if error is None:
+        return SendLedgerEntry.SENT
+    if isinstance(error, HTTPError) and \
+            not 500 < error.response.status_code < 599:
+        return SendLedgerEntry.ERRORED
+    return SendLedgerEntry.FAILED
+
+
+def send_claimed(subscribers, sender=None, attempt=1, messages=None):
+    """
+    Sends each claimed subscriber its current message, up to
+    SUBSEND_SEND_CONCURRENCY at a time, and advances the ones that were
+    sent. Every attempt is written to the send ledger, a chunk of
+    SUBSEND_LEDGER_CHUNK_SIZE sends at a time as they finish. Returns the
+    number sent, the subscribers that should be tried again and the error
+    that caused the last retryable failure, if there was one. `messages`
+    are the messages to send keyed by (message_set_id, lang,
+    sequence_number), if the caller already has them.
+    """
+    # computed positions were pinned to next_sequence_number when claimed
+    due = dict(
+        (subscriber.id, subscriber.next_sequence_number)
+        for subscriber in subscribers)
+    keys = set(
+        (subscriber.message_set_id, subscriber.lang, due[subscriber.id])
+        for subscriber in subscribers)
+    messages = dict(messages or {})
+    # get any other messages to send, at most one query for cache misses
+    messages.update(get_messages(keys - set(messages)))
+
+    errored = []
+    skipped = []
+    jobs = []
+    for subscriber in subscribers:
+        message = messages.get((
+            subscriber.message_set_id, subscriber.lang, due[subscriber.id]))
+        if is_opted_out(subscriber):
+            # known to have opted out so don't ask Vumi
+            skipped.append((subscriber, message))
+        elif message is None:
+            logger.error(
+                'Missing subscription message for subscription %s' %
+                subscriber.id)
+            errored.append(subscriber)
+        else:
+            jobs.append((subscriber, message))
+
+    # one sender for each conversation in the batch, usually just the one
+    senders = dict(
+        (key, sender or get_sender(key)) for key in set(
+            subscriber.message_set.conversation_key
+            for subscriber, _ in jobs))
+
+    def send_one(job):
+        subscriber, message = job
+        conversation_key = subscriber.message_set.conversation_key
+        ratelimit.acquire(conversation_key)
+        started = time.time()
+        try:
+            senders[conversation_key].send_text(
+                subscriber.to_addr, message.content)
+        except UserOptedOutException as e:
+            return e, time.time() - started
+        except HTTPError as e:
+            if not 500 < e.response.status_code < 599:
+                logger.error(
+                    'Error sending to subscription %s' % subscriber.id,
+                    exc_info=True)
+            return e, time.time() - started
+        except RequestException as e:
+            # connection errors and timeouts are retried like a 5xx
+            logger.warning(
+                'Error sending to subscription %s' % subscriber.id,
+                exc_info=True)
+            return e, time.time() - started
+        return None, time.time() - started
+
+    sent = []
+    opted_out = []
+    failed = []
+    last_error = None
+    metric_counts = {}
+    conversation_counts = {}
+    ledger = [
+        ledger_entry(subscriber, due[subscriber.id], None,
+                     SendLedgerEntry.ERRORED, None, attempt)
+        for subscriber in errored]
+    for subscriber, message in skipped:
+        opted_out.append(subscriber)
+        ledger.append(ledger_entry(
+            subscriber, due[subscriber.id], message,
+            SendLedgerEntry.OPTED_OUT, None, attempt))
+    vumi_opted_out = []
+
+    def write_ledger():
+        if settings.SUBSEND_LEDGER_ENABLED and ledger:
+            SendLedgerEntry.objects.bulk_create(ledger)
+        del ledger[:]
+
+    write_ledger()
+    results = []
+    timed_out = False
+    started = time.time()
+    chunk_size = settings.SUBSEND_LEDGER_CHUNK_SIZE
+    for chunk_start in range(0, len(jobs), chunk_size):
+        chunk_results = []
+        try:
+            send_all(send_one, jobs[chunk_start:chunk_start + chunk_size],
+                     workers=settings.SUBSEND_SEND_CONCURRENCY,
+                     results=chunk_results)
+        except SoftTimeLimitExceeded:
+            logger.error(
+                ('Soft time limit exceed sending message batch to Vumi'
+                 ' HTTP API via Celery'), exc_info=True)
+            timed_out = True
+        finally:
+            # whatever stopped the chunk, record the sends that were made
+            results.extend(chunk_results)
+            ledger.extend(
+                ledger_entry(subscriber, due[subscriber.id], message,
+                             send_status(error), latency, attempt)
+                for (subscriber, message), (error, latency)
+                in chunk_results)
+            write_ledger()
+        if timed_out:
+            break
+        # show the reaper the batch is still alive. Only the rows still to
+        # be sent are touched so the ledger rows of those already sent are
+        # still newer than their claim.
+        update_claimed(
+            [job[0] for job in jobs[chunk_start + chunk_size:]],
+            "process_status = process_status")
+    elapsed = time.time() - started
+
+    for (subscriber, message), (error, _) in results:
+        status = send_status(error)
+        if status == SendLedgerEntry.OPTED_OUT:
+            # user has opted out so deactivate subscription
+            opted_out.append(subscriber)
+            vumi_opted_out.append(subscriber.to_addr)
+        elif status == SendLedgerEntry.FAILED:
+            # retry these on their own
+            failed.append(subscriber)
+            last_error = error
+        elif status == SendLedgerEntry.ERRORED:
+            errored.append(subscriber)
+        else:
+            sent.append(subscriber)
+        if status != SendLedgerEntry.SENT:
+            continue
+        conversation_key = subscriber.message_set.conversation_key or \
+            settings.VUMI_GO_CONVERSATION_KEY
+        conversation_counts[conversation_key] = \
+            conversation_counts.get(conversation_key, 0) + 1
+        # Count NurseConnect metrics if applicable
+        if subscriber.message_set.short_name == 'nurseconnect':
+            metrics = [
+                "%s.sum.nurseconnect.sms.outbound" %
+                settings.VUMI_GO_METRICS_PREFIX]
+            if message.category:
+                metrics.append(
+                    "%s.sum.nurseconnect.%s.sms.outbound" % (
+                        settings.VUMI_GO_METRICS_PREFIX,
+                        str(message.category)))
+            for metric in metrics:
+                metric_counts[metric] = metric_counts.get(metric, 0) + 1
+    if timed_out:
+        # not sent yet so leave them for the next run of the schedule
+        done = set(job for job, _ in results)
+        failed.extend(job[0] for job in jobs if job not in done)
+        last_error = None
+
+    record_optouts(vumi_opted_out, "vumi")
+    update_claimed(opted_out, "active = false, process_status = 0")
+    update_claimed(errored, "process_status = -1")  # Errored
+    for metric, count in sorted(metric_counts.items()):
+        fire_metric(
+            metric=metric, value=count, agg="sum", sender=sender)
+    for conversation_key, count in sorted(conversation_counts.items()):
+        # throughput of each conversation this batch sent on
+        fire_metric(
+            metric="%s.sum.sms.outbound.%s" % (
+                settings.VUMI_GO_METRICS_PREFIX, conversation_key),
+            value=count, agg="sum", sender=sender)
+        fire_metric(
+            metric="%s.avg.sms.outbound.%s.per_second" % (
+                settings.VUMI_GO_METRICS_PREFIX, conversation_key),
+            value=count / max(elapsed, 0.001), agg="avg", sender=sender)
+    advance_subscriptions(sent, sender)
+    return len(sent), failed, last_error
+
+
+def batch_time_limits(batch_size=None):
+    """
+    Returns the (soft, hard) time limits in seconds for a send_message_batch
+    task of `batch_size` subscriptions, sized from how long its sends take
+    and the slowest rate limit they may wait on.
+    """
+    batch_size = batch_size or settings.SUBSEND_BATCH_SIZE
+    seconds = batch_size * settings.SUBSEND_BATCH_SEND_TIME / float(
+        max(1, settings.SUBSEND_SEND_CONCURRENCY))
+    rate = ratelimit.slowest_rate()
+    if rate:
+        seconds += batch_size / float(rate)
+    soft_time_limit = int(math.ceil(seconds))
+    return soft_time_limit, \
+        soft_time_limit + settings.SUBSEND_BATCH_TIME_MARGIN
+
+
+BATCH_SOFT_TIME_LIMIT, BATCH_TIME_LIMIT = batch_time_limits()
+
+
+def claimed_keys(subscribers):
+    return [(subscriber.id, subscriber.next_sequence_number)
+            for subscriber in subscribers]
+
+
+@task(bind=True, soft_time_limit=BATCH_SOFT_TIME_LIMIT,
+      time_limit=BATCH_TIME_LIMIT, ignore_result=True)
+def send_message_batch(self, claimed, sender=None, messages=None):
+    """
+    Sends and advances a batch of claimed subscriptions. `claimed` is a list
+    of (subscription id, sequence number) idempotency keys as returned by
+    claim_subscriptions. A subscription is only sent to and advanced if it
+    is still In Process on that sequence number, so a retried or repeated
+    batch never sends the same message twice or skips a message.
+    Subscriptions that fail with a 5xx from Vumi are retried on their own.
+    `messages` is the batch's message content from pack_messages. Without
+    it messages are looked up in the worker cache.
+    """
+    sent, failed, last_error = send_claimed(
+        load_claimed(claimed), sender, attempt=self.request.retries + 1,
+        messages=unpack_messages(messages) if messages is not None else None)
+    if failed:
+        if last_error is not None and \
+                self.request.retries < self.max_retries:
+            # back to In Process so the retry can load them
+            update_claimed(failed, "process_status = 1")
+            raise self.retry(
+                args=[claimed_keys(failed), sender, messages],
+                exc=last_error, expires=batch_expires())
+        # Give up for now and let the next run of the schedule pick them up
+        update_claimed(failed, "process_status = 0")  # Ready
+    return sent
+
+
+def batch_expires():
+    """ When a batch handed out now is dropped if it has not started """
+    return timezone.now() + timedelta(seconds=settings.SUBSEND_BATCH_EXPIRES)
+
+
+def dispatch_batch(claimed, sender=None, messages=None):
+    """
+    Hands claimed subscriptions to a send_message_batch task that expires
+    after SUBSEND_BATCH_EXPIRES seconds. A batch stuck behind a backlog for
+    that long is dropped instead of run, so once its subscriptions have not
+    been seen for SUBSEND_STUCK_AFTER the reaper can recover them safely.
+    """
+    return send_message_batch.apply_async(
+        args=[claimed, sender, messages], expires=batch_expires())
+
+
+def queue_subscriptions(schedule):
+    """
+    Marks every due subscription for a schedule as Queued in one statement
+    so drain_message_queue tasks can pull them. Returns how many were
+    queued.
+    """
+    cursor = connection.cursor()
+    cursor.execute(
+        """UPDATE subscription_subscription
+        SET process_status = 3, updated_at = now()
+        WHERE schedule_id = %s
+        AND active = true
+        AND completed = false
+        AND process_status = 0""", [getattr(schedule, "pk", schedule)])
+    return cursor.rowcount
+
+
+def claim_queued_subscriptions(schedule=None, limit=None, runs=None):
+    """
+    Moves up to `limit` Queued subscriptions to In Process and returns their
+    (id, sequence number) idempotency keys. Rows locked by another
+    claim are skipped rather than waited on, so any number of workers can
+    claim at the same time and each row goes to exactly one of them. The
+    locking select is a CTE so it runs exactly once. `runs` is past_runs
+    as for claim_subscription_rows.
+    """
+    schedule = getattr(schedule, "pk", schedule)
+    if runs is None:
+        runs = past_runs(timezone.now(), schedule)
+    cursor = connection.cursor()
+    cursor.execute(
+        """WITH """ + PAST_RUNS_SQL + """,
+        queued AS (
+            SELECT s.id, """ + CLAIMED_SEQUENCE_SQL + """ AS sequence_number
+            FROM subscription_subscription s
+            JOIN subscription_messageset ms ON ms.id = s.message_set_id
+            LEFT JOIN past_runs pr ON pr.schedule_id = s.schedule_id
+            WHERE s.process_status = 3
+            AND (%s::integer IS NULL OR s.schedule_id = %s)
+            ORDER BY s.id
+            LIMIT %s
+            FOR UPDATE OF s SKIP LOCKED)
+        UPDATE subscription_subscription s
+        SET process_status = 1, updated_at = now(),
+            next_sequence_number = queued.sequence_number
+        FROM queued
+        WHERE s.id = queued.id
+        RETURNING s.id, s.next_sequence_number""",
+        list(runs) + [schedule, schedule, limit])
+    return sorted(tuple(row) for row in cursor.fetchall())
+
+
+@task(ignore_result=True, time_limit=900)
+def drain_message_queue(schedule=None, sender=None):
+    """
+    Repeatedly claims small batches of Queued subscriptions, for one
+    schedule or for all of them, and sends them until there are none left.
+    Start as many of these as there are workers to spare. Once it has been
+    running for SUBSEND_DRAIN_TIME_LIMIT seconds a drainer hands over to a
+    fresh task so no single task runs for too long.
+    """
+    total_sent = 0
+    started = time.time()
+    runs = past_runs(timezone.now(), schedule)
+    while True:
+        if time.time() - started > settings.SUBSEND_DRAIN_TIME_LIMIT:
+            drain_message_queue.delay(schedule, sender)
+            break
+        claimed = claim_queued_subscriptions(
+            schedule, limit=settings.SUBSEND_DRAIN_BATCH_SIZE, runs=runs)
+        if not claimed:
+            break
+        sent, failed, last_error = send_claimed(
+            load_claimed(claimed), sender)
+        total_sent += sent
+        if failed:
+            # leave retrying with backoff to a batch task
+            update_claimed(failed, "process_status = 1")  # In Process
+            dispatch_batch(claimed_keys(failed), sender)
+    return total_sent
+
+
+@task(ignore_result=True)
+def reap_stuck_subscriptions(sender=None):
+    """
+    Recovers subscriptions that have been In Process or Sending without
+    their batch being seen for longer than SUBSEND_STUCK_AFTER seconds,
+    usually because the worker handling them died. A row is seen when it is
+    claimed, when its batch starts and after each chunk of the batch is
+    sent. A batch that has not started within SUBSEND_BATCH_EXPIRES is
+    dropped and one that has started is stopped by its time limit, so by
+    then nothing can still send to the row. Those the send ledger shows
+    were sent their current message after they were claimed are advanced,
+    so they don't get it twice. The rest are reset to Ready
+    in one statement. The number recovered is fired as a metric. Queued
+    subscriptions are left Queued, and fresh drainers are started for the
+    schedules that have been waiting that long.
+    """
+    cutoff = timezone.now() - timedelta(seconds=settings.SUBSEND_STUCK_AFTER)
+    stuck = Q(updated_at__lt=cutoff)
+    sent = list(
+        Subscription.objects.filter(
+            stuck,
+            process_status__in=[1, 4],  # In Process or Sending
+            send_ledger__status=SendLedgerEntry.SENT,
+            send_ledger__sequence_number=F("next_sequence_number"),
+            send_ledger__created_at__gte=F("updated_at"))
+        .select_related("message_set", "message_set__next_set")
+        .distinct())
+    advance_subscriptions(sent, sender)
+
+    reset = Subscription.objects.filter(
+        stuck, process_status__in=[1, 4]).update(
+        process_status=0, updated_at=timezone.now())
+    reaped = len(sent) + reset
+    if reaped:
+        logger.warning('Recovered %s stuck subscriptions' % reaped)
+
+    # Queued rows are only waiting to be pulled, so rather than reset them
+    # start new drainers in case the ones pulling them have died
+    queued = Subscription.objects.filter(
+        process_status=3, updated_at__lt=cutoff)
+    schedules = sorted(set(queued.values_list("schedule", flat=True)))
+    if schedules:
+        requeued = queued.update(updated_at=timezone.now())
+        logger.warning(
+            'Restarting drainers for %s queued subscriptions' % requeued)
+        for schedule in schedules:
+            for _ in range(settings.SUBSEND_DRAIN_TASKS):
+                drain_message_queue.delay(schedule, sender)
+    fire_metric(
+        metric="%s.sum.sms.subscription.reaped" %
+        settings.VUMI_GO_METRICS_PREFIX,
+        value=reaped, agg="sum", sender=sender)
+    return reaped
+
+
+@task(ignore_result=True)
+def plan_sends(date=None, sender=None):
+    """
+    Builds the send plan for a date, tomorrow by default, so ops can see
+    the coming day's volume per message set and language. Plans for days
+    that have already passed are dropped. Fires the number of messages
+    planned as a metric.
+    """
+    today = timezone.localtime(timezone.now()).date()
+    if date is None:
+        date = today + timedelta(days=1)
+    SendPlan.objects.filter(date__lt=today).delete()
+    planned = build_send_plan(date)
+    fire_metric(
+        metric="%s.last.sms.subscription.planned" %
+        settings.VUMI_GO_METRICS_PREFIX,
+        value=planned, agg="last", sender=sender)
+    return planned
@@ -2,20 +2,46 @@
 
 import json
 import logging
+from datetime import date, datetime, timedelta
 import responses
+from celery.exceptions import SoftTimeLimitExceeded
 import control.settings as settings
+from django.core.exceptions import ValidationError
+from django.db import connection
+from django.db.models import ProtectedError
 from django.test import TestCase
+from django.utils import timezone
+from django.utils.timezone import utc
 from django.test.utils import override_settings
 
 from requests_testadapter import TestAdapter, TestSession
-from requests.exceptions import HTTPError
+from requests.exceptions import ConnectionError, HTTPError
 from go_http.exceptions import UserOptedOutException
 
 from go_http.send import HttpApiSender, LoggingSender
 from subsend.tasks import (process_message_queue, processes_message,
-                           vumi_fire_metric, send_message)
-from subscription.models import Subscription, MessageSet
-from djcelery.models import PeriodicTask
+                           vumi_fire_metric, send_message,
+                           claim_subscriptions, send_message_batch,
+                           advance_subscriptions, queue_subscriptions,
+                           claim_queued_subscriptions, drain_message_queue,
+                           reap_stuck_subscriptions, plan_sends,
+                           complete_finished_subscriptions,
+                           batch_time_limits, send_claimed, load_claimed,
+                           claim_subscription_rows)
+from subsend.cache import (LRUCache, message_cache, get_message,
+                           get_messages, preload_messages, pack_messages,
+                           unpack_messages)
+from subsend import ratelimit
+from subsend.engine import send_all
+from subsend.models import FanoutCheckpoint, SendLedgerEntry, SendPlan, \
+    SendWindow
+from subsend.windows import SLOT_OFFSET_SQL, slot_offset, split_rows, \
+    window_slot
+from subsend.plan import build_send_plan, preview_send_plan, schedule_runs, \
+    past_runs
+from subscription.models import Subscription, MessageSet, Message, OptOut
+from subscription.optouts import registry, record_optouts
+from djcelery.models import PeriodicTask, CrontabSchedule, IntervalSchedule
 
 
 class TestMessageQueueProcessor(TestCase):
@@ -31,8 +57,16 @@ class TestMessageQueueProcessor(TestCase):
         logger.setLevel(logging.INFO)
         logger.addHandler(self.handler)
 
+    @property
+    def logs(self):
+        # leave out the per conversation throughput, which is timing based
+        return [log for log in self.handler.logs or []
+                if not log.msg.startswith((
+                    "Metric: u'prd.avg.sms.outbound.",
+                    "Metric: u'prd.sum.sms.outbound."))]
+
     def check_logs(self, msg, levelno=logging.INFO):
-        [log] = self.handler.logs
+        [log] = self.logs
         self.assertEqual(log.msg, msg)
         self.assertEqual(log.levelno, levelno)
 
@@ -56,9 +90,58 @@ class TestMessageQueueProcessor(TestCase):
         result = process_message_queue.delay(schedule, self.sender)
         self.assertEquals(result.get(), 2)
         self.assertEqual(
-            self.handler.logs[2].msg,
+            self.logs[2].msg,
             "Metric: 'prd.sum.sms.subscription.outbound' [sum] -> 2")
 
+    def test_multisend_in_chunks(self):
+        chunk_size = settings.SUBSEND_CLAIM_CHUNK_SIZE
+        settings.SUBSEND_CLAIM_CHUNK_SIZE = 1
+        try:
+            result = process_message_queue.delay(6, self.sender)
+        finally:
+            settings.SUBSEND_CLAIM_CHUNK_SIZE = chunk_size
+        self.assertEquals(result.get(), 2)
+        subscriber_updated = Subscription.objects.get(pk=2)
+        self.assertEquals(subscriber_updated.next_sequence_number, 2)
+        self.assertEquals(subscriber_updated.process_status, 0)
+
+    def test_multisend_clears_checkpoint(self):
+        process_message_queue.delay(6, self.sender)
+        self.assertEqual(FanoutCheckpoint.objects.count(), 0)
+
+    def test_multisend_resumes_from_checkpoint(self):
+        FanoutCheckpoint.objects.create(
+            schedule_id=6, task_id="crashed-task", last_id=2)
+        result = process_message_queue.apply(
+            args=[6, self.sender], task_id="crashed-task")
+        self.assertEquals(result.get(), 1)
+        # Rows before the checkpoint are left alone
+        subscriber_updated = Subscription.objects.get(pk=2)
+        self.assertEquals(subscriber_updated.next_sequence_number, 1)
+        subscriber_updated = Subscription.objects.get(pk=4)
+        self.assertEquals(subscriber_updated.completed, True)
+        self.assertEqual(FanoutCheckpoint.objects.count(), 0)
+
+    def test_multisend_ignores_stale_checkpoint(self):
+        FanoutCheckpoint.objects.create(
+            schedule_id=6, task_id="yesterdays-task", last_id=2)
+        result = process_message_queue.delay(6, self.sender)
+        self.assertEquals(result.get(), 2)
+
+    def test_claim_subscriptions(self):
+        claimed = claim_subscriptions(6)
+        self.assertEqual(claimed, [(2, 1), (4, 3)])
+        self.assertEqual(
+            Subscription.objects.filter(process_status=1).count(), 3)
+        # Already claimed rows are not claimed again
+        self.assertEqual(claim_subscriptions(6), [])
+
+    def test_claim_subscriptions_chunk(self):
+        self.assertEqual(claim_subscriptions(6, limit=1), [(2, 1)])
+        self.assertEqual(
+            claim_subscriptions(6, after_id=2, limit=1), [(4, 3)])
+        self.assertEqual(claim_subscriptions(6, after_id=4, limit=1), [])
+
     def test_multisend_none(self):
         schedule = 2
         result = process_message_queue.delay(schedule, self.sender)
@@ -73,7 +156,7 @@ class TestMessageQueueProcessor(TestCase):
             "content": "Message 3 in en on nurseconnect",
         })
         self.assertEqual(
-            self.handler.logs[1].msg,
+            self.logs[1].msg,
             "Metric: 'prd.sum.nurseconnect.sms.outbound' [sum] -> 1")
 
     def test_send_nurseconnect_info_category(self):
@@ -87,10 +170,10 @@ class TestMessageQueueProcessor(TestCase):
             "content": "Message 4 in en on nurseconnect",
         })
         self.assertEqual(
-            self.handler.logs[1].msg,
+            self.logs[1].msg,
             "Metric: 'prd.sum.nurseconnect.sms.outbound' [sum] -> 1")
         self.assertEqual(
-            self.handler.logs[2].msg,
+            self.logs[2].msg,
             "Metric: 'prd.sum.nurseconnect.info.sms.outbound' [sum] -> 1")
 
     def test_send_message_1_en_accelerated(self):
@@ -136,9 +219,23 @@ class TestMessageQueueProcessor(TestCase):
         self.assertEquals(new_subscription.to_addr, "+271234")
         self.assertEquals(new_subscription.schedule, twice_a_week)
         self.assertEqual(
-            self.handler.logs[0].msg,
+            self.logs[0].msg,
             "Metric: u'prd.sum.baby1_auto' [sum] -> 1")
 
+    @override_settings(SUBSCRIPTION_COMPUTED_SEQUENCES=True)
+    def test_new_subscription_starts_computed_sequence(self):
+        subscriber = Subscription.objects.get(pk=1)
+        subscriber.next_sequence_number = 2
+        subscriber.sequence_started_at = timezone.now() - timedelta(days=60)
+        subscriber.start_sequence_number = 1
+        subscriber.save()
+        processes_message.delay(subscriber, self.sender)
+        new_subscription = Subscription.objects.get(pk=101)
+        self.assertEqual(new_subscription.start_sequence_number, 1)
+        self.assertTrue(new_subscription.sequence_started_at >
+                        timezone.now() - timedelta(minutes=1))
+        self.assertEqual(new_subscription.sequence_number_due(), 1)
+
     def test_new_subscription_created_post_send_en_baby1(self):
         once_a_week = PeriodicTask.objects.get(pk=2)
         subscriber = Subscription.objects.get(pk=3)
@@ -184,6 +281,691 @@ class TestMessageQueueProcessor(TestCase):
         self.assertEquals(subscriber_updated.active, True)
         self.assertEquals(subscriber_updated.process_status, -1)
 
+    def test_send_message_batch(self):
+        Subscription.objects.filter(pk__in=[2, 4]).update(process_status=1)
+        result = send_message_batch.delay([(2, 1), (4, 3)], self.sender)
+        self.assertEqual(result.get(), 2)
+        self.assertEqual(
+            [log.msg for log in self.logs], [
+                "Message: u'Message 1 in af on baby1' sent to u'+271111'",
+                "Message: u'Message 3 in en on baby2' sent to u'+271112'",
+            ])
+        # Moved on to the next message
+        subscriber_updated = Subscription.objects.get(pk=2)
+        self.assertEquals(subscriber_updated.next_sequence_number, 2)
+        self.assertEquals(subscriber_updated.process_status, 0)
+        # Last message in the set so completed
+        subscriber_updated = Subscription.objects.get(pk=4)
+        self.assertEquals(subscriber_updated.completed, True)
+        self.assertEquals(subscriber_updated.active, False)
+        self.assertEquals(subscriber_updated.process_status, 2)
+
+    def test_send_message_batch_conversation_throughput(self):
+        Subscription.objects.filter(pk__in=[2, 4]).update(process_status=1)
+        send_message_batch.delay([(2, 1), (4, 3)], self.sender)
+        [count, rate] = [
+            log.msg for log in self.handler.logs if log not in self.logs]
+        self.assertEqual(
+            count,
+            "Metric: u'prd.sum.sms.outbound.replaceme_momconnect' [sum] -> 2")
+        self.assertTrue(rate.startswith(
+            "Metric: u'prd.avg.sms.outbound.replaceme_momconnect.per_second'"
+            " [avg] -> "))
+
+    def test_send_message_batch_ignores_unclaimed(self):
+        result = send_message_batch.delay([(2, 1), (4, 3)], self.sender)
+        self.assertEqual(result.get(), 0)
+        self.assertEqual(self.logs, [])
+
+    def test_send_message_batch_idempotent(self):
+        Subscription.objects.filter(pk__in=[2, 4]).update(process_status=1)
+        send_message_batch.delay([(2, 1), (4, 3)], self.sender)
+        # Running the same batch again does nothing
+        Subscription.objects.filter(pk=2).update(process_status=1)
+        result = send_message_batch.delay([(2, 1), (4, 3)], self.sender)
+        self.assertEqual(result.get(), 0)
+        self.assertEqual(len(self.logs), 2)
+        subscriber_updated = Subscription.objects.get(pk=2)
+        self.assertEquals(subscriber_updated.next_sequence_number, 2)
+
+    def test_advance_subscriptions_once(self):
+        Subscription.objects.filter(pk=2).update(process_status=1)
+        subscribers = list(Subscription.objects.filter(pk=2))
+        advance_subscriptions(subscribers, self.sender)
+        Subscription.objects.filter(pk=2).update(process_status=1)
+        advance_subscriptions(subscribers, self.sender)
+        subscriber_updated = Subscription.objects.get(pk=2)
+        self.assertEquals(subscriber_updated.next_sequence_number, 2)
+        self.assertEquals(subscriber_updated.process_status, 1)
+
+    def test_send_message_batch_next_set(self):
+        twice_a_week = PeriodicTask.objects.get(pk=3)
+        Subscription.objects.filter(pk=1).update(
+            next_sequence_number=2, process_status=1)
+        result = send_message_batch.delay([(1, 2)], self.sender)
+        self.assertEqual(result.get(), 1)
+        subscriber_updated = Subscription.objects.get(pk=1)
+        self.assertEquals(subscriber_updated.completed, True)
+        self.assertEquals(subscriber_updated.active, False)
+        # Check new subscription is for baby1
+        new_subscription = Subscription.objects.get(
+            to_addr="+271234", message_set=4)
+        self.assertEquals(new_subscription.next_sequence_number, 1)
+        self.assertEquals(new_subscription.process_status, 0)
+        self.assertEquals(new_subscription.schedule, twice_a_week)
+        self.assertEqual(
+            self.logs[1].msg,
+            "Metric: u'prd.sum.baby1_auto' [sum] -> 1")
+
+    def test_send_message_batch_nurseconnect_metrics(self):
+        Subscription.objects.filter(pk=6).update(
+            next_sequence_number=4, process_status=1)
+        result = send_message_batch.delay([(6, 4)], self.sender)
+        self.assertEqual(result.get(), 1)
+        self.assertEqual(
+            self.logs[1].msg,
+            "Metric: 'prd.sum.nurseconnect.info.sms.outbound' [sum] -> 1")
+        self.assertEqual(
+            self.logs[2].msg,
+            "Metric: 'prd.sum.nurseconnect.sms.outbound' [sum] -> 1")
+
+    def test_send_message_batch_missing_message(self):
+        Subscription.objects.filter(pk__in=[1, 2]).update(process_status=1)
+        Subscription.objects.filter(pk=1).update(lang='fr')
+        result = send_message_batch.delay([(1, 1), (2, 1)], self.sender)
+        self.assertEqual(result.get(), 1)
+        subscriber_updated = Subscription.objects.get(pk=1)
+        self.assertEquals(subscriber_updated.active, True)
+        self.assertEquals(subscriber_updated.next_sequence_number, 1)
+        self.assertEquals(subscriber_updated.process_status, -1)
+        subscriber_updated = Subscription.objects.get(pk=2)
+        self.assertEquals(subscriber_updated.next_sequence_number, 2)
+
+    def test_send_message_batch_with_messages(self):
+        Subscription.objects.filter(pk=2).update(process_status=1)
+        result = send_message_batch.delay(
+            [(2, 1)], self.sender, [[4, u"af", 1, 3, u"Preloaded", None]])
+        self.assertEqual(result.get(), 1)
+        self.check_logs("Message: u'Preloaded' sent to u'+271111'")
+
+    def test_multisend_preloads_messages(self):
+        message_cache.clear()
+        Message.objects.filter(pk=3).update(content="Updated")
+        process_message_queue.delay(6, self.sender)
+        self.assertEqual(
+            self.logs[0].msg,
+            "Message: u'Updated' sent to u'+271111'")
+        # Every message for baby1 in af is loaded with the first chunk
+        self.assertEqual(
+            message_cache.get((4, "af", 2)).content,
+            "Message 2 in af on baby1")
+
+    def computed_sequence(self, pk, runs):
+        # Every day at midnight, started just before `runs` midnights ago,
+        # and claimed on that schedule
+        CrontabSchedule.objects.filter(pk=6).update(
+            hour="0", minute="0", day_of_week="*")
+        midnight = timezone.now().replace(
+            hour=0, minute=0, second=0, microsecond=0)
+        Subscription.objects.filter(pk=pk).update(
+            process_status=0, start_sequence_number=1,
+            sequence_started_at=midnight - timedelta(days=runs - 1, minutes=1))
+        return [key for key in claim_subscriptions(6) if key[0] == pk]
+
+    def test_claim_pins_computed_sequence(self):
+        self.assertEqual(self.computed_sequence(4, runs=2), [(4, 2)])
+        self.assertEquals(
+            Subscription.objects.get(pk=4).next_sequence_number, 2)
+
+    def test_claim_computed_sequence_in_one_statement(self):
+        self.computed_sequence(4, runs=1)
+        Subscription.objects.filter(pk=4).update(process_status=0)
+        runs = past_runs(timezone.now(), 6)
+        with self.assertNumQueries(1):
+            claimed = claim_subscriptions(6, runs=runs)
+        self.assertTrue((4, 1) in claimed)
+
+    def test_claim_caps_computed_sequence(self):
+        # a run was missed, but the set only has 3 messages
+        self.assertEqual(self.computed_sequence(4, runs=4), [(4, 3)])
+        result = send_message_batch.delay([(4, 3)], self.sender)
+        self.assertEqual(result.get(), 1)
+        subscriber_updated = Subscription.objects.get(pk=4)
+        self.assertEquals(subscriber_updated.completed, True)
+        self.assertEquals(subscriber_updated.active, False)
+        self.assertEquals(subscriber_updated.process_status, 2)
+
+    def test_claim_window_slot(self):
+        offset = slot_offset("+271111", 3600)
+        self.assertNotEqual(offset, slot_offset("+271112", 3600))
+        rows = claim_subscription_rows(6, slot=(3600, offset, offset + 1))
+        self.assertEqual([row[0] for row in rows], [2])
+        # the last slot takes every number left
+        rows = claim_subscription_rows(6, slot=(3600, 0, None))
+        self.assertEqual([row[0] for row in rows], [4])
+
+    def test_claim_created_before(self):
+        Subscription.objects.filter(pk=4).update(
+            created_at=timezone.now() + timedelta(minutes=5))
+        rows = claim_subscription_rows(6, created_before=timezone.now())
+        self.assertEqual([row[0] for row in rows], [2])
+
+    def test_complete_finished_computed_subscriptions(self):
+        # restarted past the end of the set, for example by set_seq
+        Subscription.objects.filter(pk=4).update(
+            next_sequence_number=4, start_sequence_number=4,
+            sequence_started_at=timezone.now())
+        self.assertEqual(complete_finished_subscriptions(6, self.sender), 1)
+        subscriber_updated = Subscription.objects.get(pk=4)
+        self.assertEquals(subscriber_updated.completed, True)
+        self.assertEquals(subscriber_updated.process_status, 2)
+
+    def test_send_message_batch_computed_sequence(self):
+        claimed = self.computed_sequence(4, runs=2)
+        result = send_message_batch.delay(claimed, self.sender)
+        self.assertEqual(result.get(), 1)
+        self.check_logs(
+            "Message: u'Message 2 in en on baby2' sent to u'+271112'")
+        # Only released, the pinned sequence number is left alone
+        subscriber_updated = Subscription.objects.get(pk=4)
+        self.assertEquals(subscriber_updated.next_sequence_number, 2)
+        self.assertEquals(subscriber_updated.process_status, 0)
+        self.assertEquals(subscriber_updated.completed, False)
+        [entry] = SendLedgerEntry.objects.all()
+        self.assertEqual(entry.sequence_number, 2)
+
+    def test_send_message_batch_computed_sequence_stale_key(self):
+        # A batch from an earlier run is skipped once a later run claims
+        [stale] = self.computed_sequence(4, runs=2)
+        claimed = self.computed_sequence(4, runs=3)
+        self.assertEqual(claimed, [(4, 3)])
+        result = send_message_batch.delay([stale], self.sender)
+        self.assertEqual(result.get(), 0)
+        self.assertEqual(SendLedgerEntry.objects.count(), 0)
+
+    def test_send_message_batch_computed_sequence_completes(self):
+        claimed = self.computed_sequence(4, runs=3)
+        result = send_message_batch.delay(claimed, self.sender)
+        self.assertEqual(result.get(), 1)
+        self.check_logs(
+            "Message: u'Message 3 in en on baby2' sent to u'+271112'")
+        subscriber_updated = Subscription.objects.get(pk=4)
+        self.assertEquals(subscriber_updated.completed, True)
+        self.assertEquals(subscriber_updated.process_status, 2)
+
+    def test_send_message_batch_ledger(self):
+        Subscription.objects.filter(pk__in=[1, 2]).update(process_status=1)
+        Subscription.objects.filter(pk=1).update(lang='fr')
+        send_message_batch.delay([(1, 1), (2, 1)], self.sender)
+        [errored] = SendLedgerEntry.objects.filter(subscription_id=1)
+        self.assertEqual(errored.status, SendLedgerEntry.ERRORED)
+        self.assertEqual(errored.message, None)
+        self.assertEqual(errored.to_addr, "+271234")
+        [sent] = SendLedgerEntry.objects.filter(subscription_id=2)
+        self.assertEqual(sent.status, SendLedgerEntry.SENT)
+        self.assertEqual(sent.message.content, "Message 1 in af on baby1")
+        self.assertEqual(sent.to_addr, "+271111")
+        self.assertEqual(sent.sequence_number, 1)
+        self.assertEqual(sent.attempt, 1)
+        self.assertTrue(sent.latency >= 0)
+
+    def test_ledger_kept_when_message_deleted(self):
+        Subscription.objects.filter(pk=2).update(process_status=1)
+        send_message_batch.delay([(2, 1)], self.sender)
+        [sent] = SendLedgerEntry.objects.filter(subscription_id=2)
+        sent.message.delete()
+        [sent] = SendLedgerEntry.objects.filter(subscription_id=2)
+        self.assertEqual(sent.message, None)
+        self.assertEqual(sent.sequence_number, 1)
+        self.assertEqual(sent.to_addr, "+271111")
+        # and the subscription can't be deleted from under it
+        self.assertRaises(
+            ProtectedError, Subscription.objects.get(pk=2).delete)
+
+    def test_send_message_batch_ledger_disabled(self):
+        ledger_enabled = settings.SUBSEND_LEDGER_ENABLED
+        settings.SUBSEND_LEDGER_ENABLED = False
+        Subscription.objects.filter(pk=2).update(process_status=1)
+        try:
+            send_message_batch.delay([(2, 1)], self.sender)
+        finally:
+            settings.SUBSEND_LEDGER_ENABLED = ledger_enabled
+        self.assertEqual(SendLedgerEntry.objects.count(), 0)
+
+    def test_send_message_batch_concurrent(self):
+        concurrency = settings.SUBSEND_SEND_CONCURRENCY
+        settings.SUBSEND_SEND_CONCURRENCY = 4
+        Subscription.objects.filter(pk__in=[2, 4]).update(process_status=1)
+        try:
+            result = send_message_batch.delay([(2, 1), (4, 3)], self.sender)
+        finally:
+            settings.SUBSEND_SEND_CONCURRENCY = concurrency
+        self.assertEqual(result.get(), 2)
+        self.assertEqual(
+            sorted(log.msg for log in self.logs), [
+                "Message: u'Message 1 in af on baby1' sent to u'+271111'",
+                "Message: u'Message 3 in en on baby2' sent to u'+271112'",
+            ])
+        subscriber_updated = Subscription.objects.get(pk=2)
+        self.assertEquals(subscriber_updated.next_sequence_number, 2)
+        subscriber_updated = Subscription.objects.get(pk=4)
+        self.assertEquals(subscriber_updated.completed, True)
+
+    def test_send_message_batch_soft_time_limit(self):
+        Subscription.objects.filter(pk__in=[2, 4]).update(process_status=1)
+        sender = TimingOutSender('go_http.test', sends=1)
+        result = send_message_batch.delay([(2, 1), (4, 3)], sender)
+        self.assertEqual(result.get(), 1)
+        self.check_logs(
+            "Message: u'Message 1 in af on baby1' sent to u'+271111'")
+        # the message sent before the limit is recorded and advanced
+        [entry] = SendLedgerEntry.objects.all()
+        self.assertEqual(entry.subscription_id, 2)
+        self.assertEqual(entry.status, SendLedgerEntry.SENT)
+        subscriber_updated = Subscription.objects.get(pk=2)
+        self.assertEquals(subscriber_updated.next_sequence_number, 2)
+        self.assertEquals(subscriber_updated.process_status, 0)
+        # the rest are released for the next run of the schedule
+        subscriber_updated = Subscription.objects.get(pk=4)
+        self.assertEquals(subscriber_updated.next_sequence_number, 3)
+        self.assertEquals(subscriber_updated.process_status, 0)
+        self.assertEquals(subscriber_updated.completed, False)
+
+    def test_send_message_batch_ledger_chunks(self):
+        chunk_size = settings.SUBSEND_LEDGER_CHUNK_SIZE
+        settings.SUBSEND_LEDGER_CHUNK_SIZE = 1
+        Subscription.objects.filter(pk__in=[2, 4]).update(process_status=1)
+        sender = TimingOutSender('go_http.test', sends=2)
+        try:
+            send_message_batch.delay([(2, 1), (4, 3)], sender)
+        finally:
+            settings.SUBSEND_LEDGER_CHUNK_SIZE = chunk_size
+        # the first send was in the ledger before the second was made
+        self.assertEqual(sender.ledger_counts, [0, 1])
+        self.assertEqual(SendLedgerEntry.objects.count(), 2)
+
+    def test_send_message_batch_connection_error(self):
+        Subscription.objects.filter(pk__in=[2, 4]).update(process_status=1)
+        sender = ConnectionErrorSender('go_http.test', "+271111")
+        send_message_batch.delay([(2, 1), (4, 3)], sender)
+        self.check_logs(
+            "Message: u'Message 3 in en on baby2' sent to u'+271112'")
+        self.assertEqual(
+            list(SendLedgerEntry.objects.values_list(
+                "subscription", "status", "attempt")
+                .order_by("subscription", "attempt")),
+            [(2, SendLedgerEntry.FAILED, attempt) for attempt in range(1, 5)] +
+            [(4, SendLedgerEntry.SENT, 1)])
+        # only the failing subscription is left for the next run
+        subscriber_updated = Subscription.objects.get(pk=2)
+        self.assertEquals(subscriber_updated.next_sequence_number, 1)
+        self.assertEquals(subscriber_updated.process_status, 0)
+        self.assertEquals(Subscription.objects.get(pk=4).completed, True)
+
+    def test_send_claimed_error_writes_ledger(self):
+        Subscription.objects.filter(pk__in=[2, 4]).update(process_status=1)
+        sender = TimingOutSender(
+            'go_http.test', sends=1, exc_class=RuntimeError)
+        self.assertRaises(
+            RuntimeError, send_claimed, load_claimed([(2, 1), (4, 3)]),
+            sender)
+        # the message sent before the error is in the ledger
+        [entry] = SendLedgerEntry.objects.all()
+        self.assertEqual(entry.subscription_id, 2)
+        self.assertEqual(entry.status, SendLedgerEntry.SENT)
+
+    def test_reap_after_worker_dies_mid_batch(self):
+        chunk_size = settings.SUBSEND_LEDGER_CHUNK_SIZE
+        settings.SUBSEND_LEDGER_CHUNK_SIZE = 1
+        Subscription.objects.filter(pk__in=[2, 4]).update(process_status=1)
+        sender = TimingOutSender(
+            'go_http.test', sends=1, exc_class=RuntimeError)
+        try:
+            self.assertRaises(
+                RuntimeError, send_claimed,
+                load_claimed([(2, 1), (4, 3)]), sender)
+        finally:
+            settings.SUBSEND_LEDGER_CHUNK_SIZE = chunk_size
+        Subscription.objects.filter(pk__in=[2, 4]).update(
+            updated_at=timezone.now() - timedelta(hours=3))
+        SendLedgerEntry.objects.update(
+            created_at=timezone.now() - timedelta(hours=2))
+        reap_stuck_subscriptions.delay(self.sender)
+        # the ledger shows the first message went out, so it is not resent
+        subscriber_updated = Subscription.objects.get(pk=2)
+        self.assertEquals(subscriber_updated.next_sequence_number, 2)
+        self.assertEquals(subscriber_updated.process_status, 0)
+        subscriber_updated = Subscription.objects.get(pk=4)
+        self.assertEquals(subscriber_updated.next_sequence_number, 3)
+        self.assertEquals(subscriber_updated.process_status, 0)
+
+    def test_send_message_batch_redelivered(self):
+        Subscription.objects.filter(pk=2).update(process_status=1)
+        # the first delivery of the batch has started sending
+        self.assertEqual(
+            [subscriber.id for subscriber in load_claimed([(2, 1)])], [2])
+        self.assertEqual(load_claimed([(2, 1)]), [])
+        result = send_message_batch.delay([(2, 1)], self.sender)
+        self.assertEqual(result.get(), 0)
+        self.assertEqual(self.logs, [])
+        self.assertEquals(Subscription.objects.get(pk=2).process_status, 4)
+        # and if its worker dies the reaper makes it Ready again
+        Subscription.objects.filter(pk=2).update(
+            updated_at=timezone.now() - timedelta(hours=3))
+        reap_stuck_subscriptions.delay(self.sender)
+        self.assertEquals(Subscription.objects.get(pk=2).process_status, 0)
+
+    def test_reap_stuck_subscriptions(self):
+        hours_ago = timezone.now() - timedelta(hours=3)
+        Subscription.objects.filter(pk=2).update(
+            process_status=1, updated_at=hours_ago)
+        # Recently claimed so still being worked on
+        Subscription.objects.filter(pk=4).update(
+            process_status=1, updated_at=timezone.now())
+        result = reap_stuck_subscriptions.delay(self.sender)
+        # Subscription 5 has been In Process since the fixture was made
+        self.assertEqual(result.get(), 2)
+        self.assertEqual(
+            list(Subscription.objects.filter(pk__in=[2, 4, 5])
+                 .values_list("process_status", "next_sequence_number")
+                 .order_by("id")),
+            [(0, 1), (1, 3), (0, 2)])
+        self.check_logs(
+            "Metric: 'prd.sum.sms.subscription.reaped' [sum] -> 2")
+
+    def test_reap_restarts_drainers(self):
+        Subscription.objects.filter(pk=2).update(
+            process_status=3, updated_at=timezone.now() - timedelta(hours=3))
+        Subscription.objects.filter(pk=5).update(process_status=0)
+        result = reap_stuck_subscriptions.delay(self.sender)
+        # Left Queued rather than reset, and pulled by a new drainer
+        self.assertEqual(result.get(), 0)
+        self.assertEqual(
+            [log.msg for log in self.logs],
+            ["Message: u'Message 1 in af on baby1' sent to u'+271111'",
+             "Metric: 'prd.sum.sms.subscription.reaped' [sum] -> 0"])
+        subscriber_updated = Subscription.objects.get(pk=2)
+        self.assertEquals(subscriber_updated.next_sequence_number, 2)
+        self.assertEquals(subscriber_updated.process_status, 0)
+
+    def test_reap_stuck_subscriptions_already_sent(self):
+        Subscription.objects.filter(pk=2).update(
+            process_status=1,
+            updated_at=timezone.now() - timedelta(hours=3))
+        SendLedgerEntry.objects.create(
+            subscription_id=2, to_addr="+271111", sequence_number=1,
+            status=SendLedgerEntry.SENT)
+        Subscription.objects.filter(pk=5).update(process_status=0)
+        result = reap_stuck_subscriptions.delay(self.sender)
+        self.assertEqual(result.get(), 1)
+        # Moved on rather than sent the same message again
+        subscriber_updated = Subscription.objects.get(pk=2)
+        self.assertEquals(subscriber_updated.next_sequence_number, 2)
+        self.assertEquals(subscriber_updated.process_status, 0)
+
+    def test_reap_waits_for_live_batch(self):
+        chunk_size = settings.SUBSEND_LEDGER_CHUNK_SIZE
+        settings.SUBSEND_LEDGER_CHUNK_SIZE = 1
+        Subscription.objects.filter(pk__in=[2, 4]).update(process_status=1)
+        subscribers = load_claimed([(2, 1), (4, 3)])
+        # loaded long ago by a batch that is slowly working through them
+        Subscription.objects.filter(pk__in=[2, 4]).update(
+            updated_at=timezone.now() - timedelta(hours=3))
+        try:
+            sent, failed, _ = send_claimed(
+                subscribers,
+                ConnectionErrorSender('go_http.test', "+271112"))
+        finally:
+            settings.SUBSEND_LEDGER_CHUNK_SIZE = chunk_size
+        self.assertEqual([subscriber.id for subscriber in failed], [4])
+        reap_stuck_subscriptions.delay(self.sender)
+        # the batch was seen again before it got to subscription 4
+        self.assertEqual(
+            list(Subscription.objects.filter(pk__in=[2, 4, 5])
+                 .values_list("process_status", "next_sequence_number")
+                 .order_by("id")),
+            [(0, 2), (4, 3), (0, 2)])
+
+    def test_multisend_batches_by_language(self):
+        process_message_queue.delay(6, self.sender)
+        # af and en are sent by separate batches
+        self.assertEqual(
+            [log.msg for log in self.handler.logs
+             if log.msg.startswith("Metric: u'prd.sum.sms.outbound.")],
+            ["Metric: u'prd.sum.sms.outbound.replaceme_momconnect' "
+             "[sum] -> 1"] * 2)
+
+    def test_multisend_send_window(self):
+        SendWindow.objects.create(schedule_id=6, minutes=180)
+        # eager slots run straight after each other
+        process_message_queue.delay(6, self.sender)
+        subscriber_updated = Subscription.objects.get(pk=2)
+        self.assertEquals(subscriber_updated.next_sequence_number, 2)
+        subscriber_updated = Subscription.objects.get(pk=4)
+        self.assertEquals(subscriber_updated.completed, True)
+
+    def test_complete_finished_subscriptions(self):
+        Subscription.objects.filter(pk=2).update(next_sequence_number=3)
+        self.assertEqual(complete_finished_subscriptions(6, self.sender), 1)
+        subscriber_updated = Subscription.objects.get(pk=2)
+        self.assertEquals(subscriber_updated.completed, True)
+        self.assertEquals(subscriber_updated.active, False)
+        self.assertEquals(subscriber_updated.process_status, 2)
+        new_subscription = Subscription.objects.get(
+            to_addr="+271111", message_set=5)
+        self.assertEquals(new_subscription.next_sequence_number, 1)
+        self.assertEquals(new_subscription.schedule_id, 2)
+        self.check_logs("Metric: u'prd.sum.baby2_auto' [sum] -> 1")
+        # Nothing left to do
+        self.assertEqual(complete_finished_subscriptions(6, self.sender), 0)
+
+    def test_multisend_completes_finished_first(self):
+        Subscription.objects.filter(pk=2).update(next_sequence_number=3)
+        result = process_message_queue.delay(6, self.sender)
+        self.assertEquals(result.get(), 1)
+        subscriber_updated = Subscription.objects.get(pk=2)
+        self.assertEquals(subscriber_updated.completed, True)
+
+    def test_queue_subscriptions(self):
+        self.assertEqual(queue_subscriptions(6), 2)
+        self.assertEqual(
+            list(Subscription.objects.filter(process_status=3)
+                 .values_list("id", flat=True).order_by("id")), [2, 4])
+        # Already queued rows are not queued again
+        self.assertEqual(queue_subscriptions(6), 0)
+
+    def test_claim_queued_subscriptions(self):
+        queue_subscriptions(6)
+        self.assertEqual(claim_queued_subscriptions(6, limit=1), [(2, 1)])
+        self.assertEqual(claim_queued_subscriptions(limit=10), [(4, 3)])
+        self.assertEqual(claim_queued_subscriptions(limit=10), [])
+        self.assertEqual(
+            Subscription.objects.filter(process_status=1).count(), 3)
+
+    def test_drain_message_queue(self):
+        queue_subscriptions(6)
+        result = drain_message_queue.delay(6, self.sender)
+        self.assertEqual(result.get(), 2)
+        self.assertEqual(
+            Subscription.objects.filter(process_status=3).count(), 0)
+        subscriber_updated = Subscription.objects.get(pk=2)
+        self.assertEquals(subscriber_updated.next_sequence_number, 2)
+        self.assertEquals(subscriber_updated.process_status, 0)
+
+    def test_multisend_pull(self):
+        queue_mode = settings.SUBSEND_QUEUE_MODE
+        settings.SUBSEND_QUEUE_MODE = "pull"
+        try:
+            result = process_message_queue.delay(6, self.sender)
+        finally:
+            settings.SUBSEND_QUEUE_MODE = queue_mode
+        self.assertEquals(result.get(), 2)
+        self.assertEqual(
+            [log.msg for log in self.logs], [
+                "Message: u'Message 1 in af on baby1' sent to u'+271111'",
+                "Message: u'Message 3 in en on baby2' sent to u'+271112'",
+                "Metric: 'prd.sum.sms.subscription.outbound' [sum] -> 2",
+            ])
+        subscriber_updated = Subscription.objects.get(pk=4)
+        self.assertEquals(subscriber_updated.completed, True)
+        self.assertEquals(subscriber_updated.process_status, 2)
+
+
+class TestSendPlan(TestCase):
+    fixtures = ["test_initialdata.json", "test_subsend.json"]
+
+    # a Monday, when all the test schedules run, and the Sunday before it
+    monday = date(2014, 12, 8)
+    sunday = date(2014, 12, 7)
+
+    def test_schedule_runs(self):
+        self.assertEqual(
+            schedule_runs(PeriodicTask.objects.get(pk=6), self.monday), 1)
+        self.assertEqual(
+            schedule_runs(PeriodicTask.objects.get(pk=6), self.sunday), 0)
+        self.assertEqual(
+            schedule_runs(PeriodicTask.objects.get(pk=1), self.sunday), 1)
+        # hourly
+        self.assertEqual(
+            schedule_runs(PeriodicTask.objects.get(pk=10), self.sunday), 24)
+
+    def test_schedule_runs_long_interval(self):
+        # every week from Sunday 5 January 2014
+        IntervalSchedule.objects.filter(
+            periodictask=10).update(every=7, period="days")
+        periodic_task = PeriodicTask.objects.get(pk=10)
+        self.assertEqual(schedule_runs(periodic_task, self.sunday), 1)
+        self.assertEqual(schedule_runs(periodic_task, self.monday), 0)
+
+    def test_build_send_plan(self):
+        self.assertEqual(build_send_plan(self.monday), 5)
+        self.assertEqual(
+            list(SendPlan.objects.filter(date=self.monday)
+                 .values_list("subscription", "message",
+                              "conversation_key", "completes_set")
+                 .order_by("subscription")),
+            [(1, 1, "replaceme_momconnect", False),
+             (2, 3, "replaceme_momconnect", False),
+             (4, 7, "replaceme_momconnect", True),
+             (5, 6, "replaceme_momconnect", False),
+             (6, 8, "replaceme_nurseconnect", False)])
+
+    def test_build_send_plan_only_due_schedules(self):
+        self.assertEqual(build_send_plan(self.sunday), 1)
+        [plan] = SendPlan.objects.all()
+        self.assertEqual(plan.subscription_id, 1)
+
+    def test_build_send_plan_replaces_plan(self):
+        build_send_plan(self.sunday)
+        build_send_plan(self.monday)
+        build_send_plan(self.monday)
+        self.assertEqual(
+            SendPlan.objects.filter(date=self.monday).count(), 5)
+        # other days' plans are left alone
+        self.assertEqual(
+            SendPlan.objects.filter(date=self.sunday).count(), 1)
+
+    def test_build_send_plan_runs_twice_a_day(self):
+        CrontabSchedule.objects.filter(pk=6).update(hour="8,16")
+        build_send_plan(self.monday)
+        self.assertEqual(
+            list(SendPlan.objects.filter(schedule_id=6)
+                 .values_list("subscription", "tick", "sequence_number",
+                              "completes_set", "next_set")
+                 .order_by("subscription", "tick")),
+            [(2, 0, 1, False, None),
+             (2, 1, 2, True, 5),
+             (4, 0, 3, True, None),
+             (5, 0, 2, False, None),
+             (5, 1, 3, True, None)])
+
+    def test_build_send_plan_computed_sequence(self):
+        # started before Friday's second run, which sent 1
+        Subscription.objects.filter(pk=5).update(
+            next_sequence_number=1, start_sequence_number=1,
+            sequence_started_at=datetime(2014, 12, 5, 16, tzinfo=utc))
+        CrontabSchedule.objects.filter(pk=6).update(hour="8,16")
+        build_send_plan(self.monday)
+        self.assertEqual(
+            list(SendPlan.objects.filter(subscription=5)
+                 .values_list("tick", "sequence_number", "completes_set")
+                 .order_by("tick")),
+            [(0, 2, False), (1, 3, True)])
+
+    def test_plan_sends(self):
+        sender = LoggingSender('go_http.test')
+        handler = RecordingHandler()
+        logger = logging.getLogger('go_http.test')
+        logger.setLevel(logging.INFO)
+        logger.addHandler(handler)
+        build_send_plan(self.sunday)
+        result = plan_sends.delay(self.monday, sender)
+        self.assertEqual(result.get(), 5)
+        # plans for days gone by are dropped
+        self.assertEqual(
+            list(SendPlan.objects.values_list("date", flat=True).distinct()),
+            [self.monday])
+        [log] = handler.logs
+        self.assertEqual(
+            log.msg,
+            "Metric: 'prd.last.sms.subscription.planned' [last] -> 5")
+
+    def test_preview_send_plan(self):
+        build_send_plan(self.monday)
+        self.assertEqual(preview_send_plan(self.monday), [
+            ("accelerated", "en", 1, 0),
+            ("baby1", "af", 1, 0),
+            ("baby2", "en", 2, 1),
+            ("nurseconnect", "en", 1, 0),
+        ])
+
+
+class TestSendWindows(TestCase):
+
+    def setUp(self):
+        self.started_at = timezone.now()
+        self.rows = [(i, 1, 3, "en", "+2711%04d" % i) for i in range(100)]
+
+    def test_slot_offset(self):
+        offset = slot_offset("+271234", 3600)
+        self.assertTrue(0 <= offset < 3600)
+        self.assertEqual(slot_offset(u"+271234", 3600), offset)
+
+    def test_window_capped(self):
+        window = SendWindow(
+            schedule_id=6, minutes=settings.SUBSEND_MAX_WINDOW_MINUTES + 1)
+        self.assertEqual(
+            window.send_minutes(), settings.SUBSEND_MAX_WINDOW_MINUTES)
+        with self.assertRaises(ValidationError) as cm:
+            window.full_clean()
+        self.assertTrue("minutes" in cm.exception.message_dict)
+
+    def test_split_rows(self):
+        batches = split_rows(self.rows, 40)
+        self.assertEqual([len(rows) for rows in batches], [40, 40, 20])
+
+    def test_split_rows_grouped(self):
+        batches = split_rows(self.rows, 40, group=lambda row: row[0] % 2)
+        self.assertEqual(
+            [(len(rows), set(row[0] % 2 for row in rows))
+             for rows in batches],
+            [(40, set([0])), (10, set([0])), (40, set([1])), (10, set([1]))])
+
+    def test_window_slot(self):
+        self.assertEqual(window_slot(0, 60, 600), (3600, 0, 600))
+        self.assertEqual(window_slot(2400, 60, 600), (3600, 2400, 3000))
+        # the last slot takes everyone left
+        self.assertEqual(window_slot(3000, 60, 600), (3600, 3000, None))
+
+    def test_slot_offset_matches_sql(self):
+        cursor = connection.cursor()
+        for to_addr in ["+271234", "+27821234567", "+2711%04d" % 99]:
+            cursor.execute(
+                "SELECT " + SLOT_OFFSET_SQL +
+                " FROM (SELECT %s::text AS to_addr) s", [3600, to_addr])
+            self.assertEqual(
+                cursor.fetchone()[0], slot_offset(to_addr, 3600))
+
 
 class TestMessageSuccess(TestCase):
     """Test message sending using responses"""
@@ -224,6 +1006,9 @@ class TestMessageFailure(TestCase):
         logger.setLevel(logging.INFO)
         logger.addHandler(self.handler)
 
+    def tearDown(self):
+        registry.clear()
+
     def check_logs(self, msg, levelno=logging.INFO):
         [log] = self.handler.logs
         self.assertEqual(log.msg, msg)
@@ -283,6 +1068,261 @@ class TestMessageFailure(TestCase):
             result.get()
         self.assertEqual(cm.exception.response.status_code, 405)
 
+    @responses.activate
+    def test_batch_subscriber_opted_out_error(self):
+        Subscription.objects.filter(pk=1).update(process_status=1)
+        exception = UserOptedOutException("+271234",
+                                          "Message 1 on accelerated",
+                                          "response reason")
+        responses.add(responses.PUT,
+                      "https://go.vumi.org/api/v1/go/http_api_nostream/"
+                      "replaceme/messages.json",
+                      content_type='application/json;charset=utf-8',
+                      body=exception)
+        result = send_message_batch.delay([(1, 1)], self.sender)
+        self.assertEqual(result.get(), 0)
+        subscriber_updated = Subscription.objects.get(pk=1)
+        self.assertEquals(subscriber_updated.active, False)
+        self.assertEquals(subscriber_updated.process_status, 0)
+        self.assertEquals(subscriber_updated.next_sequence_number, 1)
+        [entry] = SendLedgerEntry.objects.all()
+        self.assertEqual(entry.status, SendLedgerEntry.OPTED_OUT)
+        self.assertEqual(
+            OptOut.objects.get(to_addr="+271234").source, "vumi")
+
+    @responses.activate
+    def test_batch_skips_known_optout(self):
+        Subscription.objects.filter(pk=1).update(process_status=1)
+        record_optouts(["+271234"], "csv")
+        result = send_message_batch.delay([(1, 1)], self.sender)
+        self.assertEqual(result.get(), 0)
+        # Vumi isn't asked
+        self.assertEqual(len(responses.calls), 0)
+        subscriber_updated = Subscription.objects.get(pk=1)
+        self.assertEquals(subscriber_updated.active, False)
+        self.assertEquals(subscriber_updated.process_status, 0)
+        [entry] = SendLedgerEntry.objects.all()
+        self.assertEqual(entry.status, SendLedgerEntry.OPTED_OUT)
+        self.assertEqual(entry.latency, None)
+
+    @responses.activate
+    def test_subscriber_known_optout(self):
+        subscriber = Subscription.objects.get(pk=1)
+        record_optouts(["+271234"], "csv")
+        result = send_message.delay(subscriber, self.sender)
+        self.assertEqual(len(responses.calls), 0)
+        self.assertEquals(result.get(),
+                          u'Subscription deactivated for +271234')
+
+    @responses.activate
+    def test_batch_three_retries_on_500(self):
+        Subscription.objects.filter(pk=1).update(process_status=1)
+        responses.add(responses.PUT,
+                      "https://go.vumi.org/api/v1/go/http_api_nostream/"
+                      "replaceme/messages.json",
+                      content_type='application/json;charset=utf-8',
+                      status=577, body='{"error": "problems"}')
+        send_message_batch.delay([(1, 1)], self.sender)
+        self.assertEqual(len(responses.calls), 4)
+        self.assertEqual(
+            list(SendLedgerEntry.objects.values_list("status", "attempt")
+                 .order_by("attempt")),
+            [(SendLedgerEntry.FAILED, attempt) for attempt in range(1, 5)])
+        # Left for the next run of the schedule
+        subscriber_updated = Subscription.objects.get(pk=1)
+        self.assertEquals(subscriber_updated.active, True)
+        self.assertEquals(subscriber_updated.process_status, 0)
+        self.assertEquals(subscriber_updated.next_sequence_number, 1)
+
+
+class TestLRUCache(TestCase):
+
+    def test_get_set(self):
+        cache = LRUCache(max_size=2)
+        self.assertEqual(cache.get("a"), None)
+        cache.set("a", 1)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.stats(), {"size": 1, "hits": 1, "misses": 1})
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(max_size=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        self.assertEqual(cache.get("b"), None)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.get("c"), 3)
+
+    def test_ttl(self):
+        now = [1000]
+        cache = LRUCache(ttl=60, clock=lambda: now[0])
+        cache.set("a", 1)
+        now[0] += 60
+        self.assertEqual(cache.get("a"), 1)
+        now[0] += 1
+        self.assertEqual(cache.get("a"), None)
+        self.assertEqual(len(cache), 0)
+
+
+class TestMessageCache(TestCase):
+    fixtures = ["test_initialdata.json", "test_subsend.json"]
+
+    def setUp(self):
+        message_cache.clear()
+
+    def test_get_message_cached(self):
+        with self.assertNumQueries(1):
+            message = get_message(3, "en", 1)
+            self.assertEqual(get_message(3, "en", 1), message)
+        self.assertEqual(message.content, "Message 1 on accelerated")
+
+    def test_get_message_missing(self):
+        with self.assertRaises(Message.DoesNotExist):
+            get_message(3, "fr", 1)
+
+    def test_get_messages(self):
+        get_message(3, "en", 1)
+        with self.assertNumQueries(1):
+            messages = get_messages([(3, "en", 1), (3, "en", 2),
+                                     (4, "af", 1), (3, "fr", 1)])
+        self.assertEqual(sorted(messages.keys()), [
+            (3, "en", 1), (3, "en", 2), (4, "af", 1)])
+        self.assertEqual(messages[(4, "af", 1)].content,
+                         "Message 1 in af on baby1")
+
+    def test_preload_messages(self):
+        with self.assertNumQueries(1):
+            messages = preload_messages([(3, "en"), (4, "af"), (5, "af")])
+        self.assertEqual(sorted(messages.keys()), [
+            (3, "en", 1), (3, "en", 2), (4, "af", 1), (4, "af", 2)])
+        # now cached
+        with self.assertNumQueries(0):
+            get_message(4, "af", 2)
+
+    def test_pack_messages(self):
+        messages = get_messages([(3, "en", 1), (4, "af", 1)])
+        with self.assertNumQueries(0):
+            unpacked = unpack_messages(pack_messages(messages))
+        self.assertEqual(sorted(unpacked.keys()), sorted(messages.keys()))
+        message = unpacked[(4, "af", 1)]
+        self.assertEqual(message.pk, 3)
+        self.assertEqual(message.content, "Message 1 in af on baby1")
+
+    def test_invalidated_on_save(self):
+        get_message(3, "en", 1)
+        message = Message.objects.get(pk=1)
+        message.content = "Updated"
+        message.save()
+        self.assertEqual(get_message(3, "en", 1).content, "Updated")
+
+    def test_invalidated_on_delete(self):
+        get_message(3, "en", 1).delete()
+        with self.assertRaises(Message.DoesNotExist):
+            get_message(3, "en", 1)
+
+
+class TestTokenBucket(TestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def mk_bucket(self, rate, capacity=None):
+        return ratelimit.TokenBucket(
+            rate, capacity=capacity, clock=lambda: self.now,
+            sleep=self.slept.append)
+
+    def test_burst_then_wait(self):
+        bucket = self.mk_bucket(2, capacity=2)
+        self.assertEqual(bucket.acquire(), 0)
+        self.assertEqual(bucket.acquire(), 0)
+        self.assertEqual(bucket.acquire(), 0.5)
+        self.assertEqual(bucket.acquire(), 1.0)
+        self.assertEqual(self.slept, [0.5, 1.0])
+
+    def test_refills(self):
+        bucket = self.mk_bucket(2, capacity=2)
+        bucket.acquire(2)
+        self.now += 0.5
+        self.assertEqual(bucket.acquire(), 0)
+        self.assertEqual(bucket.acquire(), 0.5)
+
+    def test_refill_capped_at_capacity(self):
+        bucket = self.mk_bucket(1)
+        self.now += 60
+        self.assertEqual(bucket.acquire(), 0)
+        self.assertEqual(bucket.acquire(), 1.0)
+
+
+class TestSendEngine(TestCase):
+
+    def test_send_all_in_order(self):
+        self.assertEqual(
+            send_all(lambda item: item * 2, [1, 2, 3]),
+            [(1, 2), (2, 4), (3, 6)])
+
+    def test_send_all_concurrent(self):
+        results = send_all(lambda item: item * 2, range(20), workers=4)
+        self.assertEqual(sorted(results), [(i, i * 2) for i in range(20)])
+
+    def test_send_all_error_keeps_results(self):
+        results = []
+        self.assertRaises(
+            ValueError, send_all, self.send_or_fail, range(10),
+            results=results)
+        self.assertEqual(results, [(0, 0), (1, 1), (2, 2)])
+
+    def test_send_all_concurrent_error_keeps_results(self):
+        results = []
+        self.assertRaises(
+            ValueError, send_all, self.send_or_fail, range(10), workers=4,
+            results=results)
+        # sends already in flight are recorded, the failed one is not
+        self.assertFalse(3 in [item for item, _ in results])
+        self.assertTrue(all(item == result for item, result in results))
+
+    def send_or_fail(self, item):
+        if item == 3:
+            raise ValueError("bad item")
+        return item
+
+
+class TestRateLimitSettings(TestCase):
+
+    def setUp(self):
+        self.original = (settings.VUMI_GO_RATE_LIMITS,
+                         settings.VUMI_GO_RATE_LIMIT_REDIS_URL)
+        settings.VUMI_GO_RATE_LIMITS = {"limited": 5}
+        settings.VUMI_GO_RATE_LIMIT_REDIS_URL = None
+        ratelimit._buckets.clear()
+
+    def tearDown(self):
+        (settings.VUMI_GO_RATE_LIMITS,
+         settings.VUMI_GO_RATE_LIMIT_REDIS_URL) = self.original
+        ratelimit._buckets.clear()
+
+    def test_unlimited(self):
+        self.assertEqual(ratelimit.get_bucket("unlimited"), None)
+        self.assertEqual(ratelimit.acquire("unlimited"), 0)
+
+    def test_limited(self):
+        bucket = ratelimit.get_bucket("limited")
+        self.assertEqual(bucket.rate, 5)
+        self.assertEqual(bucket.capacity, 5)
+        self.assertTrue(ratelimit.get_bucket("limited") is bucket)
+
+    def test_batch_time_limits(self):
+        self.assertEqual(ratelimit.slowest_rate(), 5)
+        # a second a send plus the wait for 100 tokens at 5 a second
+        self.assertEqual(batch_time_limits(100), (120, 180))
+        settings.VUMI_GO_RATE_LIMITS = {}
+        self.assertEqual(ratelimit.slowest_rate(), None)
+        self.assertEqual(batch_time_limits(100), (100, 160))
+        self.assertTrue(
+            send_message_batch.soft_time_limit <
+            send_message_batch.time_limit)
+
 
 class RecordingAdapter(TestAdapter):
 
@@ -376,6 +1416,40 @@ class TestHttpApiSender(TestCase):
             headers={"Authorization": u'Basic YWNjLWtleTpjb252LXRva2Vu'})
 
 
+class TimingOutSender(LoggingSender):
+    """ Raises `exc_class`, the soft time limit by default, after sending
+        `sends` messages, and notes how many ledger rows there were at
+        each send
+    """
+
+    def __init__(self, logger, sends, exc_class=SoftTimeLimitExceeded):
+        super(TimingOutSender, self).__init__(logger)
+        self.sends = sends
+        self.exc_class = exc_class
+        self.ledger_counts = []
+
+    def send_text(self, to_addr, content):
+        if not self.sends:
+            raise self.exc_class()
+        self.sends -= 1
+        self.ledger_counts.append(SendLedgerEntry.objects.count())
+        return super(TimingOutSender, self).send_text(to_addr, content)
+
+
+class ConnectionErrorSender(LoggingSender):
+    """ Can't connect to Vumi to send to `to_addr` """
+
+    def __init__(self, logger, to_addr):
+        super(ConnectionErrorSender, self).__init__(logger)
+        self.to_addr = to_addr
+
+    def send_text(self, to_addr, content):
+        if to_addr == self.to_addr:
+            raise ConnectionError()
+        return super(ConnectionErrorSender, self).send_text(
+            to_addr, content)
+
+
 class RecordingHandler(logging.Handler):
 
     """ Record logs. """
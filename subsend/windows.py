@@ -0,0 +1,37 @@
+import hashlib
+
+
+# slot_offset worked out in SQL for a subscription_subscription row `s`
+SLOT_OFFSET_SQL = \
+    "(('x' || substr(md5(s.to_addr), 1, 8))::bit(32)::bigint %% %s)"
+
+
+def slot_offset(to_addr, seconds):
+    """ How many seconds into a window of `seconds` a number is sent. Worked
+        out from the number alone so it is the same every run, and the same
+        as SLOT_OFFSET_SQL so slots can be claimed in one statement.
+    """
+    return int(hashlib.md5(to_addr.encode("utf-8")).hexdigest()[:8], 16) % \
+        seconds
+
+
+def split_rows(rows, batch_size, group=None):
+    """ Splits rows into batches of at most `batch_size`, keeping rows
+        that `group` gives different values for in different batches
+    """
+    groups = {}
+    for row in rows:
+        groups.setdefault(group(row) if group else None, []).append(row)
+    return [
+        groups[key][start:start + batch_size] for key in sorted(groups)
+        for start in range(0, len(groups[key]), batch_size)]
+
+
+def window_slot(offset, minutes, slot_size=300):
+    """ The (window seconds, start, end) of the slot starting `offset`
+        seconds into a window of `minutes`, for claim_subscription_rows.
+        The last slot has no end so it takes every number left.
+    """
+    seconds = minutes * 60
+    end = offset + slot_size
+    return seconds, offset, end if end < seconds else None